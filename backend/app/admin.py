@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Category, Product, Rating, Order, OrderItem, Cart, CartItem, PrivacyPolicy, FAQ, Contact, Slider, Coupon
+from .models import User, Category, Product, Rating, Order, OrderItem, Cart, CartItem, PrivacyPolicy, FAQ, Contact, Slider, Coupon, deferred_order_totals
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 
@@ -122,6 +122,11 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
     list_editable = ("status",)
 
+    def save_related(self, request, form, formsets, change):
+        # Recompute the order total once for all inline item changes
+        with deferred_order_totals():
+            super().save_related(request, form, formsets, change)
+
 
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ("order", "product", "quantity", "price", "get_subtotal")
@@ -8,7 +8,10 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
 from django.db import transaction
-from .models import Order, Product, User
+from .models import Order, User
+from .authentication import AccessToken, access_token_response, revocations
+from .cart_ops import merge_into_order, session_cart_quantities
+from .stock import InsufficientStock
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
@@ -32,12 +35,30 @@ class CustomAuthToken(ObtainAuthToken):
             'email': user.email,
             'first_name': user.first_name,
             'last_name': user.last_name,
+            **access_token_response(user),
         })
 
+class RefreshAccessTokenView(APIView):
+    """Trade the long-lived token from login for a new signed access token"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        key = request.data.get('refresh')
+        if not key:
+            return Response({"detail": "refresh is required."}, status=status.HTTP_400_BAD_REQUEST)
+        token = Token.objects.select_related('user').filter(key=key).first()
+        if token is None or not token.user.is_active:
+            return Response({"detail": "Invalid refresh token."}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(access_token_response(token.user))
+
 class LogoutView(APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
+        if isinstance(request.auth, AccessToken):
+            revocations.revoke(request.auth)
+
         # Allow logout by token or user_id
         user_id = request.data.get('user_id')
         token_key = request.data.get('token')
@@ -87,15 +108,14 @@ def sync_cart_on_login(sender, request, user, **kwargs):
             }
         )
         
-        # Add session cart items to the user's order
-        for product_id, item_data in cart.items():
-            try:
-                product = Product.objects.get(id=product_id)
-                quantity = item_data.get('quantity', 1)
-                pending_order.add_product(product, quantity)
-            except Product.DoesNotExist:
-                continue
-                
+        # Add session cart items to the user's order in bulk; unknown products are skipped.
+        # A pending order reserved at checkout must take the added units from
+        # stock, and if they are short the session cart is kept as it is.
+        try:
+            merge_into_order(pending_order, session_cart_quantities(cart))
+        except InsufficientStock:
+            return
+
         # Clear the session cart
         request.session['cart'] = {}
         request.session.modified = True
\ No newline at end of file
@@ -0,0 +1,265 @@
+import secrets
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core import signing
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from .cache import MISSING, create_backend, invalidate_on_commit
+from .models import User
+
+# User columns kept per cached token: permission flags and the profile
+# served by /api/users/me/. Any other field (notably the password hash) is
+# loaded on first access.
+SNAPSHOT_FIELDS = (
+    "id", "username", "first_name", "last_name", "email", "gender", "phone", "address",
+    "profile_picture", "profile_picture_variants", "is_active", "is_staff", "is_superuser",
+    "created_at", "updated_at",
+)
+
+
+def partial_user(values):
+    """
+    A User holding only the given {attname: value} columns. The others are
+    deferred: they load on first access, and save() only writes loaded fields.
+    """
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(User.objects.db, names, [values[name] for name in names])
+
+
+class TokenCache:
+    """
+    Token key -> slim user snapshot, so authenticated requests skip the
+    Token JOIN User query.
+
+    Entries are dropped when the token is deleted (logout, account deletion)
+    and when the user is saved (password change, profile edits, deactivation),
+    and expire after AUTH_TOKEN_CACHE_TIMEOUT seconds in any case. A reverse
+    user -> token key entry finds the token to drop on user saves without a
+    query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+        self._config = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        # Counted here rather than by the backend, which also sees the
+        # reverse lookups made by invalidations
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def get_config(self):
+        return (
+            getattr(settings, "AUTH_TOKEN_CACHE_BACKEND", "app.cache.LocalMemoryBackend"),
+            getattr(settings, "AUTH_TOKEN_CACHE_TIMEOUT", 60),
+            getattr(settings, "AUTH_TOKEN_CACHE_MAX_ENTRIES", 10000),
+        )
+
+    @property
+    def backend(self):
+        config = self.get_config()
+        if self._backend is None or self._config != config:
+            with self._lock:
+                if self._backend is None or self._config != config:
+                    path, timeout, max_entries = config
+                    self._backend = create_backend(
+                        path, timeout=timeout, max_entries=max_entries, key_prefix="vendora:auth"
+                    )
+                    self._config = config
+        return self._backend
+
+    @staticmethod
+    def fields():
+        """Snapshot fields in model order, as User.from_db expects"""
+        return [field for field in User._meta.concrete_fields if field.attname in SNAPSHOT_FIELDS]
+
+    def get(self, key):
+        """(user, token) for a cached token key, or None"""
+        values = self.backend.get(f"token:{key}")
+        with self._lock:
+            if values is MISSING:
+                self.misses += 1
+                return None
+            self.hits += 1
+        user = partial_user(dict(zip((field.attname for field in self.fields()), values)))
+        token = Token(key=key, user=user)
+        token._state.adding = False
+        return user, token
+
+    def store(self, key, user):
+        # Column values as stored, e.g. the file name rather than a FieldFile
+        values = [field.get_prep_value(getattr(user, field.attname)) for field in self.fields()]
+        self.backend.set(f"token:{key}", values)
+        self.backend.set(f"user:{user.pk}", key)
+
+    def invalidate_token(self, key):
+        self.backend.delete(f"token:{key}")
+
+    def invalidate_user(self, user_id):
+        key = self.backend.get(f"user:{user_id}")
+        if key is not MISSING:
+            self.backend.delete_many([f"token:{key}", f"user:{user_id}"])
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+        stats["backend"] = self.backend.stats()
+        return stats
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that answers from token_cache and falls back to the database"""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.store(key, user)
+            return user, token
+
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return user, token
+
+
+# Signed access tokens. The payload is [user id, is_staff, issued at (ms),
+# expires at (s), token id], signed with SECRET_KEY.
+ACCESS_TOKEN_SALT = "app.authentication.access"
+
+AccessToken = namedtuple("AccessToken", ["user_id", "is_staff", "issued_at", "expires_at", "jti"])
+
+
+def get_access_token_lifetime():
+    return getattr(settings, "ACCESS_TOKEN_LIFETIME", 300)
+
+
+def issue_access_token(user):
+    """A signed access token for user, valid for ACCESS_TOKEN_LIFETIME seconds"""
+    now = time.time()
+    payload = [user.pk, int(user.is_staff), int(now * 1000), int(now) + get_access_token_lifetime(), secrets.token_urlsafe(6)]
+    return signing.dumps(payload, salt=ACCESS_TOKEN_SALT)
+
+
+def access_token_response(user):
+    """Response fields handing out an access token, merged into login responses"""
+    return {
+        "access": issue_access_token(user),
+        "access_expires_in": get_access_token_lifetime(),
+        "token_type": "Bearer",
+    }
+
+
+def read_access_token(value):
+    """Verify a signed access token, raising AuthenticationFailed if it is forged, malformed or expired"""
+    try:
+        token = AccessToken(*signing.loads(value, salt=ACCESS_TOKEN_SALT))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise exceptions.AuthenticationFailed("Invalid access token.")
+    if token.expires_at <= time.time():
+        raise exceptions.AuthenticationFailed("Access token has expired.")
+    return token
+
+
+class AccessTokenRevocations:
+    """
+    Access tokens that must stop working before they expire.
+
+    Single tokens are revoked by id, and all tokens of a user issued up to a
+    point in time (e.g. when the refresh token is deleted) by user id.
+    Entries only need to outlive the tokens they cover, so they expire after
+    ACCESS_TOKEN_LIFETIME. They are kept in Django's default cache so a
+    revocation reaches every API node; "check --deploy" fails when that cache
+    is process-local.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+        self._config = None
+
+    def get_config(self):
+        return (
+            getattr(settings, "ACCESS_TOKEN_REVOCATION_BACKEND", "app.cache.SharedCacheBackend"),
+            get_access_token_lifetime(),
+            getattr(settings, "ACCESS_TOKEN_REVOCATION_MAX_ENTRIES", 100000),
+        )
+
+    @property
+    def backend(self):
+        config = self.get_config()
+        if self._backend is None or self._config != config:
+            with self._lock:
+                if self._backend is None or self._config != config:
+                    path, timeout, max_entries = config
+                    self._backend = create_backend(
+                        path, timeout=timeout, max_entries=max_entries, key_prefix="vendora:revoked"
+                    )
+                    self._config = config
+        return self._backend
+
+    def revoke(self, token):
+        self.backend.set(f"jti:{token.jti}", True)
+
+    def revoke_user(self, user_id):
+        self.backend.set(f"user:{user_id}", int(time.time() * 1000))
+
+    def is_revoked(self, token):
+        if self.backend.get(f"jti:{token.jti}") is not MISSING:
+            return True
+        revoked_at = self.backend.get(f"user:{token.user_id}")
+        return revoked_at is not MISSING and token.issued_at <= revoked_at
+
+    def clear(self):
+        self.backend.clear()
+
+
+revocations = AccessTokenRevocations()
+
+
+class SignedAccessTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates "Authorization: Bearer <access token>" without queries.
+
+    request.user only has id, is_staff and is_active loaded; other fields
+    load on first access. request.auth is the AccessToken.
+    """
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid access token header.")
+        try:
+            value = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid access token header.")
+
+        token = read_access_token(value)
+        if revocations.is_revoked(token):
+            raise exceptions.AuthenticationFailed("Access token has been revoked.")
+        user = partial_user({"id": token.user_id, "is_staff": bool(token.is_staff), "is_active": True})
+        return user, token
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,311 @@
+import bisect
+import heapq
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Count
+from .models import Category, Product
+
+_WORD_RE = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text):
+    """Lowercase, accent-free alphanumeric words"""
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return _WORD_RE.findall(text)
+
+
+class PrefixIndex:
+    """
+    Typeahead index over short labels.
+
+    Distinct tokens are kept in one sorted array, so the tokens starting
+    with a prefix form a contiguous run found with bisect. Each token maps
+    to the set of entry ids containing it. Every query word must prefix-match
+    a token of the entry, and matches are ranked by score. Results for
+    repeated prefixes are answered from a small LRU cleared on every change.
+    The number of entries is capped; when full, the lowest scored entry is
+    evicted. A min-heap of (score, id) finds it; superseded heap items are
+    skipped when they surface and purged when they outnumber the entries.
+    """
+
+    def __init__(self, max_entries=50000, cache_size=2048):
+        self.max_entries = max_entries
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._tokens = []
+        self._postings = {}
+        self._entries = {}
+        self._heap = []
+        self._cache = OrderedDict()
+        self.queries = 0
+        self.cache_hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add_token(self, token, entry_id):
+        ids = self._postings.get(token)
+        if ids is None:
+            self._postings[token] = ids = set()
+            bisect.insort(self._tokens, token)
+        ids.add(entry_id)
+
+    def _remove_token(self, token, entry_id):
+        ids = self._postings.get(token)
+        if ids is None:
+            return
+        ids.discard(entry_id)
+        if not ids:
+            del self._postings[token]
+            i = bisect.bisect_left(self._tokens, token)
+            if i < len(self._tokens) and self._tokens[i] == token:
+                del self._tokens[i]
+
+    def _discard(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry:
+            for token in entry["tokens"]:
+                self._remove_token(token, entry_id)
+
+    def _lowest(self):
+        """(score, entry_id) of the lowest scored entry, dropping stale heap items"""
+        heap = self._heap
+        while heap:
+            score, entry_id = heap[0]
+            entry = self._entries.get(entry_id)
+            if entry is not None and entry["score"] == score:
+                return score, entry_id
+            heapq.heappop(heap)
+        return None
+
+    def _push(self, entry_id, score):
+        heapq.heappush(self._heap, (score, entry_id))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(entry["score"], i) for i, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def upsert(self, entry_id, label, score=0.0, **data):
+        """Add or replace an entry"""
+        tokens = tuple(sorted(set(tokenize(label))))
+        with self._lock:
+            self._discard(entry_id)
+            self._cache.clear()
+            if not tokens:
+                return
+            if len(self._entries) >= self.max_entries:
+                lowest = self._lowest()
+                if lowest is None or lowest[0] >= score:
+                    return
+                heapq.heappop(self._heap)
+                self._discard(lowest[1])
+                self.evictions += 1
+            self._entries[entry_id] = {"id": entry_id, "label": label, "score": score, "tokens": tokens, **data}
+            self._push(entry_id, score)
+            for token in tokens:
+                self._add_token(token, entry_id)
+
+    def load(self, items):
+        """
+        Bulk-build from (entry_id, label, score, data) tuples, replacing the
+        current contents. Only the highest scored max_entries are kept.
+        """
+        entries = {}
+        postings = {}
+        for entry_id, label, score, data in heapq.nlargest(self.max_entries, items, key=lambda item: item[2]):
+            tokens = tuple(sorted(set(tokenize(label))))
+            if not tokens:
+                continue
+            entries[entry_id] = {"id": entry_id, "label": label, "score": score, "tokens": tokens, **data}
+            for token in tokens:
+                postings.setdefault(token, set()).add(entry_id)
+        with self._lock:
+            self._entries = entries
+            self._postings = postings
+            self._tokens = sorted(postings)
+            self._heap = [(entry["score"], i) for i, entry in entries.items()]
+            heapq.heapify(self._heap)
+            self._cache.clear()
+
+    def score_of(self, entry_id, default=0.0):
+        entry = self._entries.get(entry_id)
+        return entry["score"] if entry else default
+
+    def remove(self, entry_id):
+        with self._lock:
+            self._discard(entry_id)
+            self._cache.clear()
+
+    def clear(self):
+        with self._lock:
+            self._tokens = []
+            self._postings = {}
+            self._entries = {}
+            self._heap = []
+            self._cache.clear()
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        i = bisect.bisect_left(self._tokens, prefix)
+        tokens = self._tokens
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            ids |= self._postings[tokens[i]]
+            i += 1
+        return ids
+
+    def search(self, query, limit=10):
+        """Top entries by score whose tokens are prefixed by every query word"""
+        words = tokenize(query)
+        key = (" ".join(words), limit)
+        with self._lock:
+            self.queries += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+            if not words:
+                return []
+
+            # Intersect starting from the most selective word
+            candidates = None
+            for ids in sorted((self._prefix_ids(word) for word in words), key=len):
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    break
+
+            entries = self._entries
+            top = heapq.nsmallest(
+                limit, candidates or (), key=lambda i: (-entries[i]["score"], entries[i]["label"])
+            )
+            results = [
+                {k: v for k, v in entries[i].items() if k not in ("tokens", "score")} for i in top
+            ]
+            self._cache[key] = results
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return results
+
+    def memory_bytes(self):
+        """Approximate size of the index structures"""
+        with self._lock:
+            size = sys.getsizeof(self._tokens) + sys.getsizeof(self._postings) + sys.getsizeof(self._entries)
+            size += sum(sys.getsizeof(t) + sys.getsizeof(ids) for t, ids in self._postings.items())
+            size += sum(sys.getsizeof(e) + sys.getsizeof(e["label"]) for e in self._entries.values())
+            return size
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "tokens": len(self._tokens),
+            "memory_bytes": self.memory_bytes(),
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "evictions": self.evictions,
+        }
+
+
+def product_score(product):
+    """Popularity used to rank suggestions"""
+    return float(product.average_rating or 0)
+
+
+def product_data(product):
+    """Extra fields returned with each product suggestion"""
+    return {"category": product.category.name, "image_url": product.image_url}
+
+
+class ProductAutocomplete:
+    """Product and category name indexes, built on first use and patched from signals"""
+
+    def __init__(self):
+        self._build_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop the indexes; the next query rebuilds them"""
+        self.built = False
+        self.build_seconds = None
+        self.products = None
+        self.categories = None
+
+    def build(self):
+        max_entries = getattr(settings, "AUTOCOMPLETE_MAX_PRODUCTS", 50000)
+        start = time.perf_counter()
+        products = PrefixIndex(max_entries=max_entries)
+        categories = PrefixIndex(max_entries=max_entries)
+        queryset = Product.objects.select_related("category").only(
+            "id", "name", "image", "average_rating", "category__id", "category__name"
+        )
+        products.load(
+            (product.id, product.name, product_score(product), product_data(product))
+            for product in queryset.iterator(chunk_size=2000)
+        )
+        categories.load(
+            (category.id, category.name, category.product_count, {})
+            for category in Category.objects.annotate(product_count=Count("products"))
+        )
+        self.products, self.categories = products, categories
+        self.build_seconds = round(time.perf_counter() - start, 3)
+        self.built = True
+
+    def ensure_built(self):
+        if not self.built:
+            with self._build_lock:
+                if not self.built:
+                    self.build()
+
+    def suggest(self, query, limit=10):
+        self.ensure_built()
+        return {
+            "products": self.products.search(query, limit),
+            "categories": self.categories.search(query, limit),
+        }
+
+    def product_changed(self, product):
+        if self.built:
+            self.products.upsert(product.id, product.name, product_score(product), **product_data(product))
+
+    def refresh_products(self, product_ids):
+        """Re-read products changed by queryset UPDATEs"""
+        if self.built:
+            queryset = Product.objects.filter(id__in=list(product_ids)).select_related("category").only(
+                "id", "name", "image", "average_rating", "category__id", "category__name"
+            )
+            for product in queryset:
+                self.product_changed(product)
+
+    def product_deleted(self, product_id):
+        if self.built:
+            self.products.remove(product_id)
+
+    def category_changed(self, category):
+        if self.built:
+            self.categories.upsert(category.id, category.name, self.categories.score_of(category.id))
+            # Product suggestions carry the category name
+            for product in category.products.only("id", "name", "image", "average_rating"):
+                product.category = category
+                self.product_changed(product)
+
+    def category_deleted(self, category_id):
+        if self.built:
+            self.categories.remove(category_id)
+
+    def stats(self):
+        if not self.built:
+            return {"built": False}
+        return {
+            "built": True,
+            "build_seconds": self.build_seconds,
+            "products": self.products.stats(),
+            "categories": self.categories.stats(),
+        }
+
+
+autocomplete = ProductAutocomplete()
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Returned by get() on a miss, so None can be cached like any other value
+MISSING = object()
+
+
+class CacheBackend:
+    """
+    Minimal key/value cache interface with hit and miss counters.
+
+    Subclasses implement _get/_set/_delete/_clear; the public methods keep
+    the counters so every backend reports them the same way.
+    """
+
+    def __init__(self, timeout=300, **options):
+        self.timeout = timeout
+        self._counter_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self.hits = 0
+            self.misses = 0
+            self.sets = 0
+            self.deletes = 0
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get(self, key):
+        value = self._get(key)
+        self._count("misses" if value is MISSING else "hits")
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+        self._count("sets")
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self._delete(keys)
+            self._count("deletes", len(keys))
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def clear(self):
+        self._clear()
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def _delete(self, keys):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._counter_lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.__class__.__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "sets": self.sets,
+                "deletes": self.deletes,
+            }
+
+
+class LocalMemoryBackend(CacheBackend):
+    """
+    Per-process LRU cache with a TTL.
+
+    Values are stored as-is, not copied, so callers must not mutate what
+    they put in or get out.
+    """
+
+    def __init__(self, timeout=300, max_entries=10000, **options):
+        super().__init__(timeout=timeout)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.evictions = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        expires = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def _delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def _clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update(entries=len(self._data), max_entries=self.max_entries, evictions=self.evictions)
+        return stats
+
+
+class SharedCacheBackend(CacheBackend):
+    """
+    Stores entries in one of Django's CACHES (e.g. Redis or Memcached), so
+    every worker process sees the same values. Keys are namespaced with
+    key_prefix; clear() only forgets keys this process wrote.
+    """
+
+    def __init__(self, timeout=300, alias="default", key_prefix="vendora", **options):
+        super().__init__(timeout=timeout)
+        self.alias = alias
+        self.key_prefix = key_prefix
+        self._written = set()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, key):
+        return f"{self.key_prefix}:{key}"
+
+    def _get(self, key):
+        return self.cache.get(self._key(key), MISSING)
+
+    def _set(self, key, value):
+        self.cache.set(self._key(key), value, self.timeout or None)
+        self._written.add(key)
+
+    def _delete(self, keys):
+        self.cache.delete_many([self._key(key) for key in keys])
+        self._written.difference_update(keys)
+
+    def _clear(self):
+        self._delete(list(self._written))
+
+
+def create_backend(path, **options):
+    """Instantiate a backend from its dotted path"""
+    return import_string(path)(**options)
+
+
+def invalidate_on_commit(func, *args):
+    """
+    Drop entries now and again after commit, so a request that read the old
+    rows before the commit cannot put them back.
+    """
+    func(*args)
+    transaction.on_commit(lambda: func(*args), robust=True)
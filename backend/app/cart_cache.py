@@ -0,0 +1,82 @@
+import threading
+from django.conf import settings
+from .cache import MISSING, create_backend, invalidate_on_commit
+from .models import CartItem
+
+# Product columns that appear in a cached cart, or that it must be refreshed for
+CART_PRODUCT_FIELDS = {"name", "price", "image", "image_variants", "stock"}
+
+
+class CartCache:
+    """
+    Serialized carts (items and total) keyed by user id.
+
+    CartViewSet writes through after every mutation, so reads normally never
+    touch the database. Entries are dropped when a product in the cart
+    changes, since its price, name or stock shows up in the payload, both
+    right away and again after commit. Changes made outside the cart API
+    (e.g. in the admin) are picked up when the entry expires after
+    CART_CACHE_TIMEOUT seconds. Only app.cache.SharedCacheBackend makes
+    write-throughs and invalidations visible to every worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+        self._config = None
+
+    def get_config(self):
+        return (
+            getattr(settings, "CART_CACHE_BACKEND", "app.cache.SharedCacheBackend"),
+            getattr(settings, "CART_CACHE_TIMEOUT", 300),
+            getattr(settings, "CART_CACHE_MAX_ENTRIES", 10000),
+        )
+
+    @property
+    def backend(self):
+        config = self.get_config()
+        if self._backend is None or self._config != config:
+            with self._lock:
+                if self._backend is None or self._config != config:
+                    path, timeout, max_entries = config
+                    self._backend = create_backend(
+                        path, timeout=timeout, max_entries=max_entries, key_prefix="vendora:cart"
+                    )
+                    self._config = config
+        return self._backend
+
+    @staticmethod
+    def key(user_id):
+        return f"cart:{user_id}"
+
+    def get(self, user_id):
+        """The cached payload for a user, or None"""
+        payload = self.backend.get(self.key(user_id))
+        return None if payload is MISSING else payload
+
+    def store(self, user_id, payload):
+        self.backend.set(self.key(user_id), payload)
+
+    def invalidate_users(self, user_ids):
+        self.backend.delete_many(self.key(user_id) for user_id in set(user_ids))
+
+    def invalidate_users_on_commit(self, user_ids):
+        invalidate_on_commit(self.invalidate_users, list(user_ids))
+
+    def invalidate_products(self, product_ids):
+        """Drop the carts holding any of these products, now and after commit"""
+        user_ids = (
+            CartItem.objects.filter(product_id__in=list(product_ids))
+            .values_list("cart__user_id", flat=True)
+            .distinct()
+        )
+        self.invalidate_users_on_commit(user_ids)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+cart_cache = CartCache()
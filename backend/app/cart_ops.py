@@ -0,0 +1,175 @@
+from django.db import transaction
+from .models import CartItem, OrderItem, Product
+from .stock import sync_order_line_stock
+
+# Upper bound on operations accepted by one batch request
+MAX_BATCH_OPERATIONS = 200
+
+
+class CartBatchError(Exception):
+    """Raised when a batch of cart operations is rejected; nothing is applied"""
+
+
+def parse_operations(operations):
+    """
+    Validate [{"product_id": ..., "quantity": ...}, ...] into {product_id: quantity}.
+
+    quantity is the new quantity of the line, 0 removes it. A product listed
+    more than once takes its last quantity, as if the edits were replayed in
+    order.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError("operations must be a non-empty list")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise CartBatchError(f"At most {MAX_BATCH_OPERATIONS} operations are allowed per batch")
+
+    quantities = {}
+    for index, operation in enumerate(operations):
+        try:
+            product_id = int(operation["product_id"])
+            quantity = int(operation.get("quantity", 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CartBatchError(f"Operation {index} needs an integer product_id and quantity")
+        if quantity < 0:
+            raise CartBatchError(f"Operation {index}: quantity cannot be negative")
+        quantities[product_id] = quantity
+    return quantities
+
+
+def apply_cart_operations(cart, operations):
+    """
+    Apply a batch of quantity changes to a cart in one transaction.
+
+    All products are fetched with one id__in query and validated before
+    anything is written. Lines set to zero are removed with one DELETE and
+    the rest are written with one INSERT ... ON CONFLICT upsert.
+    """
+    quantities = parse_operations(operations)
+
+    products = Product.objects.only("id", "name", "stock").in_bulk(list(quantities))
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            raise CartBatchError(f"Product {product_id} not found")
+        if product.stock < quantity:
+            raise CartBatchError(f"Not enough stock for {product.name}. Available: {product.stock}")
+
+    removed = [product_id for product_id, quantity in quantities.items() if quantity == 0]
+    upserts = [
+        CartItem(cart=cart, product_id=product_id, quantity=quantity)
+        for product_id, quantity in quantities.items()
+        if quantity > 0
+    ]
+    with transaction.atomic():
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        if upserts:
+            CartItem.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity", "updated_at"],
+            )
+
+
+def merge_quantities(current, incoming):
+    """
+    Diff two {product_id: quantity} maps in memory.
+
+    Returns {product_id: quantity} for every line that has to be written:
+    products in both maps get the sum, products only in incoming are new.
+    """
+    return {
+        product_id: current.get(product_id, 0) + quantity
+        for product_id, quantity in incoming.items()
+        if quantity > 0
+    }
+
+
+def merge_carts(source, target):
+    """
+    Move every line of source into target and delete source.
+
+    Quantities of products in both carts are summed. Both item sets are read
+    with one query each and the result is written with a single upsert, so
+    the cost does not depend on the number of lines.
+    """
+    if source.pk == target.pk:
+        raise CartBatchError("Cannot merge a cart into itself")
+
+    with transaction.atomic():
+        incoming = dict(CartItem.objects.filter(cart=source).values_list("product_id", "quantity"))
+        if incoming:
+            current = dict(
+                CartItem.objects.filter(cart=target, product_id__in=list(incoming)).values_list(
+                    "product_id", "quantity"
+                )
+            )
+            merged = merge_quantities(current, incoming)
+            CartItem.objects.bulk_create(
+                [CartItem(cart=target, product_id=product_id, quantity=quantity) for product_id, quantity in merged.items()],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity", "updated_at"],
+            )
+        source.delete()
+
+
+def session_cart_quantities(session_cart):
+    """
+    {product_id: quantity} from a session cart of {"<id>": {"quantity": n}}.
+
+    Unparseable entries are skipped and quantities below one count as one,
+    like Order.add_product.
+    """
+    quantities = {}
+    for product_id, item in session_cart.items():
+        try:
+            product_id = int(product_id)
+            quantity = int((item or {}).get("quantity") or 1)
+        except (TypeError, ValueError, AttributeError):
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + max(quantity, 1)
+    return quantities
+
+
+def merge_into_order(order, quantities):
+    """
+    Add {product_id: quantity} to an order's items with a constant number of queries.
+
+    Products are fetched with one id__in query (unknown ids are skipped),
+    existing lines are raised with one bulk UPDATE, new lines are inserted
+    with one bulk INSERT, and the order total is recomputed once. If the
+    order already holds its stock, the added units are reserved too, or
+    InsufficientStock is raised with nothing changed.
+    """
+    products = Product.objects.only("id", "price").in_bulk(list(quantities))
+    if not products:
+        return
+
+    existing = {}
+    for item in OrderItem.objects.filter(order=order, product_id__in=list(products)).order_by("id"):
+        existing.setdefault(item.product_id, item)
+
+    changed = []
+    created = []
+    for product_id, quantity in quantities.items():
+        if product_id not in products:
+            continue
+        item = existing.get(product_id)
+        if item:
+            item.quantity += quantity
+            changed.append(item)
+        else:
+            created.append(
+                OrderItem(order=order, product_id=product_id, quantity=quantity, price=products[product_id].price or 0)
+            )
+
+    # The bulk writes skip OrderItem.save, so the total is recomputed here once
+    with transaction.atomic():
+        if changed:
+            OrderItem.objects.bulk_update(changed, ["quantity"])
+        if created:
+            OrderItem.objects.bulk_create(created)
+        sync_order_line_stock(order.pk)
+        order.update_total()
@@ -3,13 +3,40 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from django.db import transaction
 import logging
-from .models import Cart, CartItem, Product, Order, OrderItem
+from .models import Cart, CartItem, Product
 from .serializers import CartSerializer, CartItemSerializer
+from .checkout import checkout_cart, CheckoutError
+from .cart_cache import cart_cache
+from .cart_ops import CartBatchError, apply_cart_operations, merge_carts
 
 logger = logging.getLogger(__name__)
 
+
+def load_cart(user):
+    """
+    The user's cart with its items and their products, from one joined query.
+
+    The items are attached as cart.loaded_items, the list a
+    Prefetch("items", to_attr="loaded_items") would produce, so serializing
+    the cart and computing its total reuse the loaded rows. Only an empty
+    cart needs a second query, to fetch or create the cart itself.
+    """
+    items = list(
+        CartItem.objects.filter(cart__user=user)
+        .select_related("cart", "product")
+        .defer("product__description")
+    )
+    if items:
+        cart = items[0].cart
+    else:
+        cart, _ = Cart.objects.get_or_create(user=user)
+    for item in items:
+        item.cart = cart
+    cart.loaded_items = items
+    return cart
+
+
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
@@ -22,16 +49,29 @@ class CartViewSet(viewsets.ViewSet):
             logger.error(f"Error getting cart: {str(e)}")
             return None
 
+    def cache_cart(self, request):
+        """Serialize the user's cart and write it through to the cart cache"""
+        cart = load_cart(request.user)
+        data = dict(CartSerializer(cart, context={'request': request}).data)
+        cart_cache.store(request.user.id, data)
+        return data
+
+    def refresh_cache(self, request):
+        """Write-through after a mutation; on failure drop the entry instead"""
+        try:
+            self.cache_cart(request)
+        except Exception as e:
+            logger.error(f"Error caching cart: {str(e)}")
+            cart_cache.invalidate_users([request.user.id])
+
     @action(detail=False, methods=['get'])
     def items(self, request):
         """Get all items in the cart"""
         try:
-            cart = self.get_cart(request)
-            if not cart:
-                return Response({'error': 'Failed to get cart'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data)
+            data = cart_cache.get(request.user.id)
+            if data is None:
+                data = self.cache_cart(request)
+            return Response(data)
         except Exception as e:
             logger.error(f"Error getting cart items: {str(e)}")
             return Response({'error': 'Failed to get cart items'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -64,6 +104,7 @@ class CartViewSet(viewsets.ViewSet):
             cart_item = cart.add_product(product, quantity)
 
             if cart_item:
+                self.refresh_cache(request)
                 serializer = CartItemSerializer(cart_item, context={'request': request})
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response({'error': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
@@ -71,6 +112,33 @@ class CartViewSet(viewsets.ViewSet):
             logger.error(f"Error adding item to cart: {str(e)}")
             return Response({'error': 'Failed to add item to cart'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply several quantity changes at once and return the resulting cart.
+
+        Body: {"operations": [{"product_id": 1, "quantity": 2}, ...]}, where
+        quantity is the new quantity and 0 removes the item. Either every
+        operation is applied or none is.
+        """
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Body must be an object with an operations list'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        cart = self.get_cart(request)
+        if not cart:
+            return Response({'error': 'Failed to get cart'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        try:
+            apply_cart_operations(cart, request.data.get('operations'))
+        except CartBatchError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error applying cart batch: {str(e)}")
+            return Response({'error': 'Failed to update cart'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(self.cache_cart(request))
+
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
         """Remove an item from the cart"""
@@ -92,6 +160,7 @@ class CartViewSet(viewsets.ViewSet):
             
             if cart_item:
                 cart_item.delete()
+                self.refresh_cache(request)
                 return Response({'message': 'Item removed from cart successfully'})
             return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
@@ -130,6 +199,7 @@ class CartViewSet(viewsets.ViewSet):
                 cart_item = CartItem.objects.get(cart=cart, product=product)
                 cart_item.quantity = quantity
                 cart_item.save()
+                self.refresh_cache(request)
                 serializer = CartItemSerializer(cart_item, context={'request': request})
                 return Response(serializer.data)
             except CartItem.DoesNotExist:
@@ -147,6 +217,7 @@ class CartViewSet(viewsets.ViewSet):
                 return Response({'error': 'Failed to get cart'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             cart.items.all().delete()
+            self.refresh_cache(request)
             return Response({'message': 'Cart cleared'})
         except Exception as e:
             logger.error(f"Error clearing cart: {str(e)}")
@@ -174,36 +245,11 @@ class CartViewSet(viewsets.ViewSet):
             if not cart:
                 return Response({'error': 'Failed to get cart'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
-            if not cart.items.exists():
-                return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Check stock availability for all items
-            for cart_item in cart.items.all():
-                if cart_item.product.stock < cart_item.quantity:
-                    return Response({
-                        'error': f'Not enough stock for {cart_item.product.name}. Available: {cart_item.product.stock}'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-            with transaction.atomic():
-                # Create order from cart
-                order = Order.objects.create(
-                    user=request.user,
-                    status='Pending',
-                    shipping_address=request.user.address or '',
-                    total_price=cart.get_total()
-                )
-
-                # Add cart items to order
-                for cart_item in cart.items.all():
-                    OrderItem.objects.create(
-                        order=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        price=cart_item.product.price
-                    )
-
-                # Clear the cart
-                cart.items.all().delete()
+            try:
+                order = checkout_cart(cart, request.user)
+            except CheckoutError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            self.refresh_cache(request)
 
             return Response({
                 'message': 'Order created successfully',
@@ -231,12 +277,19 @@ class CartViewSet(viewsets.ViewSet):
                           status=status.HTTP_403_FORBIDDEN)
 
         current_cart = self.get_cart(request)
-        
-        with transaction.atomic():
-            for cart_item in other_cart.items.all():
-                current_cart.add_product(cart_item.product, cart_item.quantity)
-            
-            # Delete the other cart
-            other_cart.delete()
 
-        return Response({'message': 'Carts merged successfully'})
\ No newline at end of file
+        try:
+            merge_carts(other_cart, current_cart)
+        except CartBatchError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        self.refresh_cache(request)
+        return Response({'message': 'Carts merged successfully'})
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Hit/miss counters of the cart cache"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view cart cache stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response(cart_cache.stats())
@@ -0,0 +1,62 @@
+from decimal import Decimal
+from django.db import transaction
+from .models import CartItem, Order, OrderItem
+from .stock import InsufficientStock, reserve_stock
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be converted into an order"""
+
+
+def checkout_cart(cart, user, shipping_address=None):
+    """
+    Convert a cart into an order with a constant number of queries.
+
+    The cart lines and their products are loaded with one joined query, stock
+    is reserved with one conditional UPDATE, the order items are written with
+    a single bulk INSERT and the cart is emptied with a single DELETE.
+    """
+    with transaction.atomic():
+        lines = list(
+            CartItem.objects.filter(cart=cart).select_related("product")
+        )
+        if not lines:
+            raise CheckoutError("Cart is empty")
+
+        # Take the stock for every line with one conditional UPDATE
+        quantities = {}
+        for line in lines:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+        try:
+            reserve_stock(quantities)
+        except InsufficientStock as e:
+            raise CheckoutError(str(e)) from e
+
+        total = sum((line.product.price * line.quantity for line in lines), Decimal("0"))
+
+        order = Order.objects.create(
+            user=user,
+            status="Pending",
+            shipping_address=shipping_address if shipping_address is not None else user.address or "",
+            total_price=total,
+            stock_reserved=True,
+        )
+
+        # bulk_create skips OrderItem.save, so the total is not recomputed per line
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    product=line.product,
+                    quantity=line.quantity,
+                    reserved_quantity=line.quantity,
+                    price=line.product.price,
+                )
+                for line in lines
+            ]
+        )
+
+        # Clear the cart
+        CartItem.objects.filter(cart=cart).delete()
+
+    return order
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+from .cache import LocalMemoryBackend, SharedCacheBackend
+
+# Django cache backends that keep entries inside one process
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.security, deploy=True)
+def check_access_token_revocations(app_configs, **kwargs):
+    """
+    Revoked access tokens are only rejected by the processes that see the
+    revocation, so with several workers it has to live in a shared cache.
+    """
+    path = getattr(settings, "ACCESS_TOKEN_REVOCATION_BACKEND", "app.cache.SharedCacheBackend")
+    backend = import_string(path)
+    if issubclass(backend, LocalMemoryBackend):
+        return [
+            Error(
+                f"ACCESS_TOKEN_REVOCATION_BACKEND is {path}, which keeps revocations per process.",
+                hint="Use app.cache.SharedCacheBackend with a shared CACHES['default'].",
+                id="app.E001",
+            )
+        ]
+    if issubclass(backend, SharedCacheBackend):
+        cache_backend = settings.CACHES.get("default", {}).get("BACKEND")
+        if cache_backend in PROCESS_LOCAL_CACHES:
+            return [
+                Error(
+                    f"Access token revocations are stored in CACHES['default'] ({cache_backend}), "
+                    "which is not shared between processes.",
+                    hint="Point CACHES['default'] at Redis, Memcached or the database cache.",
+                    id="app.E002",
+                )
+            ]
+    return []
@@ -0,0 +1,96 @@
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    HTTP conditional GET for list and retrieve.
+
+    A validator is derived from the rows the response would be built from:
+    COUNT and MAX(timestamp) over the filtered queryset in one aggregate
+    query. The count changes when rows are added, deleted or leave the
+    filter, the timestamp when any of them is edited. If the client's
+    If-None-Match or If-Modified-Since still matches, a 304 is returned
+    without running the real query or serializing anything; otherwise the
+    response carries ETag and Last-Modified for the next request.
+
+    conditional_related_timestamps lists timestamps of related rows that
+    also appear in the payload (e.g. the category name on a product), so
+    editing them changes the validator too.
+    """
+
+    conditional_timestamp_field = "updated_at"
+    conditional_related_timestamps = ()
+    # Off when the full response is needed regardless of the client's
+    # validators, e.g. to fill a cache
+    evaluate_preconditions = True
+
+    def get_conditional_related_timestamps(self):
+        return self.conditional_related_timestamps
+
+    def get_conditional_queryset(self):
+        """The rows behind the current response, before pagination"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == "retrieve":
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    @staticmethod
+    def is_multi_valued(model, lookup):
+        field = model._meta.get_field(lookup.split("__")[0])
+        return field.one_to_many or field.many_to_many
+
+    def get_validator(self):
+        """(etag, last_modified) for the current request, or None if there is nothing to validate"""
+        related = self.get_conditional_related_timestamps()
+        queryset = self.get_conditional_queryset()
+        aggregates = {
+            # Joins to multi-valued relations repeat rows, so count each once
+            "count": Count("pk", distinct=any(self.is_multi_valued(queryset.model, lookup) for lookup in related)),
+            "modified": Max(self.conditional_timestamp_field),
+        }
+        for index, lookup in enumerate(related):
+            aggregates[f"related_{index}"] = Max(lookup)
+        values = queryset.order_by().aggregate(**aggregates)
+        if self.action == "retrieve" and not values["count"]:
+            # Let retrieve raise the 404
+            return None
+
+        timestamps = [values[name] for name in values if name != "count" and values[name] is not None]
+        last_modified = int(max(timestamps).timestamp()) if timestamps else None
+        request = self.request
+        key = "|".join([
+            self.__class__.__name__,
+            self.action,
+            request.META.get("QUERY_STRING", ""),
+            getattr(request, "accepted_media_type", "") or "",
+            *(str(values[name]) for name in values),
+        ])
+        etag = 'W/"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+        return etag, last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        validator = self.get_validator()
+        if validator is None:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = validator
+        response = None
+        if self.evaluate_preconditions:
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers["ETag"] = quote_etag(etag)
+            if last_modified is not None:
+                response.headers["Last-Modified"] = http_date(last_modified)
+            patch_vary_headers(response, ("Accept",))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,285 @@
+import bisect
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from .models import Category, Product
+
+DIMENSIONS = ("category", "color", "size", "price", "rating", "in_stock")
+
+# Rows kept per product: the facet values plus the keys used for ordering
+ROW_FIELDS = ("id", "name", "price", "created_at", "category_id", "color", "size", "stock", "average_rating")
+
+ORDERINGS = ("name", "price", "created_at")
+
+
+def get_price_bands():
+    """Upper-exclusive band edges, e.g. [25, 50] gives 0-25, 25-50 and 50+"""
+    return [Decimal(str(edge)) for edge in getattr(settings, "FACET_PRICE_BANDS", [25, 50, 100, 200])]
+
+
+def bit_positions(bits):
+    """Indices of the set bits of an int, lowest first"""
+    binary = bin(bits)[:1:-1]
+    positions = []
+    i = binary.find("1")
+    while i != -1:
+        positions.append(i)
+        i = binary.find("1", i + 1)
+    return positions
+
+
+class FacetIndex:
+    """
+    Product facets as bitsets.
+
+    Bit n of every set stands for the product with id n. Each facet value
+    (a category, a color, a price band, ...) owns one int bitset, so
+    combining filters is a handful of big-int ANDs/ORs and each facet count
+    is one popcount. Counts are disjunctive: a dimension's counts apply the
+    filters of every other dimension but not its own, so picking a color
+    still shows how many products the other colors would give.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.price_bands = get_price_bands()
+        self._bits = {dimension: {} for dimension in DIMENSIONS}
+        self._rows = {}
+        self._prices = []
+        self._all = 0
+        self.category_names = {}
+
+    def price_band(self, price):
+        edges = self.price_bands
+        i = bisect.bisect_right(edges, price)
+        low = edges[i - 1] if i else Decimal("0")
+        return f"{low}-{edges[i]}" if i < len(edges) else f"{low}+"
+
+    def values_of(self, row):
+        """Facet values of a product row; rating lists every "N and up" it meets"""
+        rating = float(row["average_rating"] or 0)
+        return {
+            "category": [row["category_id"]],
+            "color": [row["color"]] if row["color"] else [],
+            "size": [row["size"]] if row["size"] else [],
+            "price": [self.price_band(row["price"])],
+            "rating": [n for n in range(1, 5) if rating >= n],
+            "in_stock": [row["stock"] > 0],
+        }
+
+    def _set(self, row, on):
+        bit = 1 << row["id"]
+        for dimension, values in self.values_of(row).items():
+            bitsets = self._bits[dimension]
+            for value in values:
+                if on:
+                    bitsets[value] = bitsets.get(value, 0) | bit
+                else:
+                    remaining = bitsets.get(value, 0) & ~bit
+                    if remaining:
+                        bitsets[value] = remaining
+                    else:
+                        bitsets.pop(value, None)
+        key = (row["price"], row["id"])
+        if on:
+            bisect.insort(self._prices, key)
+            self._all |= bit
+        else:
+            i = bisect.bisect_left(self._prices, key)
+            if i < len(self._prices) and self._prices[i] == key:
+                del self._prices[i]
+            self._all &= ~bit
+
+    def upsert(self, row):
+        with self._lock:
+            old = self._rows.get(row["id"])
+            if old:
+                self._set(old, False)
+            self._rows[row["id"]] = row
+            self._set(row, True)
+
+    def remove(self, product_id):
+        with self._lock:
+            old = self._rows.pop(product_id, None)
+            if old:
+                self._set(old, False)
+
+    def load(self, rows):
+        """Bulk-build from product rows, replacing the current contents"""
+        with self._lock:
+            self.__init__()
+            for row in rows:
+                self._rows[row["id"]] = row
+                bit = 1 << row["id"]
+                for dimension, values in self.values_of(row).items():
+                    bitsets = self._bits[dimension]
+                    for value in values:
+                        bitsets[value] = bitsets.get(value, 0) | bit
+                self._all |= bit
+                self._prices.append((row["price"], row["id"]))
+            self._prices.sort()
+
+    def _price_range_bits(self, min_price, max_price):
+        lo = 0 if min_price is None else bisect.bisect_left(self._prices, (min_price, -1))
+        hi = len(self._prices) if max_price is None else bisect.bisect_right(self._prices, (max_price, float("inf")))
+        bits = 0
+        for _, product_id in self._prices[lo:hi]:
+            bits |= 1 << product_id
+        return bits
+
+    def _dimension_masks(self, filters):
+        """One bitset per filtered dimension; values inside a dimension are ORed"""
+        masks = {}
+        for dimension in ("category", "color", "size", "price"):
+            values = filters.get(dimension)
+            if values:
+                bits = 0
+                for value in values:
+                    bits |= self._bits[dimension].get(value, 0)
+                masks[dimension] = bits
+        if filters.get("min_price") is not None or filters.get("max_price") is not None:
+            range_bits = self._price_range_bits(filters.get("min_price"), filters.get("max_price"))
+            masks["price"] = masks.get("price", self._all) & range_bits
+        if filters.get("rating"):
+            masks["rating"] = self._bits["rating"].get(filters["rating"], 0)
+        if filters.get("in_stock"):
+            masks["in_stock"] = self._bits["in_stock"].get(True, 0)
+        return masks
+
+    def query(self, filters, ordering="name", offset=0, limit=20):
+        """
+        Matching product ids for one page plus the facet counts.
+
+        Returns (total, page_ids, facets).
+        """
+        with self._lock:
+            masks = self._dimension_masks(filters)
+            matched = self._all
+            for bits in masks.values():
+                matched &= bits
+
+            facets = {}
+            for dimension in DIMENSIONS:
+                others = self._all
+                for other, bits in masks.items():
+                    if other != dimension:
+                        others &= bits
+                counts = []
+                for value, bits in self._bits[dimension].items():
+                    count = (bits & others).bit_count()
+                    if count:
+                        counts.append({"value": value, "label": self.label(dimension, value), "count": count})
+                counts.sort(key=lambda c: (-c["count"], str(c["label"])))
+                facets[dimension] = counts
+
+            ids = bit_positions(matched)
+            rows = self._rows
+            field = ordering.lstrip("-")
+            if field not in ORDERINGS:
+                field = "name"
+            if field != "created_at":
+                # Ids already follow creation order
+                ids.sort(key=lambda i: (rows[i][field], i))
+            if ordering.startswith("-"):
+                ids.reverse()
+            return len(ids), ids[offset:offset + limit], facets
+
+    def label(self, dimension, value):
+        if dimension == "category":
+            return self.category_names.get(value, str(value))
+        if dimension == "rating":
+            return f"{value} & up"
+        if dimension == "in_stock":
+            return "In stock" if value else "Out of stock"
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "products": len(self._rows),
+                "values": {dimension: len(values) for dimension, values in self._bits.items()},
+            }
+
+
+class ProductFacets:
+    """The process-wide facet index, built on first use and patched from signals"""
+
+    def __init__(self):
+        self._build_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.index = None
+        self.build_seconds = None
+
+    def build(self):
+        start = time.perf_counter()
+        index = FacetIndex()
+        index.load(Product.objects.values(*ROW_FIELDS).iterator(chunk_size=2000))
+        index.category_names = dict(Category.objects.values_list("id", "name"))
+        self.index = index
+        self.build_seconds = round(time.perf_counter() - start, 3)
+
+    def get_index(self):
+        if self.index is None:
+            with self._build_lock:
+                if self.index is None:
+                    self.build()
+        return self.index
+
+    def refresh_products(self, product_ids):
+        """Re-read changed products, e.g. after a queryset UPDATE"""
+        if self.index is None:
+            return
+        product_ids = set(product_ids)
+        for row in Product.objects.filter(id__in=product_ids).values(*ROW_FIELDS):
+            product_ids.discard(row["id"])
+            self.index.upsert(row)
+        for product_id in product_ids:
+            self.index.remove(product_id)
+
+    def product_changed(self, product):
+        if self.index is None:
+            return
+        if product.get_deferred_fields() & set(ROW_FIELDS):
+            self.refresh_products([product.pk])
+        else:
+            self.index.upsert({field: getattr(product, field) for field in ROW_FIELDS})
+
+    def product_deleted(self, product_id):
+        if self.index is not None:
+            self.index.remove(product_id)
+
+    def category_changed(self, category):
+        if self.index is not None:
+            self.index.category_names[category.id] = category.name
+
+
+def parse_filters(params):
+    """
+    Facet filters from query params.
+
+    category, color, size and price (band labels) may repeat; min_price,
+    max_price, min_rating (1-4) and in_stock take a single value. Raises
+    ValueError for malformed values.
+    """
+    filters = {
+        "category": [int(value) for value in params.getlist("category")],
+        "color": params.getlist("color"),
+        "size": params.getlist("size"),
+        "price": params.getlist("price"),
+    }
+    try:
+        for name in ("min_price", "max_price"):
+            value = params.get(name)
+            filters[name] = Decimal(value) if value not in (None, "") else None
+    except InvalidOperation:
+        raise ValueError("min_price and max_price must be numbers")
+    if params.get("min_rating"):
+        filters["rating"] = int(params["min_rating"])
+    filters["in_stock"] = params.get("in_stock", "").lower() in ("1", "true", "yes")
+    return filters
+
+
+facets = ProductFacets()
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .models import Category, Product, Slider
+from .response_cache import response_cache
+from .serializers import CategorySerializer, ProductSerializer, SliderSerializer
+
+
+class HomeFeed:
+    """
+    The home screen payload (active sliders, categories and the top rated
+    products) materialized in memory.
+
+    The feed is stored with the response cache versions of the models it
+    was built from and rebuilt on the first request after any of them is
+    bumped, so it is never stale and usually costs no queries. Payloads
+    contain absolute URLs, so there is one feed per scheme and host. The Host
+    header comes from the client, so only the HOME_FEED_MAX_HOSTS most
+    recently used feeds are kept. A rebuild holds up only the requests for
+    its own origin, which wait for it rather than building again.
+    """
+
+    models = (Slider, Category, Product)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds = OrderedDict()
+        # Origin -> lock held while its feed is built
+        self._building = {}
+        self.hits = 0
+        self.builds = 0
+        self.evictions = 0
+
+    def get_size(self):
+        return getattr(settings, "HOME_FEED_PRODUCTS", 12)
+
+    def get_max_hosts(self):
+        return getattr(settings, "HOME_FEED_MAX_HOSTS", 8)
+
+    def versions(self):
+        return tuple(response_cache.version(model) for model in self.models) + (self.get_size(),)
+
+    def get(self, request):
+        """(payload, etag) for the current versions, rebuilding if any changed"""
+        origin = request.build_absolute_uri("/")
+        versions = self.versions()
+        feed = self._cached(origin, versions)
+        if feed is not None:
+            return feed
+        with self._lock:
+            building = self._building.setdefault(origin, threading.Lock())
+        # One build per origin at a time, without holding up the others
+        with building:
+            try:
+                # Requests that waited for a rebuild reuse it
+                feed = self._cached(origin, versions)
+                if feed is not None:
+                    return feed
+                feed = (versions, *self.build(request, versions))
+                with self._lock:
+                    self._feeds[origin] = feed
+                    self._feeds.move_to_end(origin)
+                    self.builds += 1
+                    while len(self._feeds) > self.get_max_hosts():
+                        self._feeds.popitem(last=False)
+                        self.evictions += 1
+                return feed[1:]
+            finally:
+                with self._lock:
+                    if self._building.get(origin) is building:
+                        del self._building[origin]
+
+    def _cached(self, origin, versions):
+        """(payload, etag) of the feed for origin if it is current, else None"""
+        with self._lock:
+            feed = self._feeds.get(origin)
+            if feed is None or feed[0] != versions:
+                return None
+            self._feeds.move_to_end(origin)
+            self.hits += 1
+            return feed[1:]
+
+    def build(self, request, versions):
+        context = {"request": request}
+        sliders = Slider.objects.filter(is_active=True).order_by("-created_at")
+        products = ProductSerializer.setup_eager_loading(Product.objects.all()).order_by(
+            "-average_rating", "-rating_count", "-created_at"
+        )[:self.get_size()]
+        payload = {
+            "sliders": list(SliderSerializer(sliders, many=True, context=context).data),
+            "categories": list(CategorySerializer(Category.objects.all(), many=True, context=context).data),
+            "products": list(ProductSerializer(products, many=True, context=context).data),
+        }
+        key = "|".join([request.build_absolute_uri("/"), *map(str, versions)])
+        etag = 'W/"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+        return payload, etag
+
+    def clear(self):
+        with self._lock:
+            self._feeds.clear()
+
+    def stats(self):
+        return {
+            "hosts": len(self._feeds),
+            "max_hosts": self.get_max_hosts(),
+            "hits": self.hits,
+            "builds": self.builds,
+            "evictions": self.evictions,
+        }
+
+
+home_feed = HomeFeed()
@@ -0,0 +1,236 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of each derivative; every preset is stored as WebP
+DEFAULT_PRESETS = {"thumb": 160, "small": 320, "medium": 640, "large": 1280}
+
+
+def get_presets():
+    return getattr(settings, "IMAGE_DERIVATIVE_PRESETS", DEFAULT_PRESETS)
+
+
+def get_quality():
+    return getattr(settings, "IMAGE_WEBP_QUALITY", 80)
+
+
+class DerivativeStats:
+    """Thread-safe generation latency and size counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.images = 0
+            self.failures = 0
+            self.seconds = 0.0
+            self.max_seconds = 0.0
+            self.original_bytes = 0
+            self.preset_bytes = {}
+
+    def generated(self, original_bytes, sizes, elapsed):
+        with self._lock:
+            self.images += 1
+            self.seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            self.original_bytes += original_bytes
+            for preset, size in sizes.items():
+                self.preset_bytes[preset] = self.preset_bytes.get(preset, 0) + size
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "failures": self.failures,
+                "avg_ms": round(self.seconds * 1000 / self.images, 1) if self.images else None,
+                "max_ms": round(self.max_seconds * 1000, 1),
+                "avg_original_bytes": self.original_bytes // self.images if self.images else None,
+                # Average bytes a client downloads per image for each preset
+                "avg_preset_bytes": {
+                    preset: total // self.images for preset, total in self.preset_bytes.items()
+                },
+                "queued": pool.pending(),
+            }
+
+
+stats = DerivativeStats()
+
+
+def derivative_name(source_name, preset, digest):
+    """"products/shoe.png" -> "products/shoe.thumb.<digest>.webp", cacheable forever"""
+    stem, _ = os.path.splitext(source_name)
+    return f"{stem}.{preset}.{digest}.webp"
+
+
+def render_derivatives(source_name):
+    """
+    Write the WebP derivatives of a stored image and return its variants map:
+    {"source": name, "presets": {preset: {"name", "width", "height", "size"}}}.
+
+    Names carry a digest of the original bytes and the preset settings, so a
+    derivative that already exists is never rewritten and a new upload or
+    configuration never reuses an old name.
+    """
+    started = time.perf_counter()
+    with default_storage.open(source_name, "rb") as f:
+        original = f.read()
+    presets = get_presets()
+    quality = get_quality()
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(original)))
+    image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+    variants = {}
+    # Largest first, so each preset is shrunk from the previous one
+    for preset, size in sorted(presets.items(), key=lambda item: -item[1]):
+        digest = hashlib.sha256(original + f"{size}:{quality}".encode()).hexdigest()[:12]
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        name = derivative_name(source_name, preset, digest)
+        if default_storage.exists(name):
+            byte_size = default_storage.size(name)
+        else:
+            buffer = io.BytesIO()
+            image.save(buffer, "WEBP", quality=quality, method=4)
+            byte_size = buffer.tell()
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+        variants[preset] = {"name": name, "width": image.width, "height": image.height, "size": byte_size}
+
+    stats.generated(
+        len(original), {preset: variant["size"] for preset, variant in variants.items()},
+        time.perf_counter() - started,
+    )
+    return {"source": source_name, "presets": variants}
+
+
+def generate(model, pk, field_name, variants_field, source_name):
+    """
+    Render the derivatives of one image field and store the variants map,
+    unless the image was replaced in the meantime.
+    """
+    from .authentication import token_cache
+    from .cache import invalidate_on_commit
+    from .models import Product, User
+    from .response_cache import response_cache
+    from .signals import send_products_changed
+
+    try:
+        variants = render_derivatives(source_name)
+    except Exception as e:
+        stats.failed()
+        logger.error(f"Image derivatives for {source_name} failed: {str(e)}")
+        return None
+
+    changes = {variants_field: variants}
+    if any(field.name == "updated_at" for field in model._meta.concrete_fields):
+        # Listings embed the variants, so their validators must change
+        changes["updated_at"] = Now()
+    updated = model._default_manager.filter(pk=pk, **{field_name: source_name}).update(**changes)
+    if updated:
+        if model is Product:
+            send_products_changed(Product, [pk], [variants_field])
+        elif model is User:
+            invalidate_on_commit(token_cache.invalidate_user, pk)
+        else:
+            response_cache.bump_on_commit(model)
+    return variants
+
+
+class DerivativePool:
+    """Worker threads that render derivatives off the request thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+
+    def pending(self):
+        return self._pending
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._executor is None:
+                workers = getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-derivatives")
+            self._pending += 1
+        return self._executor.submit(self._run, func, *args)
+
+    def _run(self, func, *args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._pending -= 1
+
+
+pool = DerivativePool()
+
+
+def schedule_derivatives(instance, field_name, variants_field, update_fields=None):
+    """
+    Queue derivative generation after a save if the image changed, on the
+    pool when IMAGE_DERIVATIVES_ASYNC is enabled and inline otherwise.
+    """
+    if update_fields is not None and field_name not in update_fields:
+        return
+    deferred = instance.get_deferred_fields()
+    if field_name in deferred or variants_field in deferred:
+        # Saved without loading the image, so it did not change
+        return
+    image = getattr(instance, field_name)
+    variants = getattr(instance, variants_field) or {}
+    model = instance.__class__
+    if not image:
+        if variants:
+            model._default_manager.filter(pk=instance.pk).update(**{variants_field: {}})
+            setattr(instance, variants_field, {})
+        return
+    if variants.get("source") == image.name:
+        return
+
+    args = (model, instance.pk, field_name, variants_field, image.name)
+    if getattr(settings, "IMAGE_DERIVATIVES_ASYNC", True):
+        # Wait for the commit so the worker sees the new image name
+        transaction.on_commit(lambda: pool.submit(generate, *args))
+    else:
+        variants = generate(*args)
+        if variants is not None:
+            setattr(instance, variants_field, variants)
+
+
+def srcset(variants, image, request=None):
+    """
+    {preset: url} for an image's derivatives plus "original", e.g. for
+    <img srcset>; just the original until the derivatives exist.
+    """
+    if not image:
+        return None
+
+    def url(name):
+        value = default_storage.url(name)
+        return request.build_absolute_uri(value) if request is not None else value
+
+    urls = {}
+    if variants and variants.get("source") == image.name:
+        urls = {preset: url(variant["name"]) for preset, variant in variants["presets"].items()}
+    urls["original"] = url(image.name)
+    return urls
@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from app.authentication import (
+    CachedTokenAuthentication, SignedAccessTokenAuthentication, issue_access_token, token_cache,
+)
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = "Measure per-request authentication overhead of DB tokens, cached tokens and signed access tokens."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+
+    def measure(self, label, authenticator, header, count):
+        factory = APIRequestFactory()
+        requests = [Request(factory.get("/api/cart/items/", HTTP_AUTHORIZATION=header)) for _ in range(count)]
+        # One warm-up call, e.g. to fill the token cache
+        authenticator.authenticate(Request(factory.get("/", HTTP_AUTHORIZATION=header)))
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            for request in requests:
+                authenticator.authenticate(request)
+            elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"  {label}: {len(context.captured_queries) / count:.2f} queries, "
+            f"{elapsed * 1e6 / count:.1f}us per request"
+        )
+
+    def handle(self, *args, **options):
+        count = options["requests"]
+        with transaction.atomic():
+            user = User.objects.create_user(username="bench-auth", email="bench-auth@example.com", password="x")
+            key = user.auth_token.key
+            token_cache.clear()
+            self.stdout.write(f"{count} authenticated requests")
+            self.measure("DB token", TokenAuthentication(), f"Token {key}", count)
+            self.measure("cached token", CachedTokenAuthentication(), f"Token {key}", count)
+            self.measure("signed access token", SignedAccessTokenAuthentication(), f"Bearer {issue_access_token(user)}", count)
+            transaction.set_rollback(True)
+        token_cache.clear()
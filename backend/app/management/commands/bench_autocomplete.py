@@ -0,0 +1,44 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from app.autocomplete import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = "Measure autocomplete build time, per-keystroke latency and memory on synthetic names"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        vocabulary = ["".join(rng.choices(letters, k=rng.randint(3, 9))) for _ in range(20000)]
+        index = PrefixIndex(max_entries=options["products"])
+
+        start = time.perf_counter()
+        index.load(
+            (i, " ".join(rng.sample(vocabulary, 3)), rng.random() * 5, {})
+            for i in range(options["products"])
+        )
+        self.stdout.write(f"Built index of {len(index)} entries in {time.perf_counter() - start:.2f}s")
+
+        # Simulate typing: every prefix of a random word, cold then warm
+        keystrokes = []
+        for _ in range(options["queries"] // 5):
+            word = rng.choice(vocabulary)
+            keystrokes.extend(word[:n] for n in range(2, min(len(word), 6) + 1))
+        for label in ("cold", "warm"):
+            samples = []
+            for query in keystrokes:
+                start = time.perf_counter()
+                index.search(query, 8)
+                samples.append((time.perf_counter() - start) * 1e6)
+            samples.sort()
+            self.stdout.write(
+                f"{label}: median {statistics.median(samples):.1f}us, "
+                f"p99 {samples[int(len(samples) * 0.99)]:.1f}us over {len(samples)} keystrokes"
+            )
+        self.stdout.write(str(index.stats()))
@@ -0,0 +1,63 @@
+import time
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from app.auth import sync_cart_on_login
+from app.models import Category, Order, Product, User
+
+
+class FakeRequest:
+    def __init__(self, cart):
+        self.session = SessionStore()
+        self.session["cart"] = cart
+
+
+class Command(BaseCommand):
+    help = "Measure queries and time of the login cart sync for growing session carts. Everything is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument(
+            "--compare",
+            action="store_true",
+            help="Also time the old Product.get + add_product loop",
+        )
+
+    def seed(self, count):
+        category = Category.objects.create(name="Benchmark")
+        Product.objects.bulk_create(
+            Product(name=f"Bench {i}", description="", price="9.99", category=category, stock=100)
+            for i in range(count)
+        )
+        return list(Product.objects.filter(category=category).values_list("id", flat=True))
+
+    def measure(self, label, func):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        self.stdout.write(f"  {label}: {len(context.captured_queries)} queries in {elapsed * 1000:.1f}ms")
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            with transaction.atomic():
+                product_ids = self.seed(size)
+                user = User.objects.create(username="bench-login", email="bench-login@example.com")
+                session_cart = {str(product_id): {"quantity": 2} for product_id in product_ids}
+                self.stdout.write(f"{size} session cart lines")
+
+                self.measure(
+                    "bulk sync",
+                    lambda: sync_cart_on_login(User, request=FakeRequest(session_cart), user=user),
+                )
+
+                if options["compare"]:
+                    order = Order.objects.create(user=user, status="Pending")
+
+                    def per_item():
+                        for product_id, item in session_cart.items():
+                            order.add_product(Product.objects.get(id=product_id), item["quantity"])
+
+                    self.measure("per-item loop", per_item)
+                transaction.set_rollback(True)
@@ -0,0 +1,70 @@
+import io
+import random
+import shutil
+import tempfile
+import time
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image, ImageDraw, ImageFilter
+from app.images import render_derivatives, stats
+
+
+def sample_image(width, height, fmt):
+    """A photo-like test image: smooth gradients with soft shapes and grain"""
+    rng = random.Random(width * height)
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(width // 20, width // 5)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(6))
+    noise = Image.effect_noise((width, height), 12).convert("RGB")
+    image = Image.blend(image, noise, 0.08)
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, fmt, quality=90)
+    else:
+        image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Measure image derivative generation latency and bytes per preset against the original upload."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, default=5)
+        parser.add_argument("--width", type=int, default=2400)
+        parser.add_argument("--height", type=int, default=1600)
+
+    def handle(self, *args, **options):
+        count, width, height = options["images"], options["width"], options["height"]
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for fmt, ext in (("JPEG", "jpg"), ("PNG", "png")):
+                    self.measure(fmt, ext, count, width, height)
+        finally:
+            shutil.rmtree(media_root)
+
+    def measure(self, fmt, ext, count, width, height):
+        stats.reset()
+        original = sample_image(width, height, fmt)
+        start = time.perf_counter()
+        for index in range(count):
+            # A distinct name per run, so nothing is reused from storage
+            name = default_storage.save(f"bench/{index}.{ext}", ContentFile(original))
+            variants = render_derivatives(name)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{count} {width}x{height} {fmt} uploads of {len(original)} bytes: "
+            f"{elapsed * 1000 / count:.1f}ms per image"
+        )
+        for preset, variant in variants["presets"].items():
+            self.stdout.write(
+                f"  {preset} {variant['width']}x{variant['height']}: {variant['size']} bytes, "
+                f"{variant['size'] * 100 / len(original):.1f}% of the original"
+            )
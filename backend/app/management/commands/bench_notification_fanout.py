@@ -0,0 +1,59 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.models import Notification, User
+from app.notifications import fan_out_to_active_users, stats
+
+
+class Command(BaseCommand):
+    help = "Benchmark coupon notification fan-out. Everything is rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--compare",
+            type=int,
+            default=2000,
+            help="Also time the old one-INSERT-per-user loop over this many users (0 to skip)",
+        )
+
+    def handle(self, *args, **options):
+        user_count = options["users"]
+        with transaction.atomic():
+            start = time.perf_counter()
+            # bulk_create skips the post_save receivers, so no carts or tokens are made
+            User.objects.bulk_create(
+                (
+                    User(username=f"bench-{i}", email=f"bench-{i}@example.com", password="!")
+                    for i in range(user_count)
+                ),
+                batch_size=options["batch_size"],
+            )
+            self.stdout.write(f"Seeded {user_count} users in {time.perf_counter() - start:.2f}s")
+
+            stats.reset()
+            start = time.perf_counter()
+            created = fan_out_to_active_users(
+                label="benchmark", batch_size=options["batch_size"], type="coupon", message="Benchmark"
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Batched fan-out: {created} notifications in {elapsed:.2f}s "
+                f"({created / elapsed:,.0f}/s)"
+            )
+
+            compare = min(options["compare"], user_count)
+            if compare:
+                user_ids = list(User.objects.filter(is_active=True).values_list("id", flat=True)[:compare])
+                start = time.perf_counter()
+                for user_id in user_ids:
+                    Notification.objects.create(user_id=user_id, type="coupon", message="Benchmark")
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"Per-user inserts: {compare} notifications in {elapsed:.2f}s "
+                    f"({compare / elapsed:,.0f}/s)"
+                )
+
+            self.stdout.write(str(stats.as_dict()))
+            transaction.set_rollback(True)
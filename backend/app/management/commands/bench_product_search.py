@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from app.models import Category, Product
+from app.search import ProductSearchFilter, get_search_backend
+from app.views import ProductViewSet
+
+WORDS = (
+    "jacket shirt denim cotton wool linen summer winter classic slim relaxed "
+    "hoodie sneaker leather canvas trench parka cardigan blazer chino jogger"
+).split()
+
+
+def make_vocabulary(rng, size):
+    """Pseudo-words so that, like a real catalog, most terms are selective"""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = set(WORDS)
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rng.choices(letters, k=rng.randint(4, 9))))
+    return sorted(vocabulary)
+
+
+class Command(BaseCommand):
+    help = "Compare ?search= latency of SearchFilter and the full-text backend. Rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=20)
+        parser.add_argument("--vocabulary", type=int, default=20000)
+
+    def time_filter(self, backend, terms):
+        factory = APIRequestFactory()
+        view = ProductViewSet()
+        samples = []
+        for term in terms:
+            request = Request(factory.get("/api/products/", {"search": term}))
+            start = time.perf_counter()
+            len(backend().filter_queryset(request, Product.objects.all(), view)[:20])
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        vocabulary = make_vocabulary(rng, options["vocabulary"])
+        with transaction.atomic():
+            categories = [Category.objects.create(name=f"Bench {word}") for word in WORDS[:8]]
+            start = time.perf_counter()
+            # bulk_create skips the index signals, so rebuild once afterwards
+            Product.objects.bulk_create(
+                (
+                    Product(
+                        name=" ".join(rng.sample(vocabulary, 2)).title(),
+                        description=" ".join(rng.choices(vocabulary, k=30)),
+                        price=rng.randint(5, 500),
+                        category=rng.choice(categories),
+                    )
+                    for _ in range(options["products"])
+                ),
+                batch_size=2000,
+            )
+            get_search_backend().rebuild()
+            self.stdout.write(
+                f"Seeded and indexed {options['products']} products in {time.perf_counter() - start:.2f}s"
+            )
+
+            terms = [rng.choice(vocabulary)[: rng.randint(3, 6)] for _ in range(options["queries"])]
+            for label, backend in (("SearchFilter (icontains)", filters.SearchFilter), ("FTS5", ProductSearchFilter)):
+                samples = self.time_filter(backend, terms)
+                self.stdout.write(
+                    f"{label}: median {statistics.median(samples):.2f}ms, "
+                    f"max {max(samples):.2f}ms over {len(samples)} queries (top 20 rows)"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.models import Product
+from app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from scratch"
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        start = time.perf_counter()
+        with transaction.atomic():
+            backend.rebuild()
+        self.stdout.write(
+            f"Indexed {Product.objects.count()} products with {backend.__class__.__name__} "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
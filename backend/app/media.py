@@ -0,0 +1,138 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+# Names that change whenever their content does, e.g. "shoe.thumb.3f9a1c2b.webp",
+# can be cached forever
+CONTENT_HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+
+# One "bytes=first-last", "bytes=first-" or "bytes=-suffix" range. Requests for
+# several ranges get the whole file, which RFC 9110 allows.
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def file_validators(stat):
+    """(etag, last_modified) from a file's stat: size and mtime change with the content"""
+    return '"%x-%x"' % (stat.st_size, stat.st_mtime_ns), int(stat.st_mtime)
+
+
+def cache_control(name):
+    if CONTENT_HASHED_NAME_RE.search(name):
+        return "private, max-age=31536000, immutable"
+    return f"private, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single byte range, None to send the whole
+    file, or False if the range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if size == 0:
+        # An empty file has no byte positions to satisfy any range
+        return False
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """Whether an If-Range precondition allows a partial response"""
+    value = request.META.get("HTTP_IF_RANGE")
+    if not value:
+        return True
+    if value.startswith(('"', 'W/"')):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def iter_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def offload_response(path, name):
+    """
+    An empty response telling the fronting proxy to send the file itself,
+    per MEDIA_SENDFILE: "x-accel-redirect" (nginx) or "x-sendfile" (Apache,
+    lighttpd). The proxy then handles ranges and streaming.
+    """
+    mode = getattr(settings, "MEDIA_SENDFILE", None)
+    if mode == "x-accel-redirect":
+        response = HttpResponse()
+        prefix = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + name.lstrip("/")
+    elif mode == "x-sendfile":
+        response = HttpResponse()
+        response["X-Sendfile"] = path
+    else:
+        return None
+    # The proxy keeps this content type instead of guessing one
+    content_type, _ = mimetypes.guess_type(path)
+    response["Content-Type"] = content_type or "application/octet-stream"
+    return response
+
+
+def serve_file(request, path, name):
+    """
+    Serve a file with validators (ETag, Last-Modified, 304s), single byte
+    ranges (206, 416) and Cache-Control, optionally handing the transfer
+    to a proxy. name is the path relative to the media root.
+    """
+    stat = os.stat(path)
+    etag, last_modified = file_validators(stat)
+    headers = {
+        "ETag": quote_etag(etag),
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": cache_control(name),
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = offload_response(path, name)
+    if response is None:
+        size = stat.st_size
+        byte_range = None
+        if "HTTP_RANGE" in request.META and if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(iter_range(path, start, end - start + 1), status=206)
+            content_type, _ = mimetypes.guess_type(path)
+            response["Content-Type"] = content_type or "application/octet-stream"
+            response["Content-Length"] = str(end - start + 1)
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            response = FileResponse(open(path, "rb"))
+        response["Accept-Ranges"] = "bytes"
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+def mark_delivered_orders_reserved(apps, schema_editor):
+    # Stock for delivered orders was already taken by the old signal
+    Order = apps.get_model('app', 'Order')
+    Order.objects.filter(status='Delivered').update(stock_reserved=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_reserved',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_delivered_orders_reserved, migrations.RunPython.noop),
+    ]
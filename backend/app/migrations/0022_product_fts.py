@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def create_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS app_product_fts USING fts5("
+        "name, category, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO app_product_fts (rowid, name, category, description) "
+        "SELECT p.id, p.name, c.name, p.description FROM app_product p "
+        "JOIN app_category c ON c.id = p.category_id"
+    )
+
+
+def drop_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS app_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_broadcastnotification'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_product_fts, drop_product_fts),
+    ]
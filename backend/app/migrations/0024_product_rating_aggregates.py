@@ -0,0 +1,77 @@
+# Generated by Django 5.2 on 2026-10-18 19:17
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    # One grouped query over all ratings, then one bulk UPDATE
+    Product = apps.get_model('app', 'Product')
+    Rating = apps.get_model('app', 'Rating')
+    stars = (1, 2, 3, 4, 5)
+    rows = Rating.objects.values('product_id').order_by().annotate(
+        rating_count=models.Count('id'),
+        rating_sum=models.Sum('rating'),
+        **{f'rating_{star}': models.Count('id', filter=models.Q(rating=star)) for star in stars},
+    )
+    products = []
+    for row in rows:
+        product = Product(id=row.pop('product_id'), **row)
+        product.average_rating = round(Decimal(product.rating_sum) / product.rating_count, 2)
+        products.append(product)
+    fields = ['rating_count', 'rating_sum', 'average_rating'] + [f'rating_{star}' for star in stars]
+    Product.objects.bulk_update(products, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['average_rating', 'rating_count'], name='product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_count'], name='product_rating_count_idx'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+def backfill_reserved_quantity(apps, schema_editor):
+    # Orders holding stock reserved their current quantities, the best record there is
+    OrderItem = apps.get_model('app', 'OrderItem')
+    OrderItem.objects.filter(order__stock_reserved=True).update(reserved_quantity=models.F('quantity'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0026_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_reserved_quantity, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,22 @@
-from django.db import models
-from django.contrib.auth.hashers import make_password, check_password
+from django.conf import settings
+from django.db import models, transaction
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
-import logging
-
-logger = logging.getLogger(__name__)
+from django.utils import timezone
+from contextlib import contextmanager
+from django.db.models import Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Now, Round
+from decimal import Decimal
+import threading
+from .signals import products_changed, send_products_changed
 
 
 GENDER_CHOICES = (("Male", "Male"), ("Female", "Female"), ("Other", "Other"))
@@ -37,6 +42,10 @@ class UserManager(BaseUserManager):
         return self.create_user(username, email, password, **extra_fields)
 
 
+# Changing any of these revokes the user's signed access tokens
+PERMISSION_FIELDS = ("is_active", "is_staff", "is_superuser")
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     id = models.BigAutoField(primary_key=True)
     username = models.CharField(max_length=150, unique=True)
@@ -52,6 +61,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     updated_at = models.DateTimeField(auto_now=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    # WebP derivatives of profile_picture, see app.images
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     objects = UserManager()
 
@@ -63,10 +74,46 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.username
 
     def set_password(self, raw_password):
+        from .passwords import make_password
+
         self.password = make_password(raw_password)
+        self._password = raw_password
 
     def check_password(self, raw_password):
-        return check_password(raw_password, self.password)
+        from .passwords import check_password
+
+        def setter(raw_password):
+            # Re-hash with the current hasher settings, e.g. a new iteration count
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+
+        return check_password(raw_password, self.password, setter)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # Users built from auth snapshots defer most columns. Load them all
+        # on the first access instead of one query per field.
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = list(deferred)
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        flags = self.permission_flags()
+        self._stored_permissions = {
+            **getattr(self, "_stored_permissions", {}),
+            **{name: value for name, value in flags.items() if fields is None or name in fields},
+        }
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored flags, so a save that changes them can revoke
+        # the access tokens issued under the old ones
+        instance._stored_permissions = instance.permission_flags()
+        return instance
+
+    def permission_flags(self):
+        """Loaded is_active/is_staff/is_superuser values; deferred ones are left out"""
+        return {name: self.__dict__[name] for name in PERMISSION_FIELDS if name in self.__dict__}
 
     class Meta:
         verbose_name = "User"
@@ -86,10 +133,49 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, signal, **kwargs):
+    """
+    Cached tokens carry a snapshot of the user, e.g. is_active, and signed
+    access tokens carry is_staff, so deleting the user or changing a
+    permission flag revokes every access token issued so far.
+    """
+    from .authentication import revocations, token_cache
+    from .cache import invalidate_on_commit
+
+    invalidate_on_commit(token_cache.invalidate_user, instance.pk)
+    flags = instance.permission_flags()
+    stored = getattr(instance, "_stored_permissions", {})
+    changed = any(name in stored and stored[name] != value for name, value in flags.items())
+    if signal is post_delete or changed or flags.get("is_active") is False:
+        # Again after commit, so tokens issued meanwhile with the old flags go too
+        invalidate_on_commit(revocations.revoke_user, instance.pk)
+    instance._stored_permissions = {**stored, **flags}
+
+
+@receiver(post_save, sender=User)
+def generate_profile_picture_variants(sender, instance, update_fields=None, **kwargs):
+    from .images import schedule_derivatives
+
+    schedule_derivatives(instance, "profile_picture", "profile_picture_variants", update_fields)
+
+
+@receiver(post_delete, sender=Token)
+def forget_cached_token(sender, instance, **kwargs):
+    from .authentication import revocations, token_cache
+    from .cache import invalidate_on_commit
+
+    invalidate_on_commit(token_cache.invalidate_token, instance.key)
+    # Access tokens are refreshed with this token, so they go with it
+    revocations.revoke_user(instance.user_id)
+
+
 class Category(models.Model):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=100, unique=True)
     image = models.ImageField(upload_to="categories/", blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -101,6 +187,10 @@ class Category(models.Model):
         verbose_name = "Category"
         verbose_name_plural = "Categories"
         ordering = ["name"]
+        indexes = [
+            # Conditional GET validator, MAX(updated_at) from the index alone
+            models.Index(fields=["updated_at"], name="category_updated_idx"),
+        ]
 
     @property
     def image_url(self):
@@ -115,6 +205,8 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to="products/", blank=True, null=True)
+    # WebP derivatives of image, see app.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey(
         Category, related_name="products", on_delete=models.CASCADE
     )
@@ -124,6 +216,18 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    # Rating aggregates, kept current by adjust_rating_aggregates on every
+    # rating write so reads never aggregate the ratings table
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    RATING_STARS = (1, 2, 3, 4, 5)
+    RATING_FIELDS = ["rating_count", "rating_sum", "average_rating"] + [f"rating_{star}" for star in RATING_STARS]
 
     def __str__(self):
         return self.name
@@ -132,6 +236,19 @@ class Product(models.Model):
         verbose_name = "Product"
         verbose_name_plural = "Products"
         ordering = ["name"]
+        indexes = [
+            # Listing orderings offered by ProductViewSet
+            models.Index(fields=["name"], name="product_name_idx"),
+            models.Index(fields=["price"], name="product_price_idx"),
+            models.Index(fields=["created_at"], name="product_created_idx"),
+            # Category pages, ordered by name
+            models.Index(fields=["category", "name"], name="product_category_name_idx"),
+            # Rating-sorted listings
+            models.Index(fields=["average_rating", "rating_count"], name="product_rating_idx"),
+            models.Index(fields=["rating_count"], name="product_rating_count_idx"),
+            # Conditional GET validator, covers the join to the category too
+            models.Index(fields=["updated_at", "category"], name="product_updated_idx"),
+        ]
 
     @property
     def image_url(self):
@@ -139,12 +256,173 @@ class Product(models.Model):
             return f"/media/{self.image.name}"
         return None
 
+    @property
+    def rating_histogram(self):
+        """Number of ratings per star, {1: n, ..., 5: n}"""
+        return {star: getattr(self, f"rating_{star}") for star in self.RATING_STARS}
+
     def update_average_rating(self):
-        avg_rating = self.ratings.aggregate(avg_rating=models.Avg("rating"))[
-            "avg_rating"
-        ]
-        self.average_rating = avg_rating or 0
-        self.save()
+        """Recount all rating aggregates from the ratings table, e.g. to repair drift"""
+        counts = self.ratings.aggregate(
+            rating_count=models.Count("id"),
+            rating_sum=models.Sum("rating", default=0),
+            **{
+                f"rating_{star}": models.Count("id", filter=models.Q(rating=star))
+                for star in self.RATING_STARS
+            },
+        )
+        for field, value in counts.items():
+            setattr(self, field, value)
+        self.average_rating = (
+            round(Decimal(self.rating_sum) / self.rating_count, 2) if self.rating_count else 0
+        )
+        self.save(update_fields=self.RATING_FIELDS + ["updated_at"])
+
+
+def rating_average(total, count):
+    """SQL expression for round(total / count, 2), or 0 when there are no ratings"""
+    return Coalesce(
+        Round(Cast(total, models.FloatField()) / NullIf(count, Value(0)), 2),
+        Value(0.0),
+        output_field=models.DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def adjust_rating_aggregates(product_id, added=None, removed=None):
+    """
+    Apply one rating being added, removed, or changed (both given) to a
+    product's aggregates with a single UPDATE of F-expressions.
+
+    SET expressions all read the row's old values, so the average is
+    computed from the adjusted sum and count in the same statement.
+    """
+    if added == removed:
+        return
+    count = models.F("rating_count") + ((added is not None) - (removed is not None))
+    total = models.F("rating_sum") + ((added or 0) - (removed or 0))
+    changes = {"rating_count": count, "rating_sum": total, "average_rating": rating_average(total, count)}
+    if added is not None:
+        changes[f"rating_{added}"] = models.F(f"rating_{added}") + 1
+    if removed is not None:
+        changes[f"rating_{removed}"] = models.F(f"rating_{removed}") - 1
+    Product.objects.filter(pk=product_id).update(updated_at=Now(), **changes)
+    send_products_changed(Product, [product_id], Product.RATING_FIELDS)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Keep the search, autocomplete and facet indexes in sync with product changes"""
+    from .autocomplete import autocomplete
+    from .facets import facets
+    from .search import get_search_backend
+
+    get_search_backend().index_products([instance.pk])
+    # The in-memory indexes are not rolled back with the transaction
+    transaction.on_commit(lambda: autocomplete.product_changed(instance), robust=True)
+    transaction.on_commit(lambda: facets.product_changed(instance), robust=True)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    from .autocomplete import autocomplete
+    from .facets import facets
+    from .search import get_search_backend
+
+    product_id = instance.pk
+    get_search_backend().remove_products([product_id])
+    transaction.on_commit(lambda: autocomplete.product_deleted(product_id), robust=True)
+    transaction.on_commit(lambda: facets.product_deleted(product_id), robust=True)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    """Category names are searchable, so renames re-index their products"""
+    from .autocomplete import autocomplete
+    from .facets import facets
+    from .search import get_search_backend
+
+    if not created:
+        get_search_backend().index_category(instance.pk)
+    transaction.on_commit(lambda: autocomplete.category_changed(instance), robust=True)
+    transaction.on_commit(lambda: facets.category_changed(instance), robust=True)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    from .autocomplete import autocomplete
+
+    category_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.category_deleted(category_id), robust=True)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def generate_image_variants(sender, instance, update_fields=None, **kwargs):
+    """Resized WebP copies of a new or replaced image, see app.images"""
+    from .images import schedule_derivatives
+
+    schedule_derivatives(instance, "image", "image_variants", update_fields)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_catalog_version(sender, **kwargs):
+    """Cached anonymous responses are keyed by the versions of their models"""
+    from .response_cache import response_cache
+
+    response_cache.bump_on_commit(sender)
+
+
+@receiver(products_changed, sender=Product)
+def bump_changed_products_version(sender, **kwargs):
+    # Already sent after commit
+    from .response_cache import response_cache
+
+    response_cache.bump(Product)
+
+
+@receiver(products_changed, sender=Product)
+def refresh_product_facets(sender, product_ids, **kwargs):
+    """Queryset UPDATEs skip post_save, so re-read the touched products"""
+    from .facets import facets
+
+    facets.refresh_products(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_carts(sender, instance, created, **kwargs):
+    """Cached carts show product prices, names and images"""
+    from .cart_cache import cart_cache
+
+    if not created:
+        cart_cache.invalidate_products([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def invalidate_deleted_product_carts(sender, instance, **kwargs):
+    # Before the delete, while the cascaded cart items still exist
+    from .cart_cache import cart_cache
+
+    cart_cache.invalidate_products([instance.pk])
+
+
+@receiver(products_changed, sender=Product)
+def invalidate_changed_product_carts(sender, product_ids, fields=None, **kwargs):
+    from .cart_cache import CART_PRODUCT_FIELDS, cart_cache
+
+    if fields is None or CART_PRODUCT_FIELDS.intersection(fields):
+        cart_cache.invalidate_products(product_ids)
+
+
+@receiver(products_changed, sender=Product)
+def rescore_product_suggestions(sender, product_ids, fields=None, **kwargs):
+    """Suggestions are ranked by average rating"""
+    from .autocomplete import autocomplete
+
+    if fields is None or "average_rating" in fields:
+        autocomplete.refresh_products(product_ids)
 
 
 class Rating(models.Model):
@@ -160,16 +438,99 @@ class Rating(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so a save can adjust the product aggregates
+        # by the difference. Missing when the fields were deferred.
+        instance._stored_rating = (instance.__dict__.get("product_id"), instance.__dict__.get("rating"))
+        return instance
+
     class Meta:
         unique_together = ("product", "user")
         verbose_name = "Rating"
         verbose_name_plural = "Ratings"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at"], name="rating_created_idx"),
+            # A product's reviews, newest first
+            models.Index(fields=["product", "-created_at"], name="rating_product_created_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name} - {self.rating}"
 
 
+@receiver(post_save, sender=Rating)
+def count_saved_rating(sender, instance, created, **kwargs):
+    """Keep the product's rating aggregates in step with the rating"""
+    rating = int(instance.rating)
+    if created:
+        adjust_rating_aggregates(instance.product_id, added=rating)
+    else:
+        product_id, stored = getattr(instance, "_stored_rating", (None, None))
+        if stored is None:
+            # Saved without being loaded first, so the old value is unknown
+            instance.product.update_average_rating()
+        elif product_id != instance.product_id:
+            adjust_rating_aggregates(product_id, removed=stored)
+            adjust_rating_aggregates(instance.product_id, added=rating)
+        else:
+            adjust_rating_aggregates(instance.product_id, added=rating, removed=stored)
+    instance._stored_rating = (instance.product_id, rating)
+
+
+@receiver(post_delete, sender=Rating)
+def count_deleted_rating(sender, instance, **kwargs):
+    product_id, stored = getattr(instance, "_stored_rating", (None, None))
+    if stored is not None:
+        adjust_rating_aggregates(product_id, removed=stored)
+    else:
+        product = Product.objects.filter(pk=instance.product_id).first()
+        if product:
+            product.update_average_rating()
+
+
+_deferred_totals = threading.local()
+
+
+@contextmanager
+def deferred_order_totals():
+    """
+    Batch order total recomputation.
+
+    Inside the block, saving or deleting an OrderItem only marks its order as
+    dirty; each dirty order is recomputed once when the outermost block exits.
+    """
+    if getattr(_deferred_totals, "orders", None) is not None:
+        # Nested block, the outermost one flushes
+        yield
+        return
+
+    _deferred_totals.orders = {}
+    try:
+        yield
+        dirty_orders = _deferred_totals.orders
+    finally:
+        _deferred_totals.orders = None
+
+    for order in dirty_orders.values():
+        order.update_total()
+
+
+def schedule_total_update(order):
+    """Recompute the order total now, or once at the end of deferred_order_totals"""
+    dirty_orders = getattr(_deferred_totals, "orders", None)
+    if dirty_orders is None:
+        order.update_total()
+    else:
+        dirty_orders.setdefault(order.pk, order)
+
+
+# Order statuses that hold the stock of their items
+STOCK_HOLDING_STATUSES = ("Shipped", "Delivered")
+
+
 class Order(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, related_name="orders", on_delete=models.CASCADE)
@@ -185,20 +546,40 @@ class Order(models.Model):
         ],
     )
     shipping_address = models.CharField(max_length=255, blank=True)
+    # True while product stock has been taken for this order's items
+    stock_reserved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
 
+    def clean(self):
+        # Shipping or delivering takes the stock (see reserve_stock_on_shipping);
+        # report a shortage on the form instead of failing the save
+        from .stock import InsufficientStock, check_stock, order_quantities
+
+        if self.pk and self.status in STOCK_HOLDING_STATUSES:
+            if not Order.objects.filter(pk=self.pk, stock_reserved=True).exists():
+                try:
+                    check_stock(order_quantities(self))
+                except InsufficientStock as e:
+                    raise ValidationError({"status": str(e)})
+
     def update_total(self):
-        """Automatically calculate total price from order items"""
-        order_items = self.order_items.all()
-        if not order_items.exists():
-            self.total_price = 0
-        else:
-            self.total_price = sum(item.get_subtotal() for item in order_items)
-        self.save()
+        """Recalculate total price from order items with a single SUM query"""
+        total = self.order_items.aggregate(
+            total=models.Sum(
+                models.F("price") * models.F("quantity"),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            )
+        )["total"]
+        self.total_price = total or 0
+        self.updated_at = timezone.now()
+        # Write only the total so the post_save receivers don't fire again
+        Order.objects.filter(pk=self.pk).update(
+            total_price=self.total_price, updated_at=self.updated_at
+        )
 
     def add_product(self, product, quantity=1):
         """Add a product to the order"""
@@ -208,26 +589,32 @@ class Order(models.Model):
         if quantity is None or quantity <= 0:
             quantity = 1
 
-        order_item, created = OrderItem.objects.get_or_create(
-            order=self,
-            product=product,
-            defaults={
-                "quantity": quantity,
-                "price": product.price if product.price else 0,
-            },
-        )
+        with deferred_order_totals():
+            # Register this instance so its total_price is refreshed in place
+            schedule_total_update(self)
+            order_item, created = OrderItem.objects.get_or_create(
+                order=self,
+                product=product,
+                defaults={
+                    "quantity": quantity,
+                    "price": product.price if product.price else 0,
+                },
+            )
 
-        if not created:
-            order_item.quantity += quantity
-            order_item.save()
+            if not created:
+                order_item.quantity += quantity
+                order_item.save()
 
-        self.update_total()
         return order_item
 
     class Meta:
         verbose_name = "Order"
         verbose_name_plural = "Orders"
         ordering = ["-created_at"]
+        indexes = [
+            # A customer's order history, newest first
+            models.Index(fields=["user", "-created_at"], name="order_user_created_idx"),
+        ]
 
 
 class OrderItem(models.Model):
@@ -238,6 +625,8 @@ class OrderItem(models.Model):
         Product, related_name="order_items", on_delete=models.CASCADE
     )
     quantity = models.IntegerField()
+    # Units taken from stock for this line; cancelling gives back exactly these
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     def get_subtotal(self):
@@ -249,6 +638,20 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.quantity}"
 
+    def clean(self):
+        # Units added to a reserved order are taken from stock on save
+        from .stock import InsufficientStock, check_stock
+
+        if not (self.order_id and self.product_id and self.quantity):
+            return
+        if not Order.objects.filter(pk=self.order_id, stock_reserved=True).exists():
+            return
+        reserved = OrderItem.objects.filter(pk=self.pk).values_list("reserved_quantity", flat=True).first()
+        try:
+            check_stock({self.product_id: self.quantity - (reserved or 0)})
+        except InsufficientStock as e:
+            raise ValidationError({"quantity": str(e)})
+
     def save(self, *args, **kwargs):
         # Ensure price is set correctly if it's none or a new order item
         if self.price is None or (not self.pk and not self.price):
@@ -260,17 +663,31 @@ class OrderItem(models.Model):
         if self.quantity is None:
             self.quantity = 1
 
-        super().save(*args, **kwargs)
+        from .stock import sync_order_line_stock
+
+        # reserved_quantity is only written by app.stock, so a stale instance
+        # cannot overwrite it
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "reserved_quantity"
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Lines of a reserved order take their extra units from stock,
+            # or the save is rolled back with InsufficientStock
+            sync_order_line_stock(self.order_id, [self.pk])
         # Update the order total when an item is saved
         if self.order:
-            self.order.update_total()
+            schedule_total_update(self.order)
 
     def delete(self, *args, **kwargs):
         order = self.order
-        super().delete(*args, **kwargs)
+        result = super().delete(*args, **kwargs)
         # Update the order total when an item is deleted
         if order:
-            order.update_total()
+            schedule_total_update(order)
+        return result
 
     class Meta:
         verbose_name = "Order Item"
@@ -278,19 +695,36 @@ class OrderItem(models.Model):
         ordering = ["order"]
 
 
+@receiver(pre_save, sender=Order)
+def reserve_stock_on_shipping(sender, instance, raw=False, **kwargs):
+    """
+    Take stock before an order is saved as shipped or delivered, so a
+    shortage raises InsufficientStock and the status is never written.
+    """
+    from .stock import reserve_order_stock
+
+    if raw or instance._state.adding or instance.stock_reserved:
+        return
+    if instance.status in STOCK_HOLDING_STATUSES:
+        # Orders reserved at checkout already hold their stock, so this is a no-op
+        reserve_order_stock(instance)
+
+
 @receiver(post_save, sender=Order)
 def update_order_status(sender, instance, created, **kwargs):
-    """When an order status changes to Delivered, update product stock"""
-    if not created and instance.status == "Delivered":
-        for item in instance.order_items.all():
-            product = item.product
-            # Only update stock if we haven't already updated it
-            if product.stock >= item.quantity:
-                product.stock -= item.quantity
-                product.save()
-            else:
-                # Log error if stock is insufficient
-                logger.error(f"Insufficient stock for product {product.name} when delivering order {instance.id}")
+    """Give stock back when an order is cancelled"""
+    from .stock import release_order_stock
+
+    if not created and instance.status == "Cancelled":
+        release_order_stock(instance)
+
+
+@receiver(post_delete, sender=OrderItem)
+def release_deleted_order_line(sender, instance, **kwargs):
+    """Units reserved for a deleted line would otherwise never come back"""
+    from .stock import release_order_line_stock
+
+    release_order_line_stock(instance)
 
 
 class Cart(models.Model):
@@ -301,9 +735,25 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.username}"
 
+    def get_items(self):
+        """The cart's items, reusing cart.loaded_items when they were loaded up front"""
+        loaded = getattr(self, "loaded_items", None)
+        return self.items.all() if loaded is None else loaded
+
     def get_total(self):
-        """Calculate total price of all items in cart"""
-        return sum(item.get_subtotal() for item in self.items.all())
+        """
+        Calculate total price of all items in cart, from loaded_items when
+        they were loaded up front and with a single SUM query otherwise
+        """
+        if getattr(self, "loaded_items", None) is not None:
+            return sum(item.get_subtotal() for item in self.loaded_items)
+        total = self.items.aggregate(
+            total=models.Sum(
+                models.F("product__price") * models.F("quantity"),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            )
+        )["total"]
+        return total or 0
 
     def add_product(self, product, quantity=1):
         """Add a product to the cart"""
@@ -339,6 +789,13 @@ class Cart(models.Model):
         ordering = ["-updated_at"]
 
 
+@receiver(post_delete, sender=Cart)
+def forget_cached_cart(sender, instance, **kwargs):
+    from .cart_cache import cart_cache
+
+    cart_cache.invalidate_users_on_commit([instance.user_id])
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name="items", on_delete=models.CASCADE)
     product = models.ForeignKey(
@@ -394,6 +851,11 @@ class PrivacyPolicy(models.Model):
 
     class Meta:
         verbose_name_plural = "Privacy Policies"
+        indexes = [
+            models.Index(
+                fields=["-last_updated"], condition=models.Q(is_active=True), name="privacypolicy_active_idx"
+            ),
+        ]
 
 
 class FAQ(models.Model):
@@ -417,6 +879,13 @@ class FAQ(models.Model):
     class Meta:
         verbose_name_plural = "FAQs"
         ordering = ['-created_at']
+        # Only active FAQs are ever listed, so the indexes skip inactive ones
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='faq_active_idx'),
+            models.Index(
+                fields=['category', '-created_at'], condition=models.Q(is_active=True), name='faq_active_category_idx'
+            ),
+        ]
 
 
 class Contact(models.Model):
@@ -438,6 +907,9 @@ class Contact(models.Model):
 
     class Meta:
         ordering = ['contact_type']
+        indexes = [
+            models.Index(fields=['contact_type'], condition=models.Q(is_active=True), name='contact_active_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_contact_type_display()} - {self.title}"
@@ -447,6 +919,7 @@ class Slider(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     image = models.ImageField(upload_to='sliders/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey('Category', on_delete=models.SET_NULL, null=True, blank=True, help_text="Category to show when clicking the 'Show Now' button")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -457,6 +930,9 @@ class Slider(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='slider_active_idx'),
+        ]
 
     @property
     def image_url(self):
@@ -465,6 +941,21 @@ class Slider(models.Model):
         return None
 
 
+@receiver(post_save, sender=Slider)
+@receiver(post_delete, sender=Slider)
+def bump_slider_version(sender, **kwargs):
+    from .response_cache import response_cache
+
+    response_cache.bump_on_commit(Slider)
+
+
+@receiver(post_save, sender=Slider)
+def generate_slider_image_variants(sender, instance, update_fields=None, **kwargs):
+    from .images import schedule_derivatives
+
+    schedule_derivatives(instance, "image", "image_variants", update_fields)
+
+
 class Coupon(models.Model):
     code = models.CharField(max_length=50, unique=True)
     discount_type = models.CharField(
@@ -491,6 +982,10 @@ class Coupon(models.Model):
         verbose_name = "Coupon"
         verbose_name_plural = "Coupons"
         ordering = ['-created_at']
+        # Lookups by code already use the unique index on code
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='coupon_active_idx'),
+        ]
 
     def is_valid(self):
         from django.utils import timezone
@@ -529,11 +1024,51 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+            # Unread badge and unread-only lists
+            models.Index(
+                fields=['user', '-created_at'], condition=models.Q(read=False), name='notification_unread_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.get_type_display()} - {self.user.username}"
 
 
+class BroadcastNotification(models.Model):
+    """A notification stored once and shown to every user who joined before it"""
+    type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    coupon = models.ForeignKey('Coupon', on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Broadcasts visible to a user are those created since they joined
+            models.Index(fields=['created_at'], name='broadcast_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_type_display()} - broadcast"
+
+
+class BroadcastReceipt(models.Model):
+    """Per-user read/dismiss state, only stored once a user acts on a broadcast"""
+    broadcast = models.ForeignKey(BroadcastNotification, on_delete=models.CASCADE, related_name='receipts')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='broadcast_receipts')
+    read = models.BooleanField(default=False)
+    dismissed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['broadcast', 'user']
+
+    def __str__(self):
+        return f"{self.broadcast} - {self.user.username}"
+
+
 @receiver(post_save, sender=Order)
 def create_order_notification(sender, instance, created, **kwargs):
     """Create notifications when orders are created or updated"""
@@ -573,14 +1108,18 @@ def create_order_notification(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Coupon)
 def create_coupon_notification(sender, instance, created, **kwargs):
     """Create notifications when new coupons are created"""
+    from .notifications import dispatch_fan_out
+
     if created and instance.is_active:
-        # Get all active users
-        users = User.objects.filter(is_active=True)
-        # Create notifications for all users
-        for user in users:
-            Notification.objects.create(
-                user=user,
+        message = f'New coupon code {instance.code} available! Get {instance.discount_value}{"%" if instance.discount_type == "percentage" else "$"} off'
+        if getattr(settings, 'COUPON_NOTIFICATION_DELIVERY', 'broadcast') == 'fanout':
+            # One row per active user, written with batched inserts
+            dispatch_fan_out(
+                label=f"coupon {instance.code}",
                 type='coupon',
-                message=f'New coupon code {instance.code} available! Get {instance.discount_value}{"%" if instance.discount_type == "percentage" else "$"} off',
-                coupon=instance
+                message=message,
+                coupon_id=instance.id,
             )
+        else:
+            # One row for everyone, read state is tracked per user on demand
+            BroadcastNotification.objects.create(type='coupon', message=message, coupon=instance)
@@ -0,0 +1,252 @@
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, IntegerField, OuterRef, Value
+from .models import BroadcastNotification, BroadcastReceipt, Notification, User
+
+logger = logging.getLogger(__name__)
+
+
+def get_batch_size():
+    return getattr(settings, "NOTIFICATION_FANOUT_BATCH_SIZE", 1000)
+
+
+class FanoutStats:
+    """Thread-safe throughput and progress counters for notification fan-out"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.jobs_started = 0
+            self.jobs_completed = 0
+            self.jobs_failed = 0
+            self.notifications_created = 0
+            self.seconds_spent = 0.0
+            self.current = None
+            self.last = None
+
+    def start(self, label, total):
+        with self._lock:
+            self.jobs_started += 1
+            self.current = {"label": label, "total": total, "done": 0, "started": time.monotonic()}
+
+    def progress(self, count):
+        with self._lock:
+            self.notifications_created += count
+            if self.current:
+                self.current["done"] += count
+
+    def finish(self, failed=False):
+        with self._lock:
+            if failed:
+                self.jobs_failed += 1
+            else:
+                self.jobs_completed += 1
+            if self.current:
+                elapsed = time.monotonic() - self.current["started"]
+                self.seconds_spent += elapsed
+                self.last = {
+                    "label": self.current["label"],
+                    "total": self.current["total"],
+                    "done": self.current["done"],
+                    "seconds": round(elapsed, 3),
+                    "per_second": round(self.current["done"] / elapsed, 1) if elapsed else None,
+                }
+            self.current = None
+
+    def as_dict(self):
+        with self._lock:
+            current = None
+            if self.current:
+                current = {
+                    "label": self.current["label"],
+                    "total": self.current["total"],
+                    "done": self.current["done"],
+                    "seconds": round(time.monotonic() - self.current["started"], 3),
+                }
+            return {
+                "jobs_started": self.jobs_started,
+                "jobs_completed": self.jobs_completed,
+                "jobs_failed": self.jobs_failed,
+                "notifications_created": self.notifications_created,
+                "per_second": round(self.notifications_created / self.seconds_spent, 1) if self.seconds_spent else None,
+                "queued": worker.pending(),
+                "current": current,
+                "last": self.last,
+            }
+
+
+stats = FanoutStats()
+
+
+def fan_out(user_ids, batch_size=None, **fields):
+    """
+    Create one Notification per user id with chunked bulk INSERTs.
+
+    user_ids can be any iterable, including a streaming queryset iterator,
+    so the full user list is never held in memory. Returns the number of
+    notifications created.
+    """
+    batch_size = batch_size or get_batch_size()
+    created = 0
+    batch = []
+    for user_id in user_ids:
+        batch.append(Notification(user_id=user_id, **fields))
+        if len(batch) >= batch_size:
+            Notification.objects.bulk_create(batch)
+            created += len(batch)
+            stats.progress(len(batch))
+            batch = []
+    if batch:
+        Notification.objects.bulk_create(batch)
+        created += len(batch)
+        stats.progress(len(batch))
+    return created
+
+
+def fan_out_to_active_users(label="fan-out", batch_size=None, **fields):
+    """Notify every active user, streaming their ids from the database"""
+    batch_size = batch_size or get_batch_size()
+    users = User.objects.filter(is_active=True)
+    stats.start(label, users.count())
+    try:
+        with transaction.atomic():
+            created = fan_out(
+                users.values_list("id", flat=True).iterator(chunk_size=batch_size),
+                batch_size=batch_size,
+                **fields,
+            )
+    except Exception:
+        stats.finish(failed=True)
+        raise
+    stats.finish()
+    logger.info(f"{label}: created {created} notifications")
+    return created
+
+
+class FanoutWorker:
+    """A single background thread that runs fan-out jobs off the request thread"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="notification-fanout", daemon=True)
+                self._thread.start()
+        self._queue.put((func, args, kwargs))
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            close_old_connections()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Notification fan-out failed: {str(e)}")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+worker = FanoutWorker()
+
+
+def dispatch_fan_out(label="fan-out", **fields):
+    """
+    Notify all active users, on the worker thread when
+    NOTIFICATION_FANOUT_ASYNC is enabled and inline otherwise.
+    """
+    if getattr(settings, "NOTIFICATION_FANOUT_ASYNC", False):
+        # Wait for the commit so the worker sees the rows it references
+        transaction.on_commit(lambda: worker.submit(fan_out_to_active_users, label=label, **fields))
+        return None
+    return fan_out_to_active_users(label=label, **fields)
+
+
+# Broadcast entries in the feed are addressed as "b<id>" so they never clash
+# with personal notification ids
+BROADCAST_ID_PREFIX = "b"
+
+FEED_FIELDS = ("id", "type", "message", "read", "created_at", "order_id", "coupon_id", "kind")
+
+
+def parse_broadcast_id(value):
+    """Return the broadcast pk for a "b<id>" feed id, or None"""
+    value = str(value)
+    if value.startswith(BROADCAST_ID_PREFIX) and value[len(BROADCAST_ID_PREFIX):].isdigit():
+        return int(value[len(BROADCAST_ID_PREFIX):])
+    return None
+
+
+def visible_broadcasts(user):
+    """Broadcasts sent since the user joined that they have not dismissed"""
+    dismissed = BroadcastReceipt.objects.filter(broadcast=OuterRef("pk"), user=user, dismissed=True)
+    return BroadcastNotification.objects.filter(created_at__gte=user.created_at).exclude(Exists(dismissed))
+
+
+def user_feed(user):
+    """Personal and broadcast notifications as one ordered queryset of dicts"""
+    personal = (
+        Notification.objects.filter(user=user)
+        .annotate(kind=Value("personal"))
+        .values(*FEED_FIELDS)
+        .order_by()
+    )
+    read = BroadcastReceipt.objects.filter(broadcast=OuterRef("pk"), user=user, read=True)
+    broadcasts = (
+        visible_broadcasts(user)
+        .annotate(
+            read=Exists(read),
+            order_id=Value(None, output_field=IntegerField()),
+            kind=Value("broadcast"),
+        )
+        .values(*FEED_FIELDS)
+        .order_by()
+    )
+    return personal.union(broadcasts, all=True).order_by("-created_at", "-id")
+
+
+def feed_entry(broadcast, read):
+    """A single broadcast shaped like a user_feed() row"""
+    return {
+        "id": broadcast.id,
+        "type": broadcast.type,
+        "message": broadcast.message,
+        "read": read,
+        "created_at": broadcast.created_at,
+        "order_id": None,
+        "coupon_id": broadcast.coupon_id,
+        "kind": "broadcast",
+    }
+
+
+def mark_broadcast(user, broadcast, **state):
+    """Upsert the user's receipt for a broadcast"""
+    BroadcastReceipt.objects.update_or_create(broadcast=broadcast, user=user, defaults=state)
+
+
+def dismiss_all_broadcasts(user):
+    """Dismiss every broadcast currently visible to the user with one upsert"""
+    receipts = [
+        BroadcastReceipt(broadcast_id=broadcast_id, user=user, dismissed=True)
+        for broadcast_id in visible_broadcasts(user).values_list("id", flat=True)
+    ]
+    BroadcastReceipt.objects.bulk_create(
+        receipts,
+        update_conflicts=True,
+        unique_fields=["broadcast", "user"],
+        update_fields=["dismissed", "updated_at"],
+    )
@@ -0,0 +1,59 @@
+from django.http import QueryDict
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class OptionalLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that only kicks in when the client sends ?limit=,
+    so existing clients that expect a plain list keep working.
+    """
+    default_limit = None
+    max_limit = 100
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Keyset pagination, opt-in with ?page_size=.
+
+    Follows the view's OrderingFilter (e.g. ?ordering=-price) and always adds
+    the primary key as a tie-breaker so pages stay stable for equal values.
+    """
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('name',)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id',) if ordering[0].startswith('-') else ('id',)
+        return ordering
+
+
+class ReviewCursorPagination(CursorPagination):
+    """Newest-first keyset pagination for a product's reviews"""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = ('-created_at', '-id')
+
+    def first_page(self, queryset, url):
+        """
+        (items, next link) for the first page of queryset, e.g. to embed in
+        another response. The query parameters of that response's request
+        (its own cursor or page size) are not used; the link points at url,
+        the endpoint serving the following pages.
+        """
+        page = self.paginate_queryset(queryset, FirstPageRequest(url))
+        return page, self.get_next_link()
+
+
+class FirstPageRequest:
+    """Stand-in request for ReviewCursorPagination.first_page: no query parameters, served at url"""
+
+    def __init__(self, url):
+        self.url = url
+        self.query_params = QueryDict()
+
+    def build_absolute_uri(self, location=None):
+        return self.url
@@ -0,0 +1,185 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.backends import ModelBackend
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashBusy(APIException):
+    """Raised when the hashing pool is saturated; DRF views answer it with 503"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many sign-in attempts right now, please retry shortly."
+    default_code = "password_hash_busy"
+
+
+class ConfigurablePBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the work factor taken from PASSWORD_HASH_ITERATIONS.
+
+    It keeps the pbkdf2_sha256 algorithm name, so existing hashes verify
+    with it and are re-hashed on the next login whenever their iteration
+    count differs from the setting.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_HASH_ITERATIONS", hashers.PBKDF2PasswordHasher.iterations)
+
+
+class PasswordStats:
+    """Thread-safe hashing and login timing counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hashes = 0
+            self.hash_seconds = 0.0
+            self.max_hash_seconds = 0.0
+            self.wait_seconds = 0.0
+            self.rejected = 0
+            self.in_flight = 0
+            self.logins = 0
+            self.failed_logins = 0
+            self.login_seconds = 0.0
+            self.max_login_seconds = 0.0
+            self.rehashes = 0
+
+    def count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def hashed(self, waited, elapsed):
+        with self._lock:
+            self.hashes += 1
+            self.wait_seconds += waited
+            self.hash_seconds += elapsed
+            self.max_hash_seconds = max(self.max_hash_seconds, elapsed)
+
+    def login(self, succeeded, elapsed):
+        with self._lock:
+            self.logins += 1
+            if not succeeded:
+                self.failed_logins += 1
+            self.login_seconds += elapsed
+            self.max_login_seconds = max(self.max_login_seconds, elapsed)
+
+    def as_dict(self):
+        def ms(seconds, count=1):
+            return round(seconds * 1000 / count, 2) if count else None
+
+        with self._lock:
+            return {
+                "hashes": self.hashes,
+                "avg_hash_ms": ms(self.hash_seconds, self.hashes),
+                "max_hash_ms": ms(self.max_hash_seconds),
+                "avg_queue_wait_ms": ms(self.wait_seconds, self.hashes),
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "logins": self.logins,
+                "failed_logins": self.failed_logins,
+                "avg_login_ms": ms(self.login_seconds, self.logins),
+                "max_login_ms": ms(self.max_login_seconds),
+                "rehashes": self.rehashes,
+                "iterations": ConfigurablePBKDF2PasswordHasher().iterations,
+            }
+
+
+stats = PasswordStats()
+
+
+class PasswordHashPool:
+    """
+    A bounded thread pool for password hashing.
+
+    At most PASSWORD_HASH_WORKERS hashes run at once and PASSWORD_HASH_QUEUE
+    more may wait. A request that finds the queue full waits up to
+    PASSWORD_HASH_WAIT seconds for a slot and then gets PasswordHashBusy, so
+    a burst of logins is shed with 503s instead of tying up every worker.
+    Only the hash itself runs on the pool; database work stays on the
+    request thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._config = None
+
+    def get_config(self):
+        return (
+            getattr(settings, "PASSWORD_HASH_WORKERS", 4),
+            getattr(settings, "PASSWORD_HASH_QUEUE", 16),
+            getattr(settings, "PASSWORD_HASH_WAIT", 2),
+        )
+
+    def _pool(self):
+        config = self.get_config()
+        with self._lock:
+            if self._executor is None or self._config != config:
+                workers, queue, _ = config
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+                self._slots = threading.BoundedSemaphore(workers + queue)
+                self._config = config
+            return self._executor, self._slots, config[2]
+
+    def run(self, func, *args):
+        """func(*args) on the pool; blocks until it returns"""
+        executor, slots, wait = self._pool()
+        if not slots.acquire(timeout=wait):
+            stats.count("rejected")
+            raise PasswordHashBusy()
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                stats.hashed(started - submitted, time.perf_counter() - started)
+
+        stats.count("in_flight")
+        try:
+            return executor.submit(timed).result()
+        finally:
+            stats.count("in_flight", -1)
+            slots.release()
+
+
+pool = PasswordHashPool()
+
+
+def make_password(password):
+    """django.contrib.auth.hashers.make_password, hashed on the pool"""
+    return pool.run(hashers.make_password, password)
+
+
+def check_password(password, encoded, setter=None):
+    """
+    django.contrib.auth.hashers.check_password with the verification on the
+    pool. setter(password) is called on the calling thread when the hash
+    needs upgrading, since it saves the user.
+    """
+    is_correct, must_update = pool.run(hashers.verify_password, password, encoded)
+    if setter and is_correct and must_update:
+        stats.count("rehashes")
+        setter(password)
+    return is_correct
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend that records how long each username/password login takes"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        started = time.perf_counter()
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if password is not None:
+            stats.login(user is not None, time.perf_counter() - started)
+        return user
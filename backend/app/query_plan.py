@@ -0,0 +1,55 @@
+import re
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# List endpoints checked by the query plan harness, with the kind of client
+# that calls them. Staff-only "everything" listings are left out on purpose:
+# reading a whole table is what they are for.
+LIST_ENDPOINTS = [
+    ("anonymous", "/api/categories/"),
+    ("anonymous", "/api/products/"),
+    ("anonymous", "/api/products/?ordering=-created_at"),
+    ("anonymous", "/api/products/?ordering=-average_rating"),
+    ("anonymous", "/api/ratings/"),
+    ("anonymous", "/api/privacy-policies/"),
+    ("anonymous", "/api/faqs/"),
+    ("anonymous", "/api/faqs/?category=General"),
+    ("anonymous", "/api/contacts/"),
+    ("anonymous", "/api/sliders/"),
+    ("anonymous", "/api/coupons/"),
+    ("anonymous", "/api/coupons/?code=SAVE10"),
+    ("customer", "/api/users/?user_id={user_id}"),
+    ("customer", "/api/orders/"),
+    ("customer", "/api/order-items/"),
+    ("customer", "/api/favorites/"),
+    ("customer", "/api/cart/items/"),
+    ("customer", "/api/notifications/"),
+]
+
+# "SCAN <table>" without an index is a full table scan. Ordered scans of an
+# index ("SCAN t USING INDEX ...") are fine for unfiltered listings.
+_FULL_SCAN_RE = re.compile(r"^SCAN (?!CONSTANT ROW)(\S+)$")
+
+
+def explain(sql, params=None):
+    """EXPLAIN QUERY PLAN detail lines for a query (SQLite only)"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """Tables read with a full scan in a plan from explain()"""
+    scans = []
+    for detail in plan:
+        match = _FULL_SCAN_RE.match(detail.strip())
+        if match and not match.group(1).startswith("("):
+            scans.append(match.group(1))
+    return scans
+
+
+def capture_selects(func):
+    """Run func and return the SELECT statements it sent to the database"""
+    with CaptureQueriesContext(connection) as context:
+        func()
+    return [q["sql"] for q in context.captured_queries if q["sql"].lstrip().upper().startswith("SELECT")]
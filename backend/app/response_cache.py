@@ -0,0 +1,256 @@
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+from .cache import MISSING, create_backend
+
+# How long a request waits for another thread computing the same entry
+# before computing it itself
+SINGLE_FLIGHT_TIMEOUT = 10
+
+# Response headers kept with a cached body
+CACHED_HEADERS = ("ETag", "Last-Modified")
+
+
+class _Flight:
+    """One in-progress computation of a cache entry"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = MISSING
+
+
+class ResponseCache:
+    """
+    Serialized responses keyed by route, normalized query params and the
+    versions of the models they were built from.
+
+    Every model has a version token that its save/delete receivers replace,
+    so a write invalidates all responses built from that model in O(1)
+    without knowing their keys: later lookups use a key that was never
+    stored, and the old entries age out of the LRU. Versions live in the
+    same backend as the entries, so with SharedCacheBackend a write in one
+    process invalidates the responses of all of them.
+
+    Concurrent misses on the same key are coalesced (single flight): one
+    request computes the entry, the others wait for it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+        self._config = None
+        self._flights = {}
+        self.reset_stats()
+
+    def get_config(self):
+        return (
+            getattr(settings, "RESPONSE_CACHE_BACKEND", "app.cache.LocalMemoryBackend"),
+            getattr(settings, "RESPONSE_CACHE_TIMEOUT", 600),
+            getattr(settings, "RESPONSE_CACHE_MAX_ENTRIES", 2000),
+        )
+
+    @property
+    def backend(self):
+        config = self.get_config()
+        if self._backend is None or self._config != config:
+            with self._lock:
+                if self._backend is None or self._config != config:
+                    path, timeout, max_entries = config
+                    self._backend = create_backend(
+                        path, timeout=timeout, max_entries=max_entries, key_prefix="vendora:responses"
+                    )
+                    self._config = config
+        return self._backend
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+            self.hit_seconds = 0.0
+            self.compute_seconds = 0.0
+            self.max_compute_seconds = 0.0
+
+    @staticmethod
+    def version_key(model):
+        return f"version:{model._meta.label_lower}"
+
+    def version(self, model):
+        key = self.version_key(model)
+        version = self.backend.get(key)
+        if version is MISSING:
+            # Never bumped, or the entry was evicted: start a new version,
+            # which can only cause misses, never stale hits
+            version = uuid.uuid4().hex[:12]
+            self.backend.set(key, version)
+        return version
+
+    def bump(self, *models):
+        """Invalidate every response built from these models"""
+        for model in models:
+            self.backend.set(self.version_key(model), uuid.uuid4().hex[:12])
+
+    def bump_on_commit(self, *models):
+        """
+        Bump now, so this transaction does not read its own stale entries,
+        and again after commit, so an entry computed by another request from
+        the pre-commit rows is not served.
+        """
+        self.bump(*models)
+        transaction.on_commit(lambda: self.bump(*models), robust=True)
+
+    def key(self, request, models):
+        """Route plus normalized query params plus model versions"""
+        params = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+            if any(value != "" for value in values)
+        )
+        query = "&".join(f"{name}={','.join(values)}" for name, values in params)
+        versions = ",".join(f"{model._meta.model_name}.{self.version(model)}" for model in models)
+        # The host is part of the key because payloads contain absolute URLs
+        return f"response:{request.get_host()}{request.path}?{query}#{versions}"
+
+    def get_or_compute(self, key, compute):
+        """
+        The cached value for key, computing and storing it on a miss.
+
+        compute() may return None for a value that must not be stored; the
+        requests that were waiting for it then compute their own.
+        """
+        started = time.perf_counter()
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self._record(hits=1, hit_seconds=time.perf_counter() - started)
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait(SINGLE_FLIGHT_TIMEOUT)
+            if flight.value is not MISSING and flight.value is not None:
+                self._record(coalesced=1, hit_seconds=time.perf_counter() - started)
+                return flight.value
+            return self._compute(key, compute)
+
+        try:
+            flight.value = self._compute(key, compute)
+            return flight.value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _compute(self, key, compute):
+        started = time.perf_counter()
+        value = compute()
+        if value is not None:
+            self.backend.set(key, value)
+        elapsed = time.perf_counter() - started
+        self._record(misses=1, compute_seconds=elapsed)
+        with self._lock:
+            self.max_compute_seconds = max(self.max_compute_seconds, elapsed)
+        return value
+
+    def _record(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            served = self.hits + self.coalesced
+            lookups = served + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round(served / lookups, 3) if lookups else None,
+                "avg_hit_ms": round(self.hit_seconds * 1000 / served, 3) if served else None,
+                "avg_compute_ms": round(self.compute_seconds * 1000 / self.misses, 3) if self.misses else None,
+                "max_compute_ms": round(self.max_compute_seconds * 1000, 3),
+            }
+        stats["backend"] = self.backend.stats()
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+class ResponseCacheMixin:
+    """
+    Serves anonymous GETs of the actions in response_cache_models from
+    response_cache.
+
+    response_cache_models maps an action to the models its payload is built
+    from; their versions are part of the key. Works with ConditionalGetMixin:
+    the validator headers are cached with the body, so revalidating a cached
+    response costs no queries at all.
+    """
+
+    response_cache_models = {}
+
+    def is_response_cacheable(self, request):
+        return (
+            self.action in self.response_cache_models
+            and request.method == "GET"
+            and not request.user.is_authenticated
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_response_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        computed = {}
+
+        def compute():
+            # The entry must be the full response, whatever the client's
+            # validators say; they are checked against the entry below
+            self.evaluate_preconditions = False
+            response = computed["response"] = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return None
+            headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+            # Plain containers, so the entry does not keep the serializer alive
+            data = response.data
+            data = list(data) if isinstance(data, list) else dict(data)
+            return {"data": data, "headers": headers}
+
+        key = response_cache.key(request, self.response_cache_models[self.action])
+        entry = response_cache.get_or_compute(key, compute)
+        if entry is None:
+            return computed.get("response") or handler(request, *args, **kwargs)
+
+        headers = entry["headers"]
+        if headers:
+            not_modified = get_conditional_response(
+                request,
+                etag=headers.get("ETag"),
+                last_modified=parse_http_date_safe(headers.get("Last-Modified", "")),
+            )
+            if not_modified is not None:
+                for name, value in headers.items():
+                    not_modified.headers[name] = value
+                patch_vary_headers(not_modified, ("Accept",))
+                return not_modified
+        if "response" in computed:
+            return computed["response"]
+        response = Response(entry["data"], headers=headers)
+        if headers:
+            patch_vary_headers(response, ("Accept",))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
@@ -0,0 +1,172 @@
+from abc import ABC, abstractmethod
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+from .models import Category, Product
+
+
+class SearchBackend(ABC):
+    """
+    Interface for product full-text search.
+
+    Backends receive index updates from the Product/Category signals in
+    models.py. When a backend is unavailable, ProductSearchFilter falls
+    back to DRF's icontains search.
+    """
+
+    def is_available(self):
+        return False
+
+    @abstractmethod
+    def search(self, queryset, terms):
+        """Filter and rank a Product queryset by the given search terms"""
+
+    def index_products(self, product_ids):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class NullSearchBackend(SearchBackend):
+    """No full-text index: searches always use the icontains fallback"""
+
+    def search(self, queryset, terms):
+        return queryset
+
+
+class SQLiteFTS5SearchBackend(SearchBackend):
+    """
+    SQLite FTS5 index over product name, category name and description.
+
+    Terms are matched as prefixes ("jack" finds "jacket"), all terms must
+    match, and results are ranked with bm25 weighted towards the name.
+    """
+
+    table = "app_product_fts"
+    # bm25 column weights for name, category, description
+    weights = (10.0, 5.0, 1.0)
+
+    create_sql = (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+        "name, category, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    drop_sql = f"DROP TABLE IF EXISTS {table}"
+
+    _available = None
+
+    def is_available(self):
+        if connection.vendor != "sqlite":
+            return False
+        if self._available is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table]
+                )
+                SQLiteFTS5SearchBackend._available = cursor.fetchone() is not None
+        return self._available
+
+    @staticmethod
+    def match_expression(terms):
+        """Turn user terms into an FTS5 query of quoted prefix tokens"""
+        tokens = []
+        for term in terms:
+            term = term.replace('"', '""').strip()
+            if term:
+                tokens.append(f'"{term}"*')
+        return " ".join(tokens)
+
+    def search(self, queryset, terms):
+        match = self.match_expression(terms)
+        if not match:
+            return queryset
+        table = self.table
+        product_table = queryset.model._meta.db_table
+        # The id subquery filters; the rank is then looked up by rowid for
+        # the matching rows only
+        matches = RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match])
+        rank = RawSQL(
+            f"SELECT bm25({table}, %s, %s, %s) FROM {table} "
+            f"WHERE {table} MATCH %s AND {table}.rowid = {product_table}.id",
+            [*self.weights, match],
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by("search_rank")
+
+    def _reindex(self, where="", params=()):
+        table = self.table
+        products = Product._meta.db_table
+        categories = Category._meta.db_table
+        with connection.cursor() as cursor:
+            if where:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE rowid IN (SELECT p.id FROM {products} p WHERE {where})",
+                    params,
+                )
+            else:
+                cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(
+                f"INSERT INTO {table} (rowid, name, category, description) "
+                f"SELECT p.id, p.name, c.name, p.description FROM {products} p "
+                f"JOIN {categories} c ON c.id = p.category_id"
+                + (f" WHERE {where}" if where else ""),
+                params,
+            )
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids and self.is_available():
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            self._reindex(f"p.id IN ({placeholders})", product_ids)
+
+    def index_category(self, category_id):
+        if self.is_available():
+            self._reindex("p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids and self.is_available():
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", product_ids)
+
+    def rebuild(self):
+        if connection.vendor != "sqlite":
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.create_sql)
+        SQLiteFTS5SearchBackend._available = True
+        self._reindex()
+
+
+_backend = None
+
+
+def get_search_backend():
+    """The backend named by PRODUCT_SEARCH_BACKEND"""
+    global _backend
+    path = getattr(settings, "PRODUCT_SEARCH_BACKEND", "app.search.SQLiteFTS5SearchBackend")
+    if _backend is None or _backend.__class__.__module__ + "." + _backend.__class__.__name__ != path:
+        _backend = import_string(path)()
+    return _backend
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """Drop-in SearchFilter that uses the configured full-text backend"""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        backend = get_search_backend()
+        if not backend.is_available():
+            return super().filter_queryset(request, queryset, view)
+        return backend.search(queryset, terms)
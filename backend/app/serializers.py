@@ -1,3 +1,5 @@
+from django.db.models import Prefetch
+from django.urls import reverse
 from rest_framework import serializers
 from .models import (
     User,
@@ -14,12 +16,64 @@ from .models import (
     Contact,
     Slider,
     Coupon,
-    Notification
+    Notification,
+    deferred_order_totals,
 )
+from .images import srcset
+from .notifications import BROADCAST_ID_PREFIX
+from .pagination import ReviewCursorPagination
+
+
+class EagerLoadingMixin:
+    """
+    Declares the related rows a serializer reads so views can load them up front.
+
+    select_related_fields are joined into the main query. prefetch_related_fields
+    are relation names, or (name, SerializerClass) pairs whose own plan is
+    applied to the prefetched rows.
+    """
+
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        for lookup in cls.prefetch_related_fields:
+            if isinstance(lookup, tuple):
+                name, serializer_class = lookup
+                related_model = queryset.model._meta.get_field(name).related_model
+                lookup = Prefetch(
+                    name, queryset=serializer_class.setup_eager_loading(related_model._default_manager.all())
+                )
+            queryset = queryset.prefetch_related(lookup)
+        return queryset
+
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """
+    {preset: absolute url, ..., "original": absolute url} for an image and
+    its WebP derivatives, or None without an image. source selects the
+    object holding both fields (the serialized object by default).
+    """
+
+    def __init__(self, image_field="image", variants_field="image_variants", **kwargs):
+        kwargs.setdefault("source", "*")
+        super().__init__(**kwargs)
+        self.image_field = image_field
+        self.variants_field = variants_field
+
+    def to_representation(self, value):
+        if value is None:
+            return None
+        return srcset(
+            getattr(value, self.variants_field), getattr(value, self.image_field), self.context.get("request")
+        )
 
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
+    profile_picture_srcset = ImageSrcsetField("profile_picture", "profile_picture_variants")
 
     class Meta:
         model = User
@@ -34,6 +88,7 @@ class UserSerializer(serializers.ModelSerializer):
             "phone",
             "address",
             "profile_picture",
+            "profile_picture_srcset",
             "created_at",
         ]
         read_only_fields = ["id", "created_at"]
@@ -59,14 +114,17 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class CategorySerializer(serializers.ModelSerializer):
+    image_srcset = ImageSrcsetField()
+
     class Meta:
         model = Category
-        fields = ["id", "name", "image", "created_at"]
+        fields = ["id", "name", "image", "image_srcset", "created_at"]
         read_only_fields = ["id", "created_at"]
 
 
-class RatingSerializer(serializers.ModelSerializer):
+class RatingSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     username = serializers.ReadOnlyField(source="user.username")
+    select_related_fields = ("user",)
 
     class Meta:
         model = Rating
@@ -82,10 +140,34 @@ class RatingSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "created_at", "username"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Accepts fields=[...] to serialize only that subset of the declared fields"""
+
+    @classmethod
+    def select_fields(cls, names):
+        """
+        The requested names that are declared fields, or None to serialize
+        every field. Unknown names are ignored rather than producing empty
+        objects.
+        """
+        keep = [name for name in names or () if name in cls.Meta.fields]
+        return keep or None
+
+    def __init__(self, *args, **kwargs):
+        fields = self.select_fields(kwargs.pop("fields", None))
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProductSerializer(EagerLoadingMixin, SparseFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.ReadOnlyField(source="category.name")
     average_rating = serializers.SerializerMethodField()
+    rating_histogram = serializers.ReadOnlyField()
     image_url = serializers.SerializerMethodField()
+    image_srcset = ImageSrcsetField()
+    select_related_fields = ("category",)
 
     class Meta:
         model = Product
@@ -96,15 +178,20 @@ class ProductSerializer(serializers.ModelSerializer):
             "price",
             "image",
             "image_url",
+            "image_srcset",
             "category",
             "stock",
             "color",
             "size",
             "category_name",
             "average_rating",
+            "rating_count",
+            "rating_histogram",
             "created_at",
         ]
-        read_only_fields = ["id", "created_at", "category_name", "average_rating", "image_url"]
+        read_only_fields = [
+            "id", "created_at", "category_name", "average_rating", "rating_count", "rating_histogram", "image_url",
+        ]
 
     def get_average_rating(self, obj):
         try:
@@ -122,16 +209,43 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class ProductDetailSerializer(ProductSerializer):
-    ratings = RatingSerializer(many=True, read_only=True)
+    """
+    Product with the first page of its reviews. The rating summary comes from
+    the stored aggregates and later pages from the reviews action, so the
+    cost does not grow with the number of reviews.
+    """
+    ratings = serializers.SerializerMethodField()
+    ratings_next = serializers.SerializerMethodField()
 
     class Meta(ProductSerializer.Meta):
-        fields = ProductSerializer.Meta.fields + ["ratings"]
+        fields = ProductSerializer.Meta.fields + ["ratings", "ratings_next"]
+
+    def first_review_page(self, obj):
+        """(reviews, next link) for the newest reviews, fetched once per product"""
+        pages = self.__dict__.setdefault("_review_pages", {})
+        if obj.pk not in pages:
+            reviews = RatingSerializer.setup_eager_loading(obj.ratings.all())
+            url = reverse("product-reviews", args=[obj.pk])
+            request = self.context.get("request")
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            pages[obj.pk] = ReviewCursorPagination().first_page(reviews, url)
+        return pages[obj.pk]
 
+    def get_ratings(self, obj):
+        reviews, _ = self.first_review_page(obj)
+        return RatingSerializer(reviews, many=True, context=self.context).data
 
-class OrderItemSerializer(serializers.ModelSerializer):
+    def get_ratings_next(self, obj):
+        _, link = self.first_review_page(obj)
+        return link
+
+
+class OrderItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     product_name = serializers.ReadOnlyField(source="product.name")
     product_image = serializers.ImageField(source="product.image", read_only=True)
     subtotal = serializers.SerializerMethodField()
+    select_related_fields = ("product",)
 
     class Meta:
         model = OrderItem
@@ -156,10 +270,12 @@ class OrderItemCreateSerializer(serializers.ModelSerializer):
         fields = ["product", "quantity"]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     user_name = serializers.ReadOnlyField(source="user.get_full_name")
     order_items = OrderItemSerializer(many=True, read_only=True)
     items = OrderItemCreateSerializer(many=True, write_only=True, required=False)
+    select_related_fields = ("user",)
+    prefetch_related_fields = (("order_items", OrderItemSerializer),)
 
     class Meta:
         model = Order
@@ -186,11 +302,12 @@ class OrderSerializer(serializers.ModelSerializer):
         items_data = validated_data.pop("items", [])
         order = Order.objects.create(**validated_data)
 
-        # Create order items if provided
-        for item_data in items_data:
-            product = item_data.get("product")
-            quantity = item_data.get("quantity", 1)
-            order.add_product(product, quantity)
+        # Create order items if provided, recomputing the total only once
+        with deferred_order_totals():
+            for item_data in items_data:
+                product = item_data.get("product")
+                quantity = item_data.get("quantity", 1)
+                order.add_product(product, quantity)
 
         return order
 
@@ -202,11 +319,12 @@ class OrderSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
 
-        # Add new items if provided
-        for item_data in items_data:
-            product = item_data.get("product")
-            quantity = item_data.get("quantity", 1)
-            instance.add_product(product, quantity)
+        # Add new items if provided, recomputing the total only once
+        with deferred_order_totals():
+            for item_data in items_data:
+                product = item_data.get("product")
+                quantity = item_data.get("quantity", 1)
+                instance.add_product(product, quantity)
 
         return instance
 
@@ -215,6 +333,7 @@ class CartItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
     product_price = serializers.SerializerMethodField()
     product_image = serializers.SerializerMethodField()
+    product_image_srcset = ImageSrcsetField(source="product")
     subtotal = serializers.SerializerMethodField()
 
     class Meta:
@@ -225,6 +344,7 @@ class CartItemSerializer(serializers.ModelSerializer):
             "product_name",
             "product_price",
             "product_image",
+            "product_image_srcset",
             "quantity",
             "subtotal",
             "created_at",
@@ -254,7 +374,7 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+    items = CartItemSerializer(source="get_items", many=True, read_only=True)
     total = serializers.SerializerMethodField()
 
     class Meta:
@@ -266,8 +386,9 @@ class CartSerializer(serializers.ModelSerializer):
         return obj.get_total()
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
+    select_related_fields = ("product__category",)
 
     class Meta:
         model = Favorite
@@ -297,10 +418,14 @@ class ContactSerializer(serializers.ModelSerializer):
 
 class SliderSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Slider
-        fields = ('id', 'title', 'description', 'image', 'image_url', 'category', 'is_active', 'created_at', 'updated_at')
+        fields = (
+            'id', 'title', 'description', 'image', 'image_url', 'image_srcset', 'category', 'is_active',
+            'created_at', 'updated_at',
+        )
         read_only_fields = ('created_at', 'updated_at')
 
     def get_image_url(self, obj):
@@ -324,3 +449,17 @@ class NotificationSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
+class NotificationFeedSerializer(serializers.Serializer):
+    """Serializes user_feed() rows with the same shape as NotificationSerializer"""
+    id = serializers.SerializerMethodField()
+    type = serializers.CharField()
+    message = serializers.CharField()
+    read = serializers.BooleanField()
+    created_at = serializers.DateTimeField()
+    order = serializers.IntegerField(source="order_id", allow_null=True)
+    coupon = serializers.IntegerField(source="coupon_id", allow_null=True)
+
+    def get_id(self, obj):
+        if obj["kind"] == "broadcast":
+            return f"{BROADCAST_ID_PREFIX}{obj['id']}"
+        return obj["id"]
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.dispatch import Signal
+
+# Sent after queryset-level UPDATEs to products, which bypass post_save.
+# Receivers get product_ids and fields, the names of the changed columns.
+products_changed = Signal()
+
+
+def send_products_changed(sender, product_ids, fields):
+    """Send products_changed once the current transaction commits"""
+    # Listeners re-read the rows, so only tell them once the change is committed.
+    # robust: a failing listener is logged instead of failing the committed write.
+    product_ids = list(product_ids)
+    fields = list(fields)
+    transaction.on_commit(
+        lambda: products_changed.send(sender=sender, product_ids=product_ids, fields=fields),
+        robust=True,
+    )
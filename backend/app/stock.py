@@ -0,0 +1,167 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest, Now
+from .models import Order, OrderItem, Product
+from .signals import send_products_changed
+
+
+class InsufficientStock(Exception):
+    """Raised when a reservation asks for more units than are in stock"""
+
+    def __init__(self, product, requested):
+        self.product = product
+        self.requested = requested
+        super().__init__(
+            f"Not enough stock for {product.name}. Available: {product.stock}"
+        )
+
+
+def _stock_changed(product_ids):
+    send_products_changed(Product, product_ids, ["stock"])
+
+
+def _quantity_case(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def reserve_stock(quantities):
+    """
+    Take stock for {product_id: quantity} with one conditional UPDATE.
+
+    The UPDATE only touches rows that still have enough stock, so concurrent
+    reservations can never drive stock below zero. If any product is short,
+    nothing is reserved and InsufficientStock is raised.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return
+
+    amount = _quantity_case(quantities)
+    with transaction.atomic():
+        updated = Product.objects.filter(pk__in=quantities, stock__gte=amount).update(
+            stock=F("stock") - amount, updated_at=Now()
+        )
+        if updated != len(quantities):
+            # Only the failure path pays for a lookup, to report the short product
+            for product in Product.objects.filter(pk__in=quantities).only("id", "name", "stock"):
+                if product.stock < quantities[product.pk]:
+                    raise InsufficientStock(product, quantities[product.pk])
+            raise InsufficientStock(Product(name="unknown product", stock=0), 0)
+        _stock_changed(quantities)
+
+
+def release_stock(quantities):
+    """Return stock for {product_id: quantity} with one UPDATE"""
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return
+
+    amount = _quantity_case(quantities)
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F("stock") + amount, updated_at=Now()
+    )
+    _stock_changed(quantities)
+
+
+def check_stock(quantities):
+    """Raise InsufficientStock if {product_id: quantity} is not in stock, without taking it"""
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    for product in Product.objects.filter(pk__in=quantities).only("id", "name", "stock"):
+        if product.stock < quantities[product.pk]:
+            raise InsufficientStock(product, quantities[product.pk])
+
+
+def order_quantities(order, field="quantity"):
+    """Units per product for an order, summed in SQL from quantity or reserved_quantity"""
+    rows = (
+        OrderItem.objects.filter(order=order)
+        .values("product_id")
+        .annotate(total=Sum(field))
+        .values_list("product_id", "total")
+    )
+    return dict(rows)
+
+
+def reserve_order_stock(order):
+    """
+    Reserve stock for an order unless it already holds a reservation.
+
+    Returns True if stock was taken by this call. Safe to call repeatedly.
+    """
+    with transaction.atomic():
+        claimed = Order.objects.filter(pk=order.pk, stock_reserved=False).update(
+            stock_reserved=True
+        )
+        if not claimed:
+            order.stock_reserved = True
+            return False
+        reserve_stock(order_quantities(order))
+        # Remember what was taken, so lines added later are not given back
+        OrderItem.objects.filter(order=order).update(reserved_quantity=F("quantity"))
+    order.stock_reserved = True
+    return True
+
+
+def release_order_stock(order):
+    """
+    Give back the stock held by an order, if it holds any.
+
+    Only the units recorded as reserved are returned, not the current line
+    quantities, which may have grown since the reservation.
+
+    Returns True if stock was returned by this call. Safe to call repeatedly.
+    """
+    with transaction.atomic():
+        claimed = Order.objects.filter(pk=order.pk, stock_reserved=True).update(
+            stock_reserved=False
+        )
+        if not claimed:
+            order.stock_reserved = False
+            return False
+        release_stock(order_quantities(order, "reserved_quantity"))
+        OrderItem.objects.filter(order=order).update(reserved_quantity=0)
+    order.stock_reserved = False
+    return True
+
+
+def sync_order_line_stock(order_id, item_ids=None):
+    """
+    Match the reservation of a reserved order's lines to their quantities.
+
+    Lines added or raised since the reservation take the extra units from
+    stock, lowered lines give the difference back. Raises InsufficientStock
+    with nothing changed if a product is short. Does nothing for orders that
+    hold no reservation.
+    """
+    lines = OrderItem.objects.filter(order_id=order_id, order__stock_reserved=True).exclude(
+        reserved_quantity=F("quantity")
+    )
+    if item_ids is not None:
+        lines = lines.filter(pk__in=item_ids)
+    taken, returned = {}, {}
+    with transaction.atomic():
+        rows = list(lines.values_list("pk", "product_id", "quantity", "reserved_quantity"))
+        if not rows:
+            return
+        for _, product_id, quantity, reserved in rows:
+            difference = max(quantity, 0) - reserved
+            target = taken if difference > 0 else returned
+            target[product_id] = target.get(product_id, 0) + abs(difference)
+        reserve_stock(taken)
+        release_stock(returned)
+        OrderItem.objects.filter(pk__in=[row[0] for row in rows]).update(
+            reserved_quantity=Greatest(F("quantity"), Value(0))
+        )
+
+
+def release_order_line_stock(item):
+    """
+    Give back the units reserved for an order line that is being deleted,
+    unless its order was delivered and the units have left the warehouse.
+    """
+    if item.reserved_quantity and not Order.objects.filter(pk=item.order_id, status="Delivered").exists():
+        release_stock({item.product_id: item.reserved_quantity})
@@ -1,3 +1,1797 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import io
+import os
+import tempfile
+import threading
+import time
+from django.db import OperationalError, connection, connections, transaction
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from PIL import Image
+from .authentication import issue_access_token, revocations, token_cache
+from .autocomplete import PrefixIndex, autocomplete
+from .cache import MISSING, LocalMemoryBackend, SharedCacheBackend
+from .cart_cache import cart_cache
+from .carts import CartViewSet
+from .cart_ops import merge_carts, merge_into_order
+from .auth import sync_cart_on_login
+from .checkout import CheckoutError, checkout_cart
+from .checks import check_access_token_revocations
+from .facets import facets as product_facets
+from . import query_plan
+from .notifications import stats as fanout_stats
+from .home_feed import HomeFeed, home_feed
+from .images import stats as image_stats
+from .media import CONTENT_HASHED_NAME_RE
+from .response_cache import ResponseCache, response_cache
+from . import passwords
+from .stock import InsufficientStock, release_order_stock, reserve_order_stock, reserve_stock
+from .models import (
+    User, Category, Product, Rating, Cart, CartItem, Order, OrderItem, Coupon, Notification,
+    BroadcastNotification, BroadcastReceipt, FAQ, PrivacyPolicy, Slider, deferred_order_totals,
+)
 
-# Create your tests here.
+
+def create_user(username="alice", **extra_fields):
+    return User.objects.create_user(
+        username=username,
+        email=f"{username}@example.com",
+        password="secret-pass-123",
+        first_name=username.title(),
+        last_name="Tester",
+        **extra_fields,
+    )
+
+
+def create_products(count, stock=10, price="10.00", category=None):
+    if category is None:
+        category, _ = Category.objects.get_or_create(name="General")
+    return [
+        Product.objects.create(
+            name=f"Product {i}",
+            description=f"Description {i}",
+            price=Decimal(price),
+            category=category,
+            stock=stock,
+        )
+        for i in range(count)
+    ]
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cart_cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_cart(self, products, quantity=2):
+        cart = Cart.objects.get(user=self.user)
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product=p, quantity=quantity) for p in products]
+        )
+        return cart
+
+    def checkout_query_count(self, line_count):
+        cart_cache.clear()
+        CartItem.objects.filter(cart__user=self.user).delete()
+        self.fill_cart(create_products(line_count))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post("/api/cart/checkout/")
+        self.assertEqual(response.status_code, 201, response.data)
+        return len(ctx.captured_queries)
+
+    def test_checkout_creates_order_and_clears_cart(self):
+        products = create_products(3, price="5.50")
+        cart = self.fill_cart(products, quantity=2)
+
+        response = self.client.post("/api/cart/checkout/")
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(id=response.data["order_id"])
+        self.assertEqual(order.total_price, Decimal("33.00"))
+        self.assertEqual(order.order_items.count(), 3)
+        self.assertEqual(
+            set(order.order_items.values_list("price", flat=True)), {Decimal("5.50")}
+        )
+        self.assertFalse(cart.items.exists())
+
+    def test_checkout_rejects_insufficient_stock(self):
+        products = create_products(2, stock=1)
+        cart = self.fill_cart(products, quantity=2)
+
+        response = self.client.post("/api/cart/checkout/")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Not enough stock", response.data["error"])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.items.count(), 2)
+
+    def test_checkout_rejects_empty_cart(self):
+        response = self.client.post("/api/cart/checkout/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["error"], "Cart is empty")
+
+    def test_checkout_query_count_is_independent_of_cart_size(self):
+        self.assertEqual(self.checkout_query_count(1), self.checkout_query_count(40))
+
+
+class OrderTotalTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.order = Order.objects.create(user=self.user)
+
+    def test_item_save_and_delete_update_total(self):
+        product = create_products(1, price="4.00")[0]
+        item = OrderItem.objects.create(order=self.order, product=product, quantity=3)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("12.00"))
+
+        item.delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("0"))
+
+    def test_deferred_block_recomputes_each_order_once(self):
+        products = create_products(10, price="2.50")
+        with CaptureQueriesContext(connection) as ctx:
+            with deferred_order_totals():
+                for product in products:
+                    OrderItem.objects.create(order=self.order, product=product, quantity=2)
+        totals = [q for q in ctx.captured_queries if "SUM" in q["sql"]]
+        self.assertEqual(len(totals), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("50.00"))
+
+    def test_add_product_merges_quantities(self):
+        product = create_products(1, price="3.00")[0]
+        self.order.add_product(product, 2)
+        self.order.add_product(product, 1)
+        self.assertEqual(self.order.order_items.get().quantity, 3)
+        self.assertEqual(self.order.total_price, Decimal("9.00"))
+
+    def test_total_update_does_not_emit_status_notifications(self):
+        self.order.status = "Shipped"
+        self.order.save()
+        product = create_products(1)[0]
+        self.order.add_product(product, 1)
+        self.assertEqual(
+            self.user.notifications.filter(type="order_shipped").count(), 1
+        )
+
+    def test_order_create_with_items_uses_single_recompute(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        products = create_products(5, price="1.00")
+        payload = {
+            "user": self.user.id,
+            "status": "Pending",
+            "items": [{"product": p.id, "quantity": 2} for p in products],
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.post("/api/orders/", payload, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data["total_price"]), Decimal("10.00"))
+        totals = [q for q in ctx.captured_queries if "SUM" in q["sql"]]
+        self.assertEqual(len(totals), 1)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_products(1, stock=5)[0]
+
+    def place_order(self, quantity):
+        cart = Cart.objects.get(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return checkout_cart(cart, self.user)
+
+    def test_checkout_reserves_stock(self):
+        order = self.place_order(3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+        self.assertTrue(order.stock_reserved)
+
+    def test_reserve_stock_is_all_or_nothing(self):
+        other = create_products(1, stock=1)[0]
+        with self.assertRaises(InsufficientStock):
+            reserve_stock({self.product.id: 2, other.id: 2})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_reserve_stock_uses_a_single_update(self):
+        products = create_products(20, stock=3)
+        with CaptureQueriesContext(connection) as ctx:
+            reserve_stock({p.id: 1 for p in products})
+        statements = [q["sql"] for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+
+    def test_cancel_releases_stock_once(self):
+        order = self.place_order(4)
+        response = self.client.post(f"/api/orders/{order.id}/cancel/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(release_order_stock(order))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_units_added_to_a_reserved_order_are_taken_from_stock(self):
+        order = self.place_order(2)
+        merge_into_order(order, {self.product.id: 2})
+        order.add_product(self.product, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(list(order.order_items.values_list("quantity", "reserved_quantity")), [(5, 5)])
+
+        with self.assertRaises(InsufficientStock):
+            merge_into_order(order, {self.product.id: 1})
+        with self.assertRaises(InsufficientStock):
+            order.add_product(self.product, 1)
+        self.assertEqual(order.order_items.get().quantity, 5)
+
+        self.assertTrue(release_order_stock(order))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertEqual(list(order.order_items.values_list("reserved_quantity", flat=True)), [0])
+
+    def test_deleted_lines_give_their_stock_back(self):
+        order = self.place_order(3)
+        other = create_products(1, stock=5)[0]
+        order.add_product(other, 2)
+        response = self.client.delete(f"/api/order-items/{order.order_items.get(product=other).id}/")
+        self.assertEqual(response.status_code, 204)
+        other.refresh_from_db()
+        self.assertEqual(other.stock, 5)
+
+        response = self.client.patch(f"/api/order-items/{order.order_items.get().id}/", {"quantity": 6})
+        self.assertEqual(response.status_code, 400)
+        self.client.post(f"/api/orders/{order.id}/cancel/")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_delivering_without_stock_keeps_the_order_unchanged(self):
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=6)
+        order.status = "Delivered"
+        with self.assertRaises(ValidationError):
+            order.full_clean()
+        with self.assertRaises(InsufficientStock):
+            order.save()
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((order.status, order.stock_reserved, self.product.stock), ("Pending", False, 5))
+
+    def test_repeated_delivered_saves_are_idempotent(self):
+        order = self.place_order(2)
+        order.status = "Delivered"
+        order.save()
+        order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_unreserved_order_takes_stock_on_ship(self):
+        self.user.is_staff = True
+        self.user.save()
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=5)
+
+        response = self.client.post(f"/api/orders/{order.id}/ship/")
+        self.assertEqual(response.status_code, 200, response.data)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertFalse(reserve_order_stock(order))
+        self.assertTrue(release_order_stock(order))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_ship_rejects_insufficient_stock(self):
+        self.user.is_staff = True
+        self.user.save()
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=6)
+
+        response = self.client.post(f"/api/orders/{order.id}/ship/")
+        self.assertEqual(response.status_code, 400)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "Pending")
+        self.assertFalse(order.stock_reserved)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    shoppers = 12
+    stock = 5
+
+    def checkout(self, user_id):
+        try:
+            for _ in range(100):
+                try:
+                    user = User.objects.get(id=user_id)
+                    return checkout_cart(Cart.objects.get(user=user), user).id
+                except OperationalError:
+                    # SQLite serializes writers, so retry like a client would
+                    time.sleep(0.01)
+            return None
+        except CheckoutError:
+            return None
+        finally:
+            connections.close_all()
+
+    def test_concurrent_checkouts_never_oversell(self):
+        product = create_products(1, stock=self.stock)[0]
+        user_ids = []
+        for i in range(self.shoppers):
+            user = User.objects.create(
+                username=f"shopper{i}", email=f"shopper{i}@example.com"
+            )
+            CartItem.objects.create(cart=user.cart, product=product, quantity=1)
+            user_ids.append(user.id)
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            order_ids = [i for i in pool.map(self.checkout, user_ids) if i]
+
+        product.refresh_from_db()
+        self.assertEqual(len(order_ids), self.stock)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(
+            OrderItem.objects.filter(product=product).count(), self.stock
+        )
+
+        # The query count per checkout stays bounded regardless of contention
+        user = User.objects.create(username="late", email="late@example.com")
+        product.stock = 1
+        product.save()
+        CartItem.objects.create(cart=user.cart, product=product, quantity=1)
+        with CaptureQueriesContext(connection) as ctx:
+            checkout_cart(user.cart, user)
+        # 10 for the checkout, 1 on commit to drop cached carts holding the product
+        self.assertLessEqual(len(ctx.captured_queries), 11)
+
+
+def create_coupon(code="SAVE10", **extra_fields):
+    now = timezone.now()
+    return Coupon.objects.create(
+        code=code,
+        discount_value=Decimal("10"),
+        start_date=now - timezone.timedelta(days=1),
+        end_date=now + timezone.timedelta(days=1),
+        **extra_fields,
+    )
+
+
+@override_settings(COUPON_NOTIFICATION_DELIVERY="fanout", NOTIFICATION_FANOUT_BATCH_SIZE=10)
+class CouponFanoutTests(TestCase):
+    def setUp(self):
+        User.objects.bulk_create(
+            [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(25)]
+        )
+        User.objects.create(username="inactive", email="inactive@example.com", is_active=False)
+        fanout_stats.reset()
+
+    def test_coupon_notifies_active_users_in_batches(self):
+        with CaptureQueriesContext(connection) as ctx:
+            coupon = create_coupon()
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "app_notification"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Notification.objects.filter(coupon=coupon).count(), 25)
+        self.assertFalse(Notification.objects.filter(user__is_active=False).exists())
+
+    def test_inactive_coupon_notifies_nobody(self):
+        create_coupon(is_active=False)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_stats_report_progress(self):
+        create_coupon()
+        report = fanout_stats.as_dict()
+        self.assertEqual(report["jobs_completed"], 1)
+        self.assertEqual(report["last"]["total"], 25)
+        self.assertEqual(report["last"]["done"], 25)
+
+
+class BroadcastNotificationTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_coupon_is_stored_once(self):
+        create_user("bob")
+        coupon = create_coupon()
+        self.assertEqual(BroadcastNotification.objects.filter(coupon=coupon).count(), 1)
+        self.assertFalse(Notification.objects.filter(type="coupon").exists())
+
+    def test_feed_merges_personal_and_broadcast_newest_first(self):
+        order = Order.objects.create(user=self.user)
+        coupon = create_coupon()
+
+        response = self.client.get("/api/notifications/")
+
+        self.assertEqual(response.status_code, 200)
+        broadcast = BroadcastNotification.objects.get()
+        self.assertEqual(
+            [item["id"] for item in response.data],
+            [f"b{broadcast.id}", Notification.objects.get(order=order).id],
+        )
+        self.assertEqual(response.data[0]["coupon"], coupon.id)
+        self.assertFalse(response.data[0]["read"])
+        self.assertEqual(response.data[1]["order"], order.id)
+
+    def test_feed_hides_broadcasts_sent_before_user_joined(self):
+        create_coupon()
+        late_user = create_user("late")
+        self.client.force_authenticate(late_user)
+        self.assertEqual(self.client.get("/api/notifications/").data, [])
+
+    def test_feed_paginates_on_request(self):
+        for i in range(3):
+            create_coupon(code=f"CODE{i}")
+        Order.objects.create(user=self.user)
+
+        response = self.client.get("/api/notifications/?limit=2")
+
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_read_broadcast_only_for_current_user(self):
+        create_coupon()
+        other = create_user("bob")
+        broadcast = BroadcastNotification.objects.get()
+
+        response = self.client.put(f"/api/notifications/b{broadcast.id}/read/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["read"])
+        self.assertTrue(self.client.get("/api/notifications/").data[0]["read"])
+        self.assertFalse(BroadcastReceipt.objects.filter(user=other).exists())
+
+    def test_read_personal_notification(self):
+        order = Order.objects.create(user=self.user)
+        notification = Notification.objects.get(order=order)
+        response = self.client.put(f"/api/notifications/{notification.id}/read/")
+        self.assertEqual(response.status_code, 200)
+        notification.refresh_from_db()
+        self.assertTrue(notification.read)
+
+    def test_delete_broadcast_dismisses_it(self):
+        create_coupon()
+        broadcast = BroadcastNotification.objects.get()
+        response = self.client.delete(f"/api/notifications/b{broadcast.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get("/api/notifications/").data, [])
+        self.assertTrue(BroadcastNotification.objects.exists())
+
+    def test_clear_all_removes_personal_and_dismisses_broadcasts(self):
+        create_coupon()
+        create_coupon(code="OTHER")
+        Order.objects.create(user=self.user)
+        BroadcastReceipt.objects.create(
+            broadcast=BroadcastNotification.objects.first(), user=self.user, read=True
+        )
+
+        response = self.client.delete("/api/notifications/clear_all/")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get("/api/notifications/").data, [])
+        self.assertEqual(BroadcastReceipt.objects.filter(user=self.user, dismissed=True).count(), 2)
+
+
+class ProductListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name="Shoes")
+        self.products = [
+            Product.objects.create(
+                name=f"Shoe {i}", description="Long text " * 50, price=Decimal(p),
+                category=category, stock=1,
+            )
+            for i, p in enumerate(["5.00", "3.00", "3.00", "9.00", "1.00", "3.00", "7.00"])
+        ]
+
+    def collect_pages(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(response.data["results"])
+            url = response.data["next"]
+        return seen
+
+    def test_list_is_unpaginated_by_default(self):
+        response = self.client.get("/api/products/")
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_cursor_pages_cover_catalog_once_in_order(self):
+        seen = self.collect_pages("/api/products/?page_size=2&ordering=price")
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len({item["id"] for item in seen}), 7)
+        prices = [Decimal(item["price"]) for item in seen]
+        self.assertEqual(prices, sorted(prices))
+
+    def test_cursor_pages_descending(self):
+        seen = self.collect_pages("/api/products/?page_size=3&ordering=-price")
+        prices = [Decimal(item["price"]) for item in seen]
+        self.assertEqual(len(set(item["id"] for item in seen)), 7)
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+    def test_sparse_fields(self):
+        response = self.client.get("/api/products/?fields=id,name,price,image_url")
+        self.assertEqual(set(response.data[0]), {"id", "name", "price", "image_url"})
+
+    def test_unknown_sparse_fields_are_ignored(self):
+        response_cache.clear()
+        with CaptureQueriesContext(connection) as full:
+            self.client.get("/api/products/")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/products/?fields=bogus")
+        self.assertIn("description", response.data[0])
+        # description is not deferred, so it is not loaded row by row
+        self.assertEqual(len(context.captured_queries), len(full.captured_queries))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.outerwear = Category.objects.create(name="Outerwear")
+        self.tops = Category.objects.create(name="Tops")
+        self.jacket = Product.objects.create(
+            name="Denim Jacket", description="Classic cut", price=Decimal("50"), category=self.outerwear
+        )
+        self.shirt = Product.objects.create(
+            name="Linen Shirt", description="Pairs well with a jacket", price=Decimal("20"), category=self.tops
+        )
+
+    def search(self, term):
+        response = self.client.get("/api/products/", {"search": term})
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data]
+
+    def test_prefix_match_ranks_name_hits_first(self):
+        self.assertEqual(self.search("jack"), [self.jacket.id, self.shirt.id])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search("linen jack"), [self.shirt.id])
+
+    def test_index_follows_product_updates_and_deletes(self):
+        self.jacket.name = "Wool Coat"
+        self.jacket.description = "Warm"
+        self.jacket.save()
+        self.assertEqual(self.search("coat"), [self.jacket.id])
+        self.assertEqual(self.search("denim"), [])
+
+        self.jacket.delete()
+        self.assertEqual(self.search("coat"), [])
+
+    def test_category_rename_reindexes_products(self):
+        self.tops.name = "Shirting"
+        self.tops.save()
+        self.assertEqual(self.search("shirting"), [self.shirt.id])
+
+    def test_quotes_in_terms_are_escaped(self):
+        self.assertEqual(self.search('"denim'), [self.jacket.id])
+
+    def test_explicit_ordering_overrides_rank(self):
+        response = self.client.get("/api/products/", {"search": "jack", "ordering": "price"})
+        self.assertEqual([item["id"] for item in response.data], [self.shirt.id, self.jacket.id])
+
+    @override_settings(PRODUCT_SEARCH_BACKEND="app.search.NullSearchBackend")
+    def test_falls_back_to_icontains_search(self):
+        self.assertEqual(set(self.search("jacket")), {self.jacket.id, self.shirt.id})
+        self.assertEqual(self.search("jack linen"), [self.shirt.id])
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        autocomplete.reset()
+        self.addCleanup(autocomplete.reset)
+        self.client = APIClient()
+        self.category = Category.objects.create(name="Jackets")
+        self.denim = Product.objects.create(
+            name="Denim Jacket", description="", price=Decimal("50"), category=self.category,
+            average_rating=Decimal("3.5"),
+        )
+        self.leather = Product.objects.create(
+            name="Leather Jacket", description="", price=Decimal("90"), category=self.category,
+            average_rating=Decimal("4.8"),
+        )
+
+    def suggest(self, query, **params):
+        response = self.client.get("/api/products/autocomplete/", {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_prefix_suggestions_ranked_by_popularity(self):
+        data = self.suggest("jac")
+        self.assertEqual([p["id"] for p in data["products"]], [self.leather.id, self.denim.id])
+        self.assertEqual(data["categories"], [{"id": self.category.id, "label": "Jackets"}])
+
+    def test_every_word_must_match(self):
+        data = self.suggest("den jack")
+        self.assertEqual([p["id"] for p in data["products"]], [self.denim.id])
+
+    def test_index_is_patched_from_signals(self):
+        self.suggest("jac")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.denim.name = "Denim Vest"
+            self.denim.save()
+            Product.objects.create(name="Jacquard Scarf", description="", price=Decimal("5"), category=self.category)
+            self.leather.delete()
+
+        labels = [p["label"] for p in self.suggest("jac")["products"]]
+        self.assertEqual(labels, ["Jacquard Scarf"])
+        self.assertEqual([p["label"] for p in self.suggest("vest")["products"]], ["Denim Vest"])
+
+    def test_category_rename_updates_product_suggestions(self):
+        self.suggest("jac")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Outerwear"
+            self.category.save()
+        self.assertEqual(self.suggest("denim")["products"][0]["category"], "Outerwear")
+        self.assertEqual(self.suggest("outer")["categories"][0]["label"], "Outerwear")
+
+    def test_rolled_back_writes_leave_the_index_alone(self):
+        self.suggest("jac")
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Product.objects.create(name="Jacquard Scarf", description="", price=Decimal("5"), category=self.category)
+                self.leather.delete()
+                raise RuntimeError
+        labels = [p["label"] for p in self.suggest("jac")["products"]]
+        self.assertEqual(labels, ["Leather Jacket", "Denim Jacket"])
+
+    def test_limit(self):
+        self.assertEqual(len(self.suggest("jacket", limit=1)["products"]), 1)
+
+    def test_index_is_bounded(self):
+        index = PrefixIndex(max_entries=2)
+        index.upsert(1, "alpha", score=1)
+        index.upsert(2, "alpine", score=3)
+        index.upsert(3, "alps", score=2)
+        self.assertEqual([e["id"] for e in index.search("al")], [2, 3])
+        self.assertEqual(index.stats()["evictions"], 1)
+        self.assertGreater(index.stats()["memory_bytes"], 0)
+        # Rescoring an entry keeps eviction order correct
+        index.upsert(2, "alpine", score=0.5)
+        index.upsert(4, "alpaca", score=1.5)
+        self.assertEqual([e["id"] for e in index.search("al")], [3, 4])
+        index.upsert(5, "alder", score=0.1)
+        self.assertEqual(len(index), 2)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        product_facets.reset()
+        self.addCleanup(product_facets.reset)
+        self.client = APIClient()
+        self.shirts = Category.objects.create(name="Shirts")
+        self.shoes = Category.objects.create(name="Shoes")
+
+        def make(name, category, price, color, stock=5, rating="0"):
+            return Product.objects.create(
+                name=name, description="", price=Decimal(price), category=category,
+                color=color, size="M", stock=stock, average_rating=Decimal(rating),
+            )
+
+        self.red_shirt = make("Red Shirt", self.shirts, "20", "red", rating="4.5")
+        self.blue_shirt = make("Blue Shirt", self.shirts, "30", "blue", stock=0)
+        self.red_shoe = make("Red Shoe", self.shoes, "80", "red", rating="3.2")
+
+    def browse(self, **params):
+        response = self.client.get("/api/products/facets/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def counts(self, data, dimension):
+        return {c["label"]: c["count"] for c in data["facets"][dimension]}
+
+    def test_unfiltered_counts(self):
+        data = self.browse()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual([p["name"] for p in data["results"]], ["Blue Shirt", "Red Shirt", "Red Shoe"])
+        self.assertEqual(self.counts(data, "category"), {"Shirts": 2, "Shoes": 1})
+        self.assertEqual(self.counts(data, "price"), {"0-25": 1, "25-50": 1, "50-100": 1})
+        self.assertEqual(self.counts(data, "rating"), {"1 & up": 2, "2 & up": 2, "3 & up": 2, "4 & up": 1})
+        self.assertEqual(self.counts(data, "in_stock"), {"In stock": 2, "Out of stock": 1})
+
+    def test_counts_are_disjunctive(self):
+        data = self.browse(color="red")
+        self.assertEqual({p["name"] for p in data["results"]}, {"Red Shirt", "Red Shoe"})
+        # Other colors keep their counts; other dimensions narrow to red products
+        self.assertEqual(self.counts(data, "color"), {"red": 2, "blue": 1})
+        self.assertEqual(self.counts(data, "category"), {"Shirts": 1, "Shoes": 1})
+
+        data = self.browse(color="red", category=self.shirts.id)
+        self.assertEqual([p["name"] for p in data["results"]], ["Red Shirt"])
+        self.assertEqual(self.counts(data, "color"), {"red": 1, "blue": 1})
+
+    def test_filters_and_ordering(self):
+        names = lambda data: [p["name"] for p in data["results"]]
+        self.assertEqual(names(self.browse(min_price="25", ordering="-price")), ["Red Shoe", "Blue Shirt"])
+        self.assertEqual(names(self.browse(in_stock="true", min_rating=4)), ["Red Shirt"])
+        self.assertEqual(names(self.browse(price=["0-25", "50-100"])), ["Red Shirt", "Red Shoe"])
+        self.assertEqual(names(self.browse(limit=1, offset=1)), ["Red Shirt"])
+        response = self.client.get("/api/products/facets/", {"min_price": "cheap"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_writes(self):
+        self.browse()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blue_shirt.color = "green"
+            self.blue_shirt.save()
+            Product.objects.create(name="Boot", description="", price=Decimal("150"), category=self.shoes, stock=1)
+            self.red_shoe.delete()
+            reserve_stock({self.red_shirt.id: 5})
+
+        data = self.browse()
+        self.assertEqual(self.counts(data, "color"), {"red": 1, "green": 1})
+        self.assertEqual(self.counts(data, "category"), {"Shirts": 2, "Shoes": 1})
+        self.assertEqual(self.counts(data, "in_stock"), {"In stock": 1, "Out of stock": 2})
+        self.assertEqual(self.counts(data, "price"), {"0-25": 1, "25-50": 1, "100-200": 1})
+
+    def test_rolled_back_writes_leave_the_index_alone(self):
+        self.browse()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.blue_shirt.color = "green"
+                self.blue_shirt.save()
+                self.red_shoe.delete()
+                raise RuntimeError
+        data = self.browse()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(self.counts(data, "color"), {"red": 2, "blue": 1})
+
+
+class QueryPlanTests(TestCase):
+    """List endpoints must be served from indexes, never full table scans"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = create_user()
+        product = create_products(1)[0]
+        create_coupon()
+        order = Order.objects.create(user=cls.customer)
+        order.add_product(product)
+
+    def setUp(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN output is SQLite specific")
+
+    def test_list_endpoints_avoid_full_scans(self):
+        for role, path in query_plan.LIST_ENDPOINTS:
+            client = APIClient()
+            if role == "customer":
+                client.force_authenticate(self.customer)
+            path = path.format(user_id=self.customer.id)
+
+            def get():
+                response = client.get(path)
+                self.assertEqual(response.status_code, 200, path)
+
+            for sql in query_plan.capture_selects(get):
+                plan = query_plan.explain(sql)
+                with self.subTest(path=path, sql=sql):
+                    self.assertEqual(query_plan.full_scans(plan), [], "\n".join(plan))
+
+    def test_partial_indexes_are_used(self):
+        unread = Notification.objects.filter(user=self.customer, read=False)
+        plan = query_plan.explain(*unread.query.sql_with_params())
+        self.assertIn("notification_unread_idx", " ".join(plan))
+
+        active = Coupon.objects.filter(is_active=True)
+        plan = query_plan.explain(*active.query.sql_with_params())
+        self.assertIn("coupon_active_idx", " ".join(plan))
+
+
+class EagerLoadingTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.products = create_products(3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user)
+            for product in self.products:
+                order.add_product(product, 2)
+
+    def count_queries(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data
+
+    def test_list_query_count_does_not_grow_with_results(self):
+        for path in ("/api/orders/", "/api/order-items/"):
+            with self.subTest(path=path):
+                Order.objects.all().delete()
+                self.place_orders(1)
+                few, _ = self.count_queries(path)
+                self.place_orders(5)
+                many, data = self.count_queries(path)
+                self.assertEqual(many, few)
+                self.assertGreater(len(data), 3)
+
+    def test_order_payload_is_unchanged(self):
+        self.place_orders(1)
+        _, data = self.count_queries("/api/orders/")
+        self.assertEqual(data[0]["user_name"], self.user.get_full_name())
+        self.assertEqual(
+            sorted(item["product_name"] for item in data[0]["order_items"]),
+            sorted(product.name for product in self.products),
+        )
+
+
+class CartReadTests(TestCase):
+    def setUp(self):
+        cart_cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cart_is_read_with_one_query(self):
+        cart = Cart.objects.get(user=self.user)
+        for i, product in enumerate(create_products(5, price="2.50")):
+            cart.add_product(product, i + 1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/cart/items/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 5)
+        self.assertEqual(response.data["total"], Decimal("37.50"))
+        self.assertEqual(response.data["items"][0]["product_price"], 2.5)
+
+    def test_empty_cart_costs_one_more_query(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/cart/items/")
+        self.assertEqual(response.data["items"], [])
+        self.assertEqual(response.data["total"], 0)
+
+    def test_total_without_loaded_items_is_summed_in_sql(self):
+        cart = Cart.objects.get(user=self.user)
+        for product in create_products(3, price="4.00"):
+            cart.add_product(product, 2)
+        cart = Cart.objects.get(pk=cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.get_total(), Decimal("24.00"))
+
+
+class CartCacheTests(TestCase):
+    def setUp(self):
+        cart_cache.clear()
+        cart_cache.backend.reset_stats()
+        self.addCleanup(cart_cache.clear)
+        self.user = create_user()
+        self.products = create_products(2, price="3.00")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def cart(self):
+        response = self.client.get("/api/cart/items/")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_reads_are_served_from_cache(self):
+        self.client.post("/api/cart/add_item/", {"product_id": self.products[0].id, "quantity": 2})
+        with self.assertNumQueries(0):
+            data = self.cart()
+        self.assertEqual(data["total"], Decimal("6.00"))
+        self.assertEqual(cart_cache.stats()["hits"], 1)
+
+    def test_mutations_write_through(self):
+        first, second = self.products
+        self.cart()
+        self.client.post("/api/cart/add_item/", {"product_id": first.id, "quantity": 1})
+        self.client.post("/api/cart/add_item/", {"product_id": second.id, "quantity": 1})
+        self.client.post("/api/cart/update_quantity/", {"product_id": first.id, "quantity": 4})
+        self.assertEqual(self.cart()["total"], Decimal("15.00"))
+
+        self.client.post("/api/cart/remove_item/", {"product_id": second.id})
+        self.assertEqual([i["product"] for i in self.cart()["items"]], [first.id])
+
+        self.client.post("/api/cart/checkout/")
+        self.assertEqual(self.cart()["items"], [])
+        self.assertEqual(cart_cache.stats()["misses"], 1)
+
+    def test_product_changes_invalidate_carts(self):
+        product = self.products[0]
+        self.client.post("/api/cart/add_item/", {"product_id": product.id, "quantity": 1})
+        product.price = Decimal("7.00")
+        product.save()
+        self.assertEqual(self.cart()["total"], Decimal("7.00"))
+
+        self.cart()
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock({product.id: 1})
+        self.assertIsNone(cart_cache.get(self.user.id))
+
+    def test_invalidation_is_repeated_after_commit(self):
+        product = self.products[0]
+        self.client.post("/api/cart/add_item/", {"product_id": product.id, "quantity": 1})
+        stale = self.cart()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = Decimal("7.00")
+            product.save()
+            self.assertIsNone(cart_cache.get(self.user.id))
+            # Another request re-reads the old rows before the commit
+            cart_cache.store(self.user.id, stale)
+        self.assertIsNone(cart_cache.get(self.user.id))
+
+    def test_cached_cart_does_not_replace_the_cart_row(self):
+        self.cart()
+        request = self.client.get("/api/cart/items/").wsgi_request
+        request.user = self.user
+        cart = CartViewSet().get_cart(request)
+        self.assertEqual(cart.created_at, Cart.objects.get(user=self.user).created_at)
+
+    def test_local_backend_is_bounded_lru_with_ttl(self):
+        cache = LocalMemoryBackend(timeout=60, max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        expired = LocalMemoryBackend(timeout=-1)
+        expired.set("a", 1)
+        self.assertIs(expired.get("a"), MISSING)
+
+    @override_settings(CART_CACHE_BACKEND="app.cache.SharedCacheBackend")
+    def test_shared_backend(self):
+        self.client.post("/api/cart/add_item/", {"product_id": self.products[1].id, "quantity": 3})
+        self.assertIsInstance(cart_cache.backend, SharedCacheBackend)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cart()["total"], Decimal("9.00"))
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        cart_cache.clear()
+        self.addCleanup(cart_cache.clear)
+        self.user = create_user()
+        self.products = create_products(6, stock=5, price="2.00")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, operations):
+        return self.client.post("/api/cart/batch/", {"operations": operations}, format="json")
+
+    def test_applies_operations_and_returns_cart(self):
+        first, second, third = self.products[:3]
+        self.user.cart.add_product(third, 1)
+        response = self.batch([
+            {"product_id": first.id, "quantity": 1},
+            {"product_id": second.id, "quantity": 2},
+            {"product_id": first.id, "quantity": 3},
+            {"product_id": third.id, "quantity": 0},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        lines = {item["product"]: item["quantity"] for item in response.data["items"]}
+        self.assertEqual(lines, {first.id: 3, second.id: 2})
+        self.assertEqual(response.data["total"], Decimal("10.00"))
+        # The cached cart is the one returned
+        self.assertEqual(self.client.get("/api/cart/items/").data, response.data)
+
+    def test_query_count_does_not_grow_with_operations(self):
+        def queries(products):
+            cart_cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.batch([{"product_id": p.id, "quantity": 1} for p in products])
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        self.assertEqual(queries(self.products[:2]), queries(self.products))
+
+    def test_invalid_batch_changes_nothing(self):
+        first = self.products[0]
+        for operations in (
+            [{"product_id": first.id, "quantity": 1}, {"product_id": 999999, "quantity": 1}],
+            [{"product_id": first.id, "quantity": 6}],
+            [{"product_id": first.id, "quantity": -1}],
+            [{"quantity": 1}],
+            [],
+        ):
+            with self.subTest(operations=operations):
+                self.assertEqual(self.batch(operations).status_code, 400)
+        # A body that is not an object
+        response = self.client.post("/api/cart/batch/", [{"product_id": first.id, "quantity": 1}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+
+class CartMergeTests(TestCase):
+    def setUp(self):
+        cart_cache.clear()
+        self.addCleanup(cart_cache.clear)
+        self.user = create_user()
+        self.products = create_products(4, price="1.50")
+
+    def test_merge_sums_shared_lines_and_deletes_source(self):
+        first, second, third = self.products[:3]
+        source = create_user("bob").cart
+        source.add_product(first, 2)
+        source.add_product(second, 1)
+        target = self.user.cart
+        target.add_product(first, 3)
+        target.add_product(third, 1)
+
+        # Savepoint pair, two reads, one upsert, two DELETEs for the source cart
+        with self.assertNumQueries(7):
+            merge_carts(source, target)
+
+        lines = dict(target.items.values_list("product_id", "quantity"))
+        self.assertEqual(lines, {first.id: 5, second.id: 1, third.id: 1})
+        self.assertFalse(Cart.objects.filter(pk=source.pk).exists())
+
+    def test_merge_into_same_cart_is_rejected(self):
+        self.user.cart.add_product(self.products[0], 2)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post("/api/cart/merge/", {"cart_id": self.user.cart.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.user.cart.items.get().quantity, 2)
+
+    def login_sync_queries(self, session_cart):
+        request = type("Request", (), {})()
+        request.session = SessionStore()
+        request.session["cart"] = session_cart
+        with CaptureQueriesContext(connection) as context:
+            sync_cart_on_login(User, request=request, user=self.user)
+        self.assertEqual(request.session["cart"], {})
+        return len(context.captured_queries)
+
+    def test_login_sync_query_count_is_constant(self):
+        first, second, third, fourth = self.products
+        small = self.login_sync_queries({str(first.id): {"quantity": 1}})
+        large = self.login_sync_queries({
+            str(first.id): {"quantity": 2},
+            str(second.id): {"quantity": 1},
+            str(third.id): {"quantity": 3},
+            str(fourth.id): {},
+            "999999": {"quantity": 1},
+            "junk": {"quantity": 1},
+        })
+        self.assertLessEqual(large, small + 1)
+
+        order = Order.objects.get(user=self.user, status="Pending")
+        lines = dict(order.order_items.values_list("product_id", "quantity"))
+        self.assertEqual(lines, {first.id: 3, second.id: 1, third.id: 3, fourth.id: 1})
+        self.assertEqual(order.total_price, Decimal("12.00"))
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.product = create_products(1)[0]
+        self.users = [create_user(f"rater{i}") for i in range(3)]
+
+    def aggregates(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return product.rating_count, product.rating_sum, product.average_rating, product.rating_histogram
+
+    def test_aggregates_follow_rating_writes(self):
+        first = Rating.objects.create(product=self.product, user=self.users[0], rating=5)
+        Rating.objects.create(product=self.product, user=self.users[1], rating=4)
+        Rating.objects.create(product=self.product, user=self.users[2], rating=4)
+        self.assertEqual(self.aggregates(), (3, 13, Decimal("4.33"), {1: 0, 2: 0, 3: 0, 4: 2, 5: 1}))
+
+        first = Rating.objects.get(pk=first.pk)
+        first.rating = 1
+        first.save()
+        self.assertEqual(self.aggregates(), (3, 9, Decimal("3.00"), {1: 1, 2: 0, 3: 0, 4: 2, 5: 0}))
+
+        Rating.objects.filter(user__in=self.users[1:]).delete()
+        self.assertEqual(self.aggregates(), (1, 1, Decimal("1.00"), {1: 1, 2: 0, 3: 0, 4: 0, 5: 0}))
+
+        first.delete()
+        self.assertEqual(self.aggregates(), (0, 0, Decimal("0.00"), {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}))
+
+    def test_update_is_one_statement(self):
+        rating = Rating.objects.create(product=self.product, user=self.users[0], rating=2)
+        rating = Rating.objects.get(pk=rating.pk)
+        rating.rating = 3
+        # UPDATE rating, UPDATE product aggregates
+        with self.assertNumQueries(2):
+            rating.save()
+
+    def test_recount_matches_incremental_values(self):
+        for user, stars in zip(self.users, (2, 3, 5)):
+            Rating.objects.create(product=self.product, user=user, rating=stars)
+        incremental = self.aggregates()
+        Product.objects.filter(pk=self.product.pk).update(rating_count=0, rating_sum=0, rating_5=0)
+        Product.objects.get(pk=self.product.pk).update_average_rating()
+        self.assertEqual(self.aggregates(), incremental)
+
+    def test_rate_endpoint_and_rating_ordering(self):
+        other = create_products(1)[0]
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        self.assertEqual(client.post(f"/api/products/{self.product.id}/rate/", {"rating": 9}).status_code, 400)
+        client.post(f"/api/products/{self.product.id}/rate/", {"rating": 2})
+        client.post(f"/api/products/{self.product.id}/rate/", {"rating": 4})
+        client.post(f"/api/products/{other.id}/rate/", {"rating": 5})
+
+        response = client.get("/api/products/", {"ordering": "-average_rating"})
+        self.assertEqual([p["id"] for p in response.data], [other.id, self.product.id])
+        self.assertEqual(response.data[1]["rating_count"], 1)
+        self.assertEqual(response.data[1]["average_rating"], 4.0)
+        self.assertEqual(response.data[1]["rating_histogram"], {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+
+class ProductReviewTests(TestCase):
+    def setUp(self):
+        self.product = create_products(1)[0]
+        self.client = APIClient()
+        for i in range(23):
+            Rating.objects.create(
+                product=self.product, user=create_user(f"reviewer{i}"), rating=i % 5 + 1, comment=f"Review {i}"
+            )
+
+    def test_detail_embeds_first_page_with_flat_query_count(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"/api/products/{self.product.id}/")
+        self.assertEqual(response.status_code, 200)
+        # Conditional GET validator, product with its category, then one page
+        # of reviews with their users
+        self.assertEqual(len(context.captured_queries), 3)
+        self.assertEqual([r["comment"] for r in response.data["ratings"]], [f"Review {i}" for i in range(22, 12, -1)])
+        self.assertEqual(response.data["ratings"][0]["username"], "reviewer22")
+        self.assertEqual(response.data["rating_count"], 23)
+        self.assertIsNotNone(response.data["ratings_next"])
+
+    def test_reviews_pages_continue_from_detail(self):
+        comments = [r["comment"] for r in self.client.get(f"/api/products/{self.product.id}/").data["ratings"]]
+        url = self.client.get(f"/api/products/{self.product.id}/").data["ratings_next"]
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            comments += [r["comment"] for r in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(comments, [f"Review {i}" for i in range(22, -1, -1)])
+
+    def test_detail_query_params_do_not_page_the_embedded_reviews(self):
+        detail = self.client.get(f"/api/products/{self.product.id}/")
+        for query in ("?cursor=bogus", "?page_size=1", "?cursor=cD0yMDI0&page_size=2"):
+            response = self.client.get(f"/api/products/{self.product.id}/{query}")
+            self.assertEqual(response.status_code, 200, query)
+            self.assertEqual(response.data["ratings"], detail.data["ratings"], query)
+            self.assertEqual(response.data["ratings_next"], detail.data["ratings_next"], query)
+        self.assertNotIn("page_size", detail.data["ratings_next"])
+
+    def test_small_product_has_no_next_link(self):
+        other = create_products(1)[0]
+        response = self.client.get(f"/api/products/{other.id}/")
+        self.assertEqual(response.data["ratings"], [])
+        self.assertIsNone(response.data["ratings_next"])
+        response = self.client.get(f"/api/products/{other.id}/reviews/")
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(self.client.get("/api/products/999999/reviews/").status_code, 404)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = create_products(3)
+
+    def revalidate(self, url, response, **headers):
+        with CaptureQueriesContext(connection) as context:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"], **headers)
+        return again, len(context.captured_queries)
+
+    def test_list_answers_304_with_only_the_validator_query(self):
+        # Signed in, so the anonymous response cache stays out of the way
+        self.client.force_authenticate(create_user())
+        response = self.client.get("/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["ETag"].startswith('W/"'))
+        self.assertIn("Last-Modified", response)
+        again, queries = self.revalidate("/api/products/", response)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], response["ETag"])
+        self.assertEqual(queries, 1)
+
+    def test_edit_delete_and_related_changes_invalidate(self):
+        url = "/api/products/"
+        response = self.client.get(url)
+        product = self.products[0]
+        product.name = "Renamed"
+        product.save()
+        again, _ = self.revalidate(url, response)
+        self.assertEqual(again.status_code, 200)
+
+        self.products[1].delete()
+        self.assertEqual(self.revalidate(url, again)[0].status_code, 200)
+
+        response = self.client.get(url)
+        product.category.name = "Renamed category"
+        product.category.save()
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+
+    def test_query_string_is_part_of_the_etag(self):
+        response = self.client.get("/api/products/")
+        again, _ = self.revalidate("/api/products/?ordering=-price", response)
+        self.assertEqual(again.status_code, 200)
+
+    def test_detail_tracks_embedded_reviews(self):
+        product = self.products[0]
+        url = f"/api/products/{product.id}/"
+        rating = Rating.objects.create(product=product, user=create_user(), rating=4, comment="Good")
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 304)
+        # Same star count, so the product aggregates do not change
+        rating = Rating.objects.get(pk=rating.pk)
+        rating.comment = "Very good"
+        rating.save()
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+        self.assertEqual(self.client.get("/api/products/999999/").status_code, 404)
+
+    def test_if_modified_since(self):
+        FAQ.objects.create(question="Shipping?", answer="Yes", category="General")
+        response = self.client.get("/api/faqs/")
+        again = self.client.get("/api/faqs/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(again.status_code, 304)
+
+    def test_privacy_policy_uses_last_updated(self):
+        PrivacyPolicy.objects.create(title="Privacy", content="...")
+        response = self.client.get("/api/privacy-policies/")
+        self.assertIn("Last-Modified", response)
+        self.assertEqual(self.revalidate("/api/privacy-policies/", response)[0].status_code, 304)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        response_cache.reset_stats()
+        self.client = APIClient()
+        self.products = create_products(3)
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **headers)
+        self.assertIn(response.status_code, (200, 304))
+        return response, len(context.captured_queries)
+
+    def test_repeated_anonymous_reads_skip_the_database(self):
+        first, _ = self.get("/api/products/")
+        second, queries = self.get("/api/products/")
+        self.assertEqual(queries, 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+        not_modified, queries = self.get("/api/products/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual((not_modified.status_code, queries), (304, 0))
+        stats = response_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    def test_query_params_are_normalized(self):
+        self.get("/api/products/?ordering=price&page_size=2")
+        _, queries = self.get("/api/products/?page_size=2&ordering=price&search=")
+        self.assertEqual(queries, 0)
+        _, queries = self.get("/api/products/?page_size=2&ordering=-price")
+        self.assertGreater(queries, 0)
+
+    def test_writes_bump_the_version(self):
+        self.get("/api/products/")
+        product = self.products[0]
+        product.name = "Renamed"
+        product.save()
+        response, _ = self.get("/api/products/")
+        self.assertIn("Renamed", [item["name"] for item in response.data])
+
+        product.category.name = "Renamed category"
+        product.category.save()
+        response, _ = self.get("/api/products/")
+        self.assertEqual(response.data[0]["category_name"], "Renamed category")
+
+        self.get(f"/api/categories/{product.category_id}/products/")
+        self.products[1].delete()
+        response, _ = self.get(f"/api/categories/{product.category_id}/products/")
+        self.assertEqual(len(response.data), 2)
+
+    def test_queryset_updates_bump_the_version(self):
+        self.get("/api/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock({self.products[0].pk: 4})
+        response, _ = self.get("/api/products/")
+        self.assertEqual({item["stock"] for item in response.data}, {6, 10})
+
+    def test_sliders_are_cached_per_model(self):
+        Slider.objects.create(title="Sale", description="Everything must go")
+        self.get("/api/sliders/")
+        # A product write does not touch the slider entry
+        self.products[0].save()
+        _, queries = self.get("/api/sliders/")
+        self.assertEqual(queries, 0)
+        Slider.objects.create(title="New in", description="Fresh arrivals")
+        response, _ = self.get("/api/sliders/")
+        self.assertEqual(len(response.data), 2)
+
+    def test_authenticated_reads_bypass_the_cache(self):
+        self.client.force_authenticate(create_user())
+        self.get("/api/products/")
+        _, queries = self.get("/api/products/")
+        self.assertGreater(queries, 0)
+
+    def test_concurrent_misses_compute_once(self):
+        cache = ResponseCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"data": [1], "headers": {}}
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(lambda _: cache.get_or_compute("key", compute), range(5)))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result == {"data": [1], "headers": {}} for result in results))
+        self.assertEqual(cache.stats()["coalesced"], 4)
+
+
+class HomeFeedTests(TestCase):
+    def setUp(self):
+        home_feed.clear()
+        self.client = APIClient()
+        self.products = create_products(4)
+        Slider.objects.create(title="Sale", description="...", category=self.products[0].category)
+        Slider.objects.create(title="Old", description="...", is_active=False)
+        Rating.objects.create(product=self.products[2], user=create_user(), rating=5)
+
+    def get(self, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/home/", **headers)
+        return response, len(context.captured_queries)
+
+    def test_feed_combines_sliders_categories_and_top_products(self):
+        response, _ = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s["title"] for s in response.data["sliders"]], ["Sale"])
+        self.assertEqual(response.data["sliders"][0]["category"], self.products[0].category_id)
+        self.assertEqual([c["name"] for c in response.data["categories"]], ["General"])
+        self.assertEqual(response.data["products"][0]["id"], self.products[2].id)
+        self.assertEqual(len(response.data["products"]), 4)
+
+    @override_settings(HOME_FEED_PRODUCTS=2)
+    def test_served_from_memory_until_a_model_changes(self):
+        builds = home_feed.stats()["builds"]
+        first, _ = self.get()
+        self.assertEqual(len(first.data["products"]), 2)
+        second, queries = self.get()
+        self.assertEqual(queries, 0)
+        self.assertEqual(second.data, first.data)
+        not_modified, queries = self.get(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual((not_modified.status_code, queries), (304, 0))
+
+        Slider.objects.create(title="New in", description="...")
+        rebuilt, queries = self.get()
+        self.assertGreater(queries, 0)
+        self.assertNotEqual(rebuilt["ETag"], first["ETag"])
+        self.assertEqual(len(rebuilt.data["sliders"]), 2)
+        self.assertEqual(home_feed.stats()["builds"], builds + 2)
+
+    @override_settings(HOME_FEED_MAX_HOSTS=2)
+    def test_feeds_for_unknown_hosts_are_bounded(self):
+        evictions = home_feed.stats()["evictions"]
+        first, _ = self.get(HTTP_HOST="shop.example")
+        for i in range(5):
+            self.assertEqual(self.get(HTTP_HOST=f"random-{i}.example")[0].status_code, 200)
+        self.assertEqual(home_feed.stats()["hosts"], 2)
+        self.assertEqual(home_feed.stats()["evictions"], evictions + 4)
+        rebuilt, queries = self.get(HTTP_HOST="shop.example")
+        self.assertGreater(queries, 0)
+        self.assertEqual(rebuilt.data, first.data)
+
+    def test_a_slow_build_only_holds_up_its_own_host(self):
+        started, release = threading.Event(), threading.Event()
+
+        class SlowFeed(HomeFeed):
+            def build(self, request, versions):
+                if request.get_host() == "slow.example":
+                    started.set()
+                    release.wait(2)
+                return {"host": request.get_host()}, '"etag"'
+
+        feed = SlowFeed()
+        factory = RequestFactory()
+        slow = threading.Thread(target=feed.get, args=[factory.get("/", HTTP_HOST="slow.example")])
+        slow.start()
+        try:
+            self.assertTrue(started.wait(2))
+            payload, _ = feed.get(factory.get("/", HTTP_HOST="fast.example"))
+            # Served while the other host was still building
+            self.assertFalse(release.is_set())
+            self.assertTrue(slow.is_alive())
+        finally:
+            release.set()
+            slow.join()
+        self.assertEqual(payload, {"host": "fast.example"})
+        self.assertEqual(feed.stats()["builds"], 2)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        token_cache.reset_stats()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.user.auth_token.key}")
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/users/me/")
+        return response, len(context.captured_queries)
+
+    def test_repeat_requests_skip_the_token_query(self):
+        response, queries = self.get_me()
+        self.assertEqual((response.status_code, queries), (200, 1))
+        cached, queries = self.get_me()
+        self.assertEqual((cached.status_code, queries), (200, 0))
+        self.assertEqual(cached.data, response.data)
+        stats = token_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+
+    def test_saving_a_snapshot_user_writes_loaded_fields_only(self):
+        self.get_me()
+        user, _ = token_cache.get(self.user.auth_token.key)
+        user.first_name = "Alicia"
+        with CaptureQueriesContext(connection) as context:
+            user.save()
+        update = [q["sql"] for q in context.captured_queries if q["sql"].startswith("UPDATE")][0]
+        self.assertIn('"first_name"', update)
+        self.assertNotIn('"password"', update)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Alicia")
+        self.assertTrue(self.user.check_password("secret-pass-123"))
+
+    def test_password_change_drops_the_snapshot(self):
+        self.get_me()
+        response = self.client.post(
+            "/api/users/update_password/",
+            {"current_password": "secret-pass-123", "new_password": "another-pass-456"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("another-pass-456"))
+        self.assertEqual(self.get_me()[1], 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.get_me()
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_logout_and_token_delete_invalidate(self):
+        self.get_me()
+        response = self.client.post("/api/logout/", {"token": self.user.auth_token.key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_delete_account_invalidates(self):
+        self.get_me()
+        response = self.client.post("/api/users/delete_account/", {"password": "secret-pass-123"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+
+class SignedAccessTokenTests(TestCase):
+    def setUp(self):
+        revocations.clear()
+        token_cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post("/api/token-auth/", {"username": "alice", "password": "secret-pass-123"})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_me(self, access):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/users/me/", HTTP_AUTHORIZATION=f"Bearer {access}")
+        return response, len(context.captured_queries)
+
+    def test_login_issues_access_token_that_needs_no_auth_query(self):
+        data = self.login()
+        self.assertEqual(data["token_type"], "Bearer")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/cart/items/", HTTP_AUTHORIZATION=f"Bearer {data['access']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any("authtoken_token" in q["sql"] for q in context.captured_queries))
+        # The profile loads all remaining user columns with one query
+        response, queries = self.get_me(data["access"])
+        self.assertEqual((response.data["email"], queries), ("alice@example.com", 1))
+
+    def test_tampered_and_expired_tokens_are_rejected(self):
+        access = issue_access_token(self.user)
+        self.assertEqual(self.get_me(access[:-2] + "xx")[0].status_code, 401)
+        with override_settings(ACCESS_TOKEN_LIFETIME=-1):
+            expired = issue_access_token(self.user)
+        self.assertEqual(self.get_me(expired)[0].status_code, 401)
+
+    def test_refresh_with_the_db_token(self):
+        response = self.client.post("/api/token/refresh/", {"refresh": self.user.auth_token.key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_me(response.data["access"])[0].status_code, 200)
+        response = self.client.post("/api/token/refresh/", {"refresh": "bogus"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_logout_revokes_access_tokens(self):
+        first = self.login()["access"]
+        second = issue_access_token(self.user)
+        response = self.client.post("/api/logout/", HTTP_AUTHORIZATION=f"Bearer {first}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_me(first)[0].status_code, 401)
+        # The refresh token was deleted, so every token issued before goes too
+        self.assertEqual(self.get_me(second)[0].status_code, 401)
+        self.assertEqual(self.get_me(self.login()["access"])[0].status_code, 200)
+
+    def test_permission_changes_revoke_access_tokens(self):
+        self.user.is_staff = True
+        self.user.save()
+        time.sleep(0.002)
+        staff = self.login()["access"]
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = "Alicia"
+        user.save()
+        self.assertEqual(self.get_me(staff)[0].status_code, 200)
+
+        user.is_staff = False
+        user.save()
+        self.assertEqual(self.get_me(staff)[0].status_code, 401)
+        time.sleep(0.002)
+        access = self.login()["access"]
+        User.objects.get(pk=self.user.pk).delete()
+        self.assertEqual(self.get_me(access)[0].status_code, 401)
+
+    def test_deploy_check_needs_a_shared_revocation_cache(self):
+        with override_settings(ACCESS_TOKEN_REVOCATION_BACKEND="app.cache.LocalMemoryBackend"):
+            self.assertEqual([e.id for e in check_access_token_revocations(None)], ["app.E001"])
+        # The test settings use the default process-local CACHES
+        self.assertEqual([e.id for e in check_access_token_revocations(None)], ["app.E002"])
+        shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "cache"}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_access_token_revocations(None), [])
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        passwords.stats.reset()
+        self.user = create_user()
+        self.client = APIClient()
+
+    def login(self):
+        return self.client.post("/api/users/login/", {"username": "alice", "password": "secret-pass-123"})
+
+    def test_hashing_runs_on_the_pool(self):
+        self.assertTrue(passwords.pool.run(lambda: threading.current_thread().name).startswith("password-hash"))
+        self.assertIn("$1000$", self.user.password)
+
+    def test_login_rehashes_when_iterations_change(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            response = self.login()
+            self.assertEqual(response.status_code, 200)
+            self.user.refresh_from_db()
+            self.assertIn("$2000$", self.user.password)
+            self.assertTrue(self.user.check_password("secret-pass-123"))
+        stats = passwords.stats.as_dict()
+        self.assertEqual((stats["logins"], stats["failed_logins"], stats["rehashes"]), (1, 0, 1))
+        self.assertIsNotNone(stats["avg_login_ms"])
+
+    def test_failed_logins_are_counted(self):
+        response = self.client.post("/api/users/login/", {"username": "alice", "password": "wrong"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(passwords.stats.as_dict()["failed_logins"], 1)
+
+    @override_settings(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0, PASSWORD_HASH_WAIT=0.05)
+    def test_saturated_pool_answers_503(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        with ThreadPoolExecutor(max_workers=1) as background:
+            background.submit(passwords.pool.run, block)
+            started.wait(5)
+            response = self.login()
+            release.set()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(passwords.stats.as_dict()["rejected"], 1)
+        self.assertEqual(self.login().status_code, 200)
+
+
+class ProtectedMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root.name, "products"))
+        self.content = bytes(range(256)) * 4
+        for name in ("products/shoe.png", "products/shoe.thumb.3f9a1c2b.webp"):
+            with open(os.path.join(self.media_root.name, name), "wb") as f:
+                f.write(self.content)
+        self.client = APIClient()
+        self.url = "/api/media/products/shoe.png"
+
+    def body(self, response):
+        return b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_full_response_carries_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], "private, max-age=3600")
+        self.assertIn("Last-Modified", response)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        not_modified = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+
+    def test_byte_ranges(self):
+        for header, expected in (("bytes=2-5", (2, 5)), ("bytes=1000-", (1000, 1023)), ("bytes=-4", (1020, 1023))):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            start, end = expected
+            self.assertEqual(self.body(response), self.content[start:end + 1])
+            self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/1024")
+            self.assertEqual(response["Content-Length"], str(end - start + 1))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5000-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, "bytes */1024"))
+        # Several ranges, or a stale If-Range, get the whole file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=0-1,4-5").status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    def test_ranges_of_an_empty_file_are_unsatisfiable(self):
+        open(os.path.join(self.media_root.name, "products/empty.png"), "wb").close()
+        for header in ("bytes=-5", "bytes=0-"):
+            response = self.client.get("/api/media/products/empty.png", HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response["Content-Range"]), (416, "bytes */0"), header)
+        self.assertEqual(self.client.get("/api/media/products/empty.png").status_code, 200)
+
+    def test_content_hashed_names_are_immutable(self):
+        response = self.client.get("/api/media/products/shoe.thumb.3f9a1c2b.webp")
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+
+    @override_settings(MEDIA_SENDFILE="x-accel-redirect")
+    def test_proxy_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/products/shoe.png")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"")
+
+    def test_paths_outside_media_root_are_refused(self):
+        self.assertEqual(self.client.get("/api/media/../settings.py").status_code, 403)
+        self.assertEqual(self.client.get("/api/media/products").status_code, 403)
+
+
+@override_settings(IMAGE_DERIVATIVES_ASYNC=False)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        response_cache.clear()
+        token_cache.clear()
+        image_stats.reset()
+        self.client = APIClient()
+        self.product = create_products(1)[0]
+
+    def upload(self, name="shoe.png", size=(2000, 1000)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, (200, 60, 30)).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_upload_generates_webp_presets(self):
+        self.product.image = self.upload()
+        self.product.save()
+        self.product.refresh_from_db()
+        variants = self.product.image_variants
+        self.assertEqual(variants["source"], self.product.image.name)
+        self.assertEqual(set(variants["presets"]), {"thumb", "small", "medium", "large"})
+        thumb = variants["presets"]["thumb"]
+        self.assertEqual((thumb["width"], thumb["height"]), (160, 80))
+        self.assertRegex(thumb["name"], CONTENT_HASHED_NAME_RE)
+        with default_storage.open(thumb["name"]) as f:
+            self.assertEqual(Image.open(f).format, "WEBP")
+        self.assertEqual(thumb["size"], default_storage.size(thumb["name"]))
+        stats = image_stats.as_dict()
+        self.assertEqual((stats["images"], stats["failures"]), (1, 0))
+        self.assertLess(stats["avg_preset_bytes"]["large"], stats["avg_original_bytes"])
+
+    def test_small_images_are_not_upscaled(self):
+        self.product.image = self.upload(size=(100, 50))
+        self.product.save()
+        presets = Product.objects.get(pk=self.product.pk).image_variants["presets"]
+        self.assertEqual({(p["width"], p["height"]) for p in presets.values()}, {(100, 50)})
+
+    def test_only_new_images_are_rendered(self):
+        self.product.image = self.upload()
+        self.product.save()
+        self.product.name = "Renamed"
+        self.product.save()
+        self.assertEqual(image_stats.as_dict()["images"], 1)
+        self.product.image = self.upload("boot.png")
+        self.product.save()
+        self.assertEqual(image_stats.as_dict()["images"], 2)
+        self.assertIn("boot", self.product.image_variants["presets"]["thumb"]["name"])
+        self.product.image = None
+        self.product.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_variants, {})
+
+    def test_unreadable_images_are_counted_as_failures(self):
+        self.product.image = SimpleUploadedFile("broken.png", b"not an image")
+        with self.assertLogs("app.images", "ERROR"):
+            self.product.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_variants, {})
+        self.assertEqual(image_stats.as_dict()["failures"], 1)
+
+    def test_async_generation_waits_for_commit(self):
+        with self.settings(IMAGE_DERIVATIVES_ASYNC=True):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.product.image = self.upload()
+                self.product.save()
+        self.assertTrue(callbacks)
+        self.assertEqual(image_stats.as_dict()["images"], 0)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_variants, {})
+
+    def test_serializers_expose_srcset(self):
+        self.product.image = self.upload()
+        self.product.save()
+        category = self.product.category
+        category.image = self.upload("general.png")
+        category.save()
+        Slider.objects.create(title="Sale", description="Sale", image=self.upload("sale.png"))
+
+        srcset = self.client.get(f"/api/products/{self.product.pk}/").data["image_srcset"]
+        self.assertEqual(set(srcset), {"thumb", "small", "medium", "large", "original"})
+        self.assertTrue(srcset["thumb"].startswith("http://testserver/media/products/shoe.thumb."))
+        self.assertEqual(srcset["original"], f"http://testserver/media/{self.product.image.name}")
+        category_data = self.client.get(f"/api/categories/{category.pk}/").data
+        self.assertIn("medium", category_data["image_srcset"])
+        slider_data = self.client.get("/api/sliders/").data
+        self.assertIn("large", slider_data[0]["image_srcset"])
+
+    def test_srcset_falls_back_to_the_original(self):
+        with self.settings(IMAGE_DERIVATIVES_ASYNC=True):
+            self.product.image = self.upload()
+            self.product.save()
+        srcset = self.client.get(f"/api/products/{self.product.pk}/").data["image_srcset"]
+        self.assertEqual(list(srcset), ["original"])
+        self.assertIsNone(self.client.get(f"/api/categories/{self.product.category_id}/").data["image_srcset"])
+
+    def test_profile_picture_srcset_reaches_cached_profiles(self):
+        user = create_user()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {user.auth_token.key}")
+        self.client.get("/api/users/me/")
+        user.profile_picture = self.upload("alice.png")
+        user.save()
+        for _ in range(2):
+            srcset = self.client.get("/api/users/me/").data["profile_picture_srcset"]
+            self.assertIn("thumb", srcset)
+
+    def test_stats_are_staff_only(self):
+        user = create_user()
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get("/api/products/image_stats/").status_code, 403)
+        user.is_staff = True
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/products/image_stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("avg_preset_bytes", response.data)
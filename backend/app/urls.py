@@ -2,12 +2,12 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
 from .carts import CartViewSet
-from .auth import CustomAuthToken, LogoutView
+from .auth import CustomAuthToken, LogoutView, RefreshAccessTokenView
 from .views import (
     UserViewSet, CategoryViewSet, ProductViewSet, RatingViewSet,
     OrderViewSet, OrderItemViewSet, get_csrf_token, serve_protected_media,
     FavoriteViewSet, PrivacyPolicyViewSet, FAQViewSet, ContactViewSet,
-    SliderViewSet, CouponViewSet, ValidateCouponView, RegisterView,
+    SliderViewSet, CouponViewSet, ValidateCouponView, RegisterView, HomeFeedView,
     NotificationViewSet
 )
 
@@ -34,8 +34,10 @@ urlpatterns = [
     # Token authentication endpoints
     path('get-csrf-token/', get_csrf_token, name='get-csrf-token'),
     path('token-auth/', CustomAuthToken.as_view(), name='token_auth'),
+    path('token/refresh/', RefreshAccessTokenView.as_view(), name='token_refresh'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('media/<path:path>', serve_protected_media, name='serve_protected_media'),
     path('validate-coupon/', ValidateCouponView.as_view(), name='validate-coupon'),
+    path('home/', HomeFeedView.as_view(), name='home-feed'),
 ]
\ No newline at end of file
@@ -4,14 +4,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, IsAuthenticatedOrReadOnly
 from django.db.models import Avg
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponseForbidden, JsonResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.middleware.csrf import get_token
 from rest_framework.exceptions import PermissionDenied
 from django.conf import settings
-from django.http import FileResponse, HttpResponseForbidden
-from django.views.decorators.http import require_GET
+from django.http import HttpResponseForbidden
+from django.views.decorators.http import require_safe
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
@@ -20,11 +24,38 @@ from .models import User, Category, Product, Rating, Order, OrderItem, Favorite,
 from .serializers import (
     UserSerializer, CategorySerializer, ProductSerializer, ProductDetailSerializer,
     RatingSerializer, OrderSerializer, OrderItemSerializer, FavoriteSerializer, PrivacyPolicySerializer,
-    FAQSerializer, ContactSerializer, SliderSerializer, CouponSerializer, NotificationSerializer
+    FAQSerializer, ContactSerializer, SliderSerializer, CouponSerializer, NotificationSerializer,
+    NotificationFeedSerializer, EagerLoadingMixin
 )
+from .search import ProductSearchFilter
+from .autocomplete import autocomplete as product_autocomplete
+from .facets import facets as product_facets, parse_filters as parse_facet_filters
+from .conditional import ConditionalGetMixin
+from .response_cache import ResponseCacheMixin, response_cache
+from .home_feed import home_feed
+from .images import stats as image_stats
+from .media import serve_file
+from .authentication import access_token_response, token_cache
+from .passwords import PasswordHashBusy, stats as password_stats
+from .pagination import OptionalCursorPagination, OptionalLimitOffsetPagination, ReviewCursorPagination
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
+from .stock import InsufficientStock, reserve_order_stock
+from . import notifications as notification_fanout
+
+class EagerLoadingViewMixin:
+    """Applies the serializer's select/prefetch plan to every queryset the view reads"""
+
+    def eager_load(self, queryset):
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, EagerLoadingMixin):
+            return serializer_class.setup_eager_loading(queryset)
+        return queryset
+
+    def filter_queryset(self, queryset):
+        return self.eager_load(super().filter_queryset(queryset))
+
 
 # Add RegisterView class for user registration
 class RegisterView(APIView):
@@ -43,6 +74,7 @@ class RegisterView(APIView):
                 'email': user.email,
                 'first_name': user.first_name,
                 'last_name': user.last_name,
+                **access_token_response(user),
                 'message': 'User registered successfully'
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -71,6 +103,22 @@ class UserViewSet(viewsets.ModelViewSet):
         # For other actions like retrieve, let Django's permission system handle it
         return User.objects.all()
     
+    @action(detail=False, methods=['get'])
+    def auth_cache_stats(self, request):
+        """Hit rate of the token authentication cache"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view auth cache stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response(token_cache.stats())
+
+    @action(detail=False, methods=['get'])
+    def password_stats(self, request):
+        """Password hashing pool load and per-login timings"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view password stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response(password_stats.as_dict())
+
     @action(detail=False, methods=['get'])
     def me(self, request):
         """Get current user's profile"""
@@ -155,6 +203,7 @@ class UserViewSet(viewsets.ModelViewSet):
         
         return Response({
             'token': token.key,
+            **access_token_response(user),
             'user': serializer.data
         })
 
@@ -191,6 +240,8 @@ class UserViewSet(viewsets.ModelViewSet):
             user.save()
             
             return Response({'message': 'Password updated successfully'})
+        except PasswordHashBusy:
+            raise
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -215,16 +266,19 @@ class UserViewSet(viewsets.ModelViewSet):
             user.delete()
             
             return Response({'message': 'Account deleted successfully'})
+        except PasswordHashBusy:
+            raise
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ResponseCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
     permission_classes = [AllowAny]
+    response_cache_models = {'list': (Category,), 'products': (Category, Product)}
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -235,6 +289,9 @@ class CategoryViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
+        return self.cached_response(self.products_response, request, pk=pk)
+
+    def products_response(self, request, pk=None):
         try:
             # Validate that pk is a valid integer
             try:
@@ -272,13 +329,16 @@ class CategoryViewSet(viewsets.ModelViewSet):
             )
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ResponseCacheMixin, ConditionalGetMixin, EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [ProductSearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description', 'category__name']
-    ordering_fields = ['name', 'price', 'created_at']
+    ordering_fields = ['name', 'price', 'created_at', 'average_rating', 'rating_count']
     permission_classes = [AllowAny]
+    pagination_class = OptionalCursorPagination
+    conditional_related_timestamps = ('category__updated_at',)
+    response_cache_models = {'list': (Product, Category)}
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -291,7 +351,107 @@ class ProductViewSet(viewsets.ModelViewSet):
         if self.action == 'retrieve':
             return ProductDetailSerializer
         return ProductSerializer
+
+    def get_conditional_related_timestamps(self):
+        # The detail response embeds the newest reviews
+        if self.action == 'retrieve':
+            return self.conditional_related_timestamps + ('ratings__updated_at',)
+        return self.conditional_related_timestamps
+
+    def get_sparse_fields(self):
+        """
+        Known field names requested with ?fields=id,name,price on reads, or
+        None when every field is serialized
+        """
+        if self.request is None or self.request.method != 'GET':
+            return None
+        if not hasattr(self, '_sparse_fields'):
+            fields = self.request.query_params.get('fields', '')
+            requested = [name.strip() for name in fields.split(',') if name.strip()]
+            self._sparse_fields = self.get_serializer_class().select_fields(requested)
+        return self._sparse_fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_sparse_fields()
+        # Skip loading the long description when the response leaves it out
+        if fields and 'description' not in fields:
+            queryset = queryset.defer('description')
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
     
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Search-as-you-type suggestions from the in-memory prefix index"""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 8)), 1), 20)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'query': query, **product_autocomplete.suggest(query, limit)})
+
+    @action(detail=False, methods=['get'])
+    def autocomplete_stats(self, request):
+        """Size, memory and hit counters of the autocomplete index"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view autocomplete stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response(product_autocomplete.stats())
+
+    @action(detail=False, methods=['get'])
+    def response_cache_stats(self, request):
+        """Hit, miss and latency counters of the anonymous response cache"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view response cache stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response({**response_cache.stats(), 'home_feed': home_feed.stats()})
+
+    @action(detail=False, methods=['get'])
+    def image_stats(self, request):
+        """Image derivative generation latency and bytes per preset against the originals"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view image stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response(image_stats.as_dict())
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Faceted browsing: filtered products plus counts for every facet value,
+        answered from the in-memory bitset index.
+        """
+        params = request.query_params
+        try:
+            filters = parse_facet_filters(params)
+            limit = min(max(int(params.get('limit', 20)), 1), 100)
+            offset = max(int(params.get('offset', 0)), 0)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ordering = params.get('ordering', 'name')
+        count, ids, facet_counts = product_facets.get_index().query(filters, ordering, offset, limit)
+        products = self.eager_load(self.get_queryset()).in_bulk(ids)
+        page = [products[i] for i in ids if i in products]
+        return Response({
+            'count': count,
+            'results': self.get_serializer(page, many=True).data,
+            'facets': facet_counts,
+        })
+
+    @action(detail=True, methods=['get'])
+    def reviews(self, request, pk=None):
+        """A product's reviews, newest first, with cursor pagination"""
+        product = get_object_or_404(Product.objects.only('id'), pk=pk)
+        queryset = RatingSerializer.setup_eager_loading(product.ratings.all())
+        paginator = ReviewCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(RatingSerializer(page, many=True).data)
+
     @action(detail=True, methods=['post'])
     def rate(self, request, pk=None):
         # Still require authentication for rating
@@ -304,6 +464,12 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         if not rating_value:
             return Response({'error': 'Rating is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rating_value = int(rating_value)
+        except (TypeError, ValueError):
+            rating_value = None
+        if rating_value not in Product.RATING_STARS:
+            return Response({'error': 'Rating must be an integer from 1 to 5'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Update or create rating
         rating, created = Rating.objects.update_or_create(
@@ -316,7 +482,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class RatingViewSet(viewsets.ModelViewSet):
+class RatingViewSet(EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
     permission_classes = [AllowAny]
@@ -335,7 +501,7 @@ class RatingViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     filter_backends = [filters.OrderingFilter]
@@ -381,16 +547,14 @@ class OrderViewSet(viewsets.ModelViewSet):
                     'error': f'Cannot transition from {instance.status} to {new_status}'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Check stock availability for Shipped status
-            if new_status == 'Shipped':
-                for item in instance.order_items.all():
-                    if item.product.stock < item.quantity:
-                        return Response({
-                            'error': f'Not enough stock for {item.product.name}. Available: {item.product.stock}'
-                        }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Proceed with update
-        return super().update(request, *args, **kwargs)
+        # Proceed with update. Shipping takes the stock when the order is
+        # saved, and added items of a reserved order take theirs; a shortage
+        # rolls the whole update back.
+        try:
+            with transaction.atomic():
+                return super().update(request, *args, **kwargs)
+        except InsufficientStock as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -429,16 +593,14 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Can only ship pending orders'}, 
                            status=status.HTTP_400_BAD_REQUEST)
         
-        # Check stock availability
-        for item in order.order_items.all():
-            if item.product.stock < item.quantity:
-                return Response({
-                    'error': f'Not enough stock for {item.product.name}. Available: {item.product.stock}'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Update order status
-        order.status = 'Shipped'
-        order.save()
+        # Update order status, reserving stock if checkout did not already
+        with transaction.atomic():
+            try:
+                reserve_order_stock(order)
+            except InsufficientStock as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            order.status = 'Shipped'
+            order.save()
         
         # Notification will be created automatically via signal
         
@@ -460,9 +622,12 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Can only deliver shipped orders'}, 
                            status=status.HTTP_400_BAD_REQUEST)
         
-        # Update order status
+        # Update order status, taking the stock if the order holds none yet
         order.status = 'Delivered'
-        order.save()
+        try:
+            order.save()
+        except InsufficientStock as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         # Notification will be created automatically via signal
         
@@ -470,7 +635,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+class OrderItemViewSet(EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
     permission_classes = [AllowAny]
@@ -488,6 +653,21 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         # For anonymous users, return empty queryset
         return OrderItem.objects.none()
 
+    def create(self, request, *args, **kwargs):
+        # Lines of a reserved order take their units from stock when saved
+        try:
+            with transaction.atomic():
+                return super().create(request, *args, **kwargs)
+        except InsufficientStock as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def update(self, request, *args, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().update(request, *args, **kwargs)
+        except InsufficientStock as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 def get_csrf_token(request):
     """
     Return CSRF token for the frontend to use in subsequent requests
@@ -495,34 +675,34 @@ def get_csrf_token(request):
     csrf_token = get_token(request)
     return JsonResponse({'csrfToken': csrf_token})
 
-@require_GET
+@require_safe
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def serve_protected_media(request, path):
     """
     Serve media files with authentication check.
     The path parameter should be the relative path within MEDIA_ROOT.
+    Supports conditional requests, byte ranges and proxy offload (see app.media).
     """
-    # Construct the full path
-    file_path = os.path.join(settings.MEDIA_ROOT, path)
-    
     # Basic security check to prevent directory traversal
-    if not os.path.abspath(file_path).startswith(os.path.abspath(settings.MEDIA_ROOT)):
+    try:
+        file_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
         return HttpResponseForbidden('Invalid path')
     
     # Check if file exists
-    if not os.path.exists(file_path):
+    if not os.path.isfile(file_path):
         return HttpResponseForbidden('File not found')
     
     # Serve the file
-    return FileResponse(open(file_path, 'rb'))
+    return serve_file(request, file_path, path)
 
 class FavoriteViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
     def list(self, request):
         """Get all favorites for the current user"""
-        favorites = Favorite.objects.filter(user=request.user)
+        favorites = FavoriteSerializer.setup_eager_loading(Favorite.objects.filter(user=request.user))
         serializer = FavoriteSerializer(favorites, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -570,15 +750,16 @@ class FavoriteViewSet(viewsets.ViewSet):
         is_favorited = Favorite.objects.filter(user=request.user, product=product).exists()
         return Response({'is_favorited': is_favorited})
 
-class PrivacyPolicyViewSet(viewsets.ModelViewSet):
+class PrivacyPolicyViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = PrivacyPolicy.objects.filter(is_active=True)
     serializer_class = PrivacyPolicySerializer
     permission_classes = [AllowAny]
+    conditional_timestamp_field = 'last_updated'
 
     def get_queryset(self):
         return PrivacyPolicy.objects.filter(is_active=True).order_by('-last_updated')
 
-class FAQViewSet(viewsets.ModelViewSet):
+class FAQViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = FAQ.objects.filter(is_active=True)
     serializer_class = FAQSerializer
     permission_classes = [AllowAny]
@@ -595,7 +776,7 @@ class FAQViewSet(viewsets.ModelViewSet):
         categories = FAQ.CATEGORY_CHOICES
         return Response([{'value': value, 'label': label} for value, label in categories])
 
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Contact.objects.filter(is_active=True)
     serializer_class = ContactSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -603,10 +784,11 @@ class ContactViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Contact.objects.filter(is_active=True).order_by('contact_type')
 
-class SliderViewSet(viewsets.ModelViewSet):
+class SliderViewSet(ResponseCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Slider.objects.filter(is_active=True)
     serializer_class = SliderSerializer
     permission_classes = [AllowAny]
+    response_cache_models = {'list': (Slider,)}
 
     def get_queryset(self):
         return Slider.objects.filter(is_active=True).order_by('-created_at')
@@ -628,6 +810,31 @@ class CouponViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(code=code)
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def fanout_stats(self, request):
+        """Throughput and progress of coupon notification fan-out"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view fan-out stats'},
+                           status=status.HTTP_403_FORBIDDEN)
+        return Response(notification_fanout.stats.as_dict())
+
+class HomeFeedView(APIView):
+    """
+    Everything the app's home screen shows in one request: active sliders,
+    categories and the top rated products, served from memory.
+    """
+    # The feed is the same for everyone, so skip the token lookup
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        payload, etag = home_feed.get(request)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified.headers['ETag'] = etag
+            return not_modified
+        return Response(payload, headers={'ETag': etag})
+
 class ValidateCouponView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -665,15 +872,53 @@ class ValidateCouponView(APIView):
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptionalLimitOffsetPagination
 
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user)
 
+    def get_broadcast(self, pk):
+        """Visible broadcast for a "b<id>" lookup, None for personal ids"""
+        broadcast_id = notification_fanout.parse_broadcast_id(pk)
+        if broadcast_id is None:
+            return None
+        return get_object_or_404(notification_fanout.visible_broadcasts(self.request.user), pk=broadcast_id)
+
+    def broadcast_response(self, broadcast):
+        read = broadcast.receipts.filter(user=self.request.user, read=True).exists()
+        return Response(NotificationFeedSerializer(notification_fanout.feed_entry(broadcast, read)).data)
+
+    def list(self, request, *args, **kwargs):
+        """Personal and broadcast notifications merged into one feed"""
+        feed = notification_fanout.user_feed(request.user)
+        page = self.paginate_queryset(feed)
+        if page is not None:
+            return self.get_paginated_response(NotificationFeedSerializer(page, many=True).data)
+        return Response(NotificationFeedSerializer(feed, many=True).data)
+
+    def retrieve(self, request, pk=None, *args, **kwargs):
+        broadcast = self.get_broadcast(pk)
+        if broadcast is not None:
+            return self.broadcast_response(broadcast)
+        return super().retrieve(request, pk=pk, *args, **kwargs)
+
+    def destroy(self, request, pk=None, *args, **kwargs):
+        broadcast = self.get_broadcast(pk)
+        if broadcast is not None:
+            # Broadcasts are shared, so deleting one only hides it for this user
+            notification_fanout.mark_broadcast(request.user, broadcast, dismissed=True)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return super().destroy(request, pk=pk, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
     @action(detail=True, methods=['put'])
     def read(self, request, pk=None):
+        broadcast = self.get_broadcast(pk)
+        if broadcast is not None:
+            notification_fanout.mark_broadcast(request.user, broadcast, read=True)
+            return self.broadcast_response(broadcast)
         notification = self.get_object()
         notification.read = True
         notification.save()
@@ -682,4 +927,5 @@ class NotificationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['delete'])
     def clear_all(self, request):
         self.get_queryset().delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        notification_fanout.dismiss_all_broadcasts(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -57,10 +57,67 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES' : ['rest_framework.permissions.AllowAny'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'app.authentication.SignedAccessTokenAuthentication',
+        'app.authentication.CachedTokenAuthentication',
     ],
 }
 
+# Token -> user snapshots kept by CachedTokenAuthentication. Entries are
+# dropped on logout, token deletion and user saves; with the per-process
+# LocalMemoryBackend other processes only notice after the timeout, use
+# app.cache.SharedCacheBackend to invalidate everywhere at once.
+AUTH_TOKEN_CACHE_BACKEND = 'app.cache.LocalMemoryBackend'
+AUTH_TOKEN_CACHE_TIMEOUT = 60
+AUTH_TOKEN_CACHE_MAX_ENTRIES = 10000
+
+# Signed access tokens ("Authorization: Bearer ..."), handed out at login
+# and by /api/token/refresh/ in exchange for the DRF token. They are checked
+# without queries; revocations (logout, deactivation, permission changes)
+# are kept for ACCESS_TOKEN_LIFETIME seconds in the revocation backend. It
+# must be shared between workers: SharedCacheBackend stores them in the
+# "default" entry of CACHES, and "check --deploy" fails while that is
+# process-local.
+ACCESS_TOKEN_LIFETIME = 300
+ACCESS_TOKEN_REVOCATION_BACKEND = 'app.cache.SharedCacheBackend'
+ACCESS_TOKEN_REVOCATION_MAX_ENTRIES = 100000
+
+# Coupon notifications are stored once as a broadcast ('broadcast') or
+# copied to every active user ('fanout'). Fan-out writes chunks of
+# NOTIFICATION_FANOUT_BATCH_SIZE rows; set NOTIFICATION_FANOUT_ASYNC to run
+# it on a background worker thread
+COUPON_NOTIFICATION_DELIVERY = 'broadcast'
+NOTIFICATION_FANOUT_BATCH_SIZE = 1000
+NOTIFICATION_FANOUT_ASYNC = False
+
+# Full-text backend behind ProductViewSet's ?search= (see app/search.py)
+PRODUCT_SEARCH_BACKEND = 'app.search.SQLiteFTS5SearchBackend'
+
+# Upper bound on products held by the in-memory autocomplete index
+AUTOCOMPLETE_MAX_PRODUCTS = 50000
+
+# Price facet band edges; [25, 50] gives 0-25, 25-50 and 50+
+FACET_PRICE_BANDS = [25, 50, 100, 200]
+
+# Per-user cart cache: app.cache.SharedCacheBackend (the "default" entry of
+# CACHES, so every worker sees write-throughs and invalidations once CACHES
+# points at Redis or Memcached) or app.cache.LocalMemoryBackend (per process)
+CART_CACHE_BACKEND = 'app.cache.SharedCacheBackend'
+CART_CACHE_TIMEOUT = 300
+CART_CACHE_MAX_ENTRIES = 10000
+
+# Anonymous response cache for catalog listings (products, categories,
+# sliders), same backends as the cart cache. Entries are invalidated by
+# per-model versions, the timeout only bounds memory of unused entries.
+RESPONSE_CACHE_BACKEND = 'app.cache.LocalMemoryBackend'
+RESPONSE_CACHE_TIMEOUT = 600
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+
+# Number of top rated products in the /api/home/ feed
+HOME_FEED_PRODUCTS = 12
+# Feeds are cached per scheme and host; the least recently used are dropped
+# past this many (Host headers come from the client)
+HOME_FEED_MAX_HOSTS = 8
+
 ROOT_URLCONF = 'shoppingApp.urls'
 
 TEMPLATES = [
@@ -153,6 +210,25 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing. PBKDF2 iterations are configurable; stored hashes with
+# another count are re-hashed on the next successful login. Hashes run on a
+# pool of PASSWORD_HASH_WORKERS threads with PASSWORD_HASH_QUEUE waiting
+# slots; when both are taken a request waits PASSWORD_HASH_WAIT seconds
+# and then gets a 503.
+PASSWORD_HASHERS = [
+    'app.passwords.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = 1_000_000
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_QUEUE = 16
+PASSWORD_HASH_WAIT = 2
+
+AUTHENTICATION_BACKENDS = ['app.passwords.PooledModelBackend']
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -182,6 +258,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Protected media (/api/media/...). Content-hashed file names are cached
+# for a year, others for MEDIA_CACHE_MAX_AGE seconds. Set MEDIA_SENDFILE to
+# "x-accel-redirect" (nginx, files under MEDIA_ACCEL_REDIRECT_PREFIX) or
+# "x-sendfile" to let the fronting proxy send the bytes.
+MEDIA_CACHE_MAX_AGE = 3600
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Image derivatives (app.images): uploaded product, category, slider and
+# profile images are resized to each preset (longest side in pixels) and
+# stored as WebP next to the original. Generation runs on
+# IMAGE_DERIVATIVE_WORKERS threads after commit, or inline when
+# IMAGE_DERIVATIVES_ASYNC is False.
+IMAGE_DERIVATIVE_PRESETS = {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280}
+IMAGE_WEBP_QUALITY = 80
+IMAGE_DERIVATIVES_ASYNC = True
+IMAGE_DERIVATIVE_WORKERS = 2
+
 customColorPalette = [
     {
         'color': 'hsl(4, 90%, 58%)',